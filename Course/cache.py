@@ -0,0 +1,128 @@
+import hashlib
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from lab1_pi2.cache import LRUCache
+
+
+def normalize_question(question):
+    """
+    Normalize a question so that trivial variations share the same cache entry.
+
+    Case, punctuation and repeated whitespace are ignored.
+
+    Args:
+        question (str): The question to normalize.
+
+    Returns:
+        str: The normalized question.
+    """
+    question = re.sub(r'[^\w\s]', ' ', question.casefold())
+    return ' '.join(question.split())
+
+
+def context_hash(context):
+    """
+    Get a short content hash of a course context.
+
+    Args:
+        context (str): The context of the course.
+
+    Returns:
+        str: The hash of the context.
+    """
+    return hashlib.sha256(context.encode()).hexdigest()[:16]
+
+
+class AnswerCache:
+    """
+    Cache of model answers keyed on the course context and the normalized question.
+
+    The backend is pluggable through the ANSWER_CACHE setting and must implement
+    get, set, delete, clear and stats like LRUCache.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self._course_keys = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(course_id, context, question):
+        """
+        Build the cache key of a question asked in a course.
+
+        Args:
+            course_id (int): The ID of the course.
+            context (str): The context of the course.
+            question (str): The question asked.
+
+        Returns:
+            str: The cache key.
+        """
+        question_hash = hashlib.sha256(normalize_question(question).encode()).hexdigest()[:16]
+        return f'answer:{course_id}:{context_hash(context)}:{question_hash}'
+
+    def get(self, course_id, context, question):
+        """
+        Get the cached answer of a question.
+
+        Returns:
+            str: The cached answer, or None if not found.
+        """
+        return self.backend.get(self.make_key(course_id, context, question))
+
+    def set(self, course_id, context, question, answer):
+        """
+        Store the answer of a question.
+        """
+        key = self.make_key(course_id, context, question)
+        self.backend.set(key, answer)
+        with self._lock:
+            self._course_keys[course_id].add(key)
+
+    def invalidate_course(self, course_id):
+        """
+        Remove every cached answer of a course.
+
+        Args:
+            course_id (int): The ID of the course.
+        """
+        with self._lock:
+            keys = self._course_keys.pop(course_id, set())
+        for key in keys:
+            self.backend.delete(key)
+
+    def clear(self):
+        """
+        Remove every cached answer.
+        """
+        with self._lock:
+            self._course_keys.clear()
+        self.backend.clear()
+
+    def stats(self):
+        """
+        Get the hit/miss counters of the cache.
+
+        Returns:
+            dict: The counters reported by the backend.
+        """
+        return self.backend.stats()
+
+
+def get_answer_cache():
+    """
+    Build the answer cache configured in settings.ANSWER_CACHE.
+
+    Returns:
+        AnswerCache: The configured answer cache.
+    """
+    config = getattr(settings, 'ANSWER_CACHE', {})
+    backend_class = import_string(config.get('BACKEND', 'Course.cache.LRUCache'))
+    return AnswerCache(backend_class(**config.get('OPTIONS', {})))
+
+
+answer_cache = get_answer_cache()
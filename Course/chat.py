@@ -0,0 +1,213 @@
+import logging
+
+import markdown
+from asgiref.sync import sync_to_async
+
+from .cache import answer_cache
+from .models import Course
+from .retrieval import retrieve_context
+from .semantic import semantic_cache
+from .singleflight import single_flight
+from .throttling import get_llm_limiter
+from .utils import NO_RESPONSE, ask_google_ai, ask_google_ai_async, render_markdown_stream, stream_google_ai
+
+logger = logging.getLogger(__name__)
+
+# Detail of the error event of an answer the model could not finish
+STREAM_FAILED = 'The model could not finish the answer, try again.'
+
+
+def get_cached_answer(course_id, context, question):
+    """
+    Get the answer of a question from the exact cache or, if enabled, from the semantic cache.
+
+    Args:
+        course_id (int): The ID of the course.
+        context (str): The context of the course.
+        question (str): The question to answer.
+
+    Returns:
+        str: The cached answer, or None if not found.
+    """
+    answer = answer_cache.get(course_id, context, question)
+    if answer is None and semantic_cache is not None:
+        answer = semantic_cache.get(course_id, context, question)
+        if answer is not None:
+            answer_cache.set(course_id, context, question, answer)
+    return answer
+
+
+def remember_answer(course_id, context, question, answer):
+    """
+    Store the answer given by the model in the exact and semantic caches.
+
+    Args:
+        course_id (int): The ID of the course.
+        context (str): The context of the course.
+        question (str): The question answered.
+        answer (str): The answer of the model.
+    """
+    answer_cache.set(course_id, context, question, answer)
+    if semantic_cache is not None:
+        semantic_cache.set(course_id, context, question, answer)
+
+
+def invalidate_course_answers(course_id):
+    """
+    Drop every cached answer of a course after it changes.
+
+    Args:
+        course_id (int): The ID of the course.
+    """
+    answer_cache.invalidate_course(course_id)
+    if semantic_cache is not None:
+        semantic_cache.invalidate_course(course_id)
+
+
+def generate_answer(course_id, context, question):
+    """
+    Ask the model a question, coalescing identical questions asked at the same time.
+
+    Only the first of the concurrent identical questions calls the model and
+    stores the answer, the others wait for its answer.
+
+    Args:
+        course_id (int): The ID of the course.
+        context (str): The context of the course.
+        question (str): The question to answer.
+
+    Returns:
+        str: The answer to the question.
+    """
+    def ask():
+        limiter = get_llm_limiter()
+        slot = limiter.acquire()
+        try:
+            answer = ask_google_ai(retrieve_context(course_id, question, context), question)
+        finally:
+            limiter.release(slot)
+        if answer == NO_RESPONSE:
+            return None
+        remember_answer(course_id, context, question, answer)
+        return answer
+
+    return single_flight.do(answer_cache.make_key(course_id, context, question), ask) or NO_RESPONSE
+
+
+async def agenerate_answer(course_id, context, question):
+    """
+    Asynchronous version of generate_answer.
+    """
+    async def ask():
+        prompt_context = await sync_to_async(retrieve_context)(course_id, question, context)
+        limiter = get_llm_limiter()
+        slot = await limiter.aacquire()
+        try:
+            answer = await ask_google_ai_async(prompt_context, question)
+        finally:
+            await limiter.arelease(slot)
+        if answer == NO_RESPONSE:
+            return None
+        await sync_to_async(remember_answer)(course_id, context, question, answer)
+        return answer
+
+    return await single_flight.ado(answer_cache.make_key(course_id, context, question), ask) or NO_RESPONSE
+
+
+def answer_question(course_id, question):
+    """
+    Answer a question about a course, reusing cached answers when possible.
+
+    Args:
+        course_id (int): The ID of the course.
+        question (str): The question to answer.
+
+    Returns:
+        str: The answer to the question.
+    """
+    context = Course.get_context(course_id)
+    answer = get_cached_answer(course_id, context, question)
+    if answer is None:
+        answer = generate_answer(course_id, context, question)
+    return answer
+
+
+async def aanswer_question(course_id, question):
+    """
+    Asynchronous version of answer_question.
+
+    Args:
+        course_id (int): The ID of the course.
+        question (str): The question to answer.
+
+    Returns:
+        str: The answer to the question.
+    """
+    context = await Course.aget_context(course_id)
+    answer = answer_cache.get(course_id, context, question)
+    if answer is None and semantic_cache is not None:
+        # The semantic cache may read or write the stored questions and answers
+        answer = await sync_to_async(get_cached_answer)(course_id, context, question)
+    if answer is None:
+        answer = await agenerate_answer(course_id, context, question)
+    return answer
+
+
+def stream_answer(course_id, question):
+    """
+    Answer a question about a course as a stream of events.
+
+    The slot of the model is taken before returning the stream, so that a busy
+    model is reported before the response starts. It is released when the
+    stream ends, or expires with the slot_timeout of the limiter if the stream
+    is never read.
+
+    Args:
+        course_id (int): The ID of the course.
+        question (str): The question to answer.
+
+    Returns:
+        iterator: ('chunk', data) for each rendered block of the answer, then
+        ('done', data) with the whole answer, where data is {'answer': html}.
+        If the model fails during the answer, ('error', data) with the detail
+        ends the stream instead of 'done', and the partial answer is not cached.
+
+    Raises:
+        Throttled: If too many questions are being answered.
+    """
+    context = Course.get_context(course_id)
+    answer = get_cached_answer(course_id, context, question)
+    if answer is not None:
+        return iter([('chunk', {'answer': answer}), ('done', {'answer': answer})])
+
+    limiter = get_llm_limiter()
+    slot = limiter.acquire()
+    return _stream_new_answer(course_id, context, question, limiter, slot)
+
+
+def _stream_new_answer(course_id, context, question, limiter, slot):
+    received = []
+
+    def collect(chunks):
+        for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+
+    try:
+        prompt_context = retrieve_context(course_id, question, context)
+        for html in render_markdown_stream(collect(stream_google_ai(prompt_context, question))):
+            yield 'chunk', {'answer': html}
+    except Exception:
+        logger.exception('The model stream failed')
+        yield 'error', {'detail': STREAM_FAILED}
+        return
+    finally:
+        limiter.release(slot)
+
+    text = ''.join(received)
+    if text:
+        answer = markdown.markdown(text)
+        remember_answer(course_id, context, question, answer)
+    else:
+        answer = NO_RESPONSE
+    yield 'done', {'answer': answer}
@@ -0,0 +1,60 @@
+import hashlib
+
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from lab1_pi2.cache import get_versions, tiered_cache
+
+
+def plain_data(data):
+    """
+    Copy serializer output as plain dicts and lists, without the serializer backlinks.
+    """
+    if isinstance(data, dict):
+        return {key: plain_data(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [plain_data(value) for value in data]
+    return data
+
+
+class ConditionalListMixin:
+    """
+    Mixin for list views answering If-None-Match with a 304 from the versions of their scopes,
+    and serving the payload from the two-tier cache otherwise.
+
+    The ETag depends on the versions, the user, the query string and the Accept header,
+    so it is computed with cache reads only, without the list query or the serializer.
+    Subclasses implement get_version_scopes, and set per_user to False if the list is
+    the same for every user.
+    """
+    per_user = True
+
+    def get_version_scopes(self):
+        """
+        Get the scopes whose changes modify the list.
+
+        Returns:
+            list: The scopes.
+        """
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        scopes = self.get_version_scopes()
+        versions = get_versions(scopes)
+        user = str(request.user.id) if self.per_user else ''
+        parts = versions + [user, request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+        etag = '"' + hashlib.sha1('\n'.join(parts).encode()).hexdigest() + '"'
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = tiered_cache.get_or_set(
+                f'list:{user}:{request.build_absolute_uri()}', scopes,
+                lambda: plain_data(super(ConditionalListMixin, self).list(request, *args, **kwargs).data),
+                versions=versions,
+            )
+            response = Response(data)
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,165 @@
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Course, FavoriteCourse
+
+# Columns of each export, and the field they are read from
+EXPORTS = {
+    'courses': {
+        'model': Course,
+        'columns': {
+            'id': 'id',
+            'name': 'name',
+            'instructor': 'instructor_id',
+            'instructor_email': 'instructor__email',
+            'description': 'description',
+            'context': 'context',
+            'creation_date': 'creation_date',
+            'updated_at': 'updated_at',
+            'active': 'active',
+        },
+    },
+    'favorites': {
+        'model': FavoriteCourse,
+        'columns': {
+            'id': 'id',
+            'student': 'student_id',
+            'student_email': 'student__email',
+            'course': 'course_id',
+            'course_name': 'course__name',
+            'active': 'active',
+            'updated_at': 'updated_at',
+        },
+    },
+}
+EXPORT_FORMATS = ('csv', 'json')
+
+
+class _Echo:
+    """
+    File-like object returning what is written, to get the lines of csv.writer.
+    """
+    def write(self, value):
+        return value
+
+
+def get_columns(kind, columns=None):
+    """
+    Get the columns of an export.
+
+    Args:
+        kind (str): 'courses' or 'favorites'.
+        columns (list, optional): The requested columns, all of them by default.
+
+    Returns:
+        list: The columns.
+
+    Raises:
+        ValueError: If a column does not exist.
+    """
+    available = EXPORTS[kind]['columns']
+    if not columns:
+        return list(available)
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ValueError(f'Unknown columns: {", ".join(unknown)}. Available: {", ".join(available)}.')
+    return columns
+
+
+def export_rows(kind, columns, chunk_size=2000):
+    """
+    Read the rows of an export without loading the whole table.
+
+    Args:
+        kind (str): 'courses' or 'favorites'.
+        columns (list): The columns, as given by get_columns.
+        chunk_size (int): Rows fetched from the database at once.
+
+    Returns:
+        iterator: Tuples with the values of the columns, by ID.
+    """
+    export = EXPORTS[kind]
+    fields = [export['columns'][column] for column in columns]
+    queryset = export['model'].objects.order_by('id').values_list(*fields)
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def render_csv(rows, columns):
+    """
+    Render rows as CSV lines, header first.
+
+    Yields:
+        str: The lines.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_json(rows, columns):
+    """
+    Render rows as a JSON array of objects, piece by piece.
+
+    Yields:
+        str: The pieces of the array.
+    """
+    yield '['
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+def encode(pieces, compress=False, buffer_size=65536):
+    """
+    Encode rendered pieces in UTF-8 blocks of about buffer_size bytes, gzipped if compress.
+
+    Yields:
+        bytes: The blocks.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            block = b''.join(buffer)
+            buffer, size = [], 0
+            block = compressor.compress(block) if compressor else block
+            if block:
+                yield block
+    block = b''.join(buffer)
+    if compressor:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+
+def export(kind, columns=None, file_format='csv', compress=False, chunk_size=2000):
+    """
+    Stream an export of courses or favorite courses.
+
+    Args:
+        kind (str): 'courses' or 'favorites'.
+        columns (list, optional): The columns, all of them by default.
+        file_format (str): 'csv' or 'json'.
+        compress (bool): Whether to gzip the output.
+        chunk_size (int): Rows fetched from the database at once.
+
+    Returns:
+        iterator: The blocks of the file, as bytes.
+
+    Raises:
+        ValueError: If a column does not exist.
+    """
+    columns = get_columns(kind, columns)
+    rows = export_rows(kind, columns, chunk_size)
+    render = render_json if file_format == 'json' else render_csv
+    return encode(render(rows, columns), compress)
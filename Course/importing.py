@@ -0,0 +1,183 @@
+import csv
+import json
+import os
+
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from lab1_pi2.cache import bump_versions
+from .models import Course
+from .signals import course_scopes
+from .retrieval import build_new_course_indexes
+from .serializers import BaseCourseSerializer
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+
+class CourseImportSerializer(BaseCourseSerializer):
+    """
+    Serializer for a row of a course import, the instructor is the one importing.
+    """
+    class Meta:
+        model = Course
+        fields = ['name', 'description', 'context', 'active']
+        extra_kwargs = {
+            "name": {"required": True},
+            "description": {"required": True},
+            "context": {"required": True},
+        }
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # CSV rows are decoded as strict UTF-8, which never gives surrogates, and checking
+        # every character of every context is most of the validation time. JSON can
+        # escape surrogates, so JSONL rows keep the check
+        if not self.context.get('prohibit_surrogates', True):
+            for field in fields.values():
+                field.validators = [
+                    validator for validator in field.validators
+                    if not isinstance(validator, ProhibitSurrogateCharactersValidator)
+                ]
+        return fields
+
+
+def get_import_format(filename, file_format=None):
+    """
+    Get the format of an import file, given explicitly or from its extension.
+
+    Args:
+        filename (str): The name of the file.
+        file_format (str, optional): The requested format.
+
+    Returns:
+        str: 'csv' or 'jsonl', or None if the format is not supported.
+    """
+    file_format = (file_format or os.path.splitext(filename or '')[1].lstrip('.')).lower()
+    if file_format in ('json', 'ndjson'):
+        file_format = 'jsonl'
+    return file_format if file_format in IMPORT_FORMATS else None
+
+
+def read_rows(lines, file_format):
+    """
+    Read the rows of an import file one by one.
+
+    Args:
+        lines (iterable): The lines of the file, as bytes.
+        file_format (str): 'csv' or 'jsonl'.
+
+    Yields:
+        tuple: The row number and the row as a dict, or None if the row can not be parsed
+        or is not UTF-8 encoded.
+    """
+    undecodable = []
+
+    def decode(lines):
+        for number, line in enumerate(lines, start=1):
+            try:
+                yield line.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                undecodable.append(number)
+
+    if file_format == 'csv':
+        reader = csv.DictReader(decode(lines))
+        skipped = 0
+        for row in reader:
+            # The lines skipped before this row are not counted by the reader
+            for number in undecodable:
+                yield number, None
+            skipped += len(undecodable)
+            undecodable.clear()
+            yield reader.line_num + skipped, row
+        for number in undecodable:
+            yield number, None
+        return
+    for number, line in enumerate(lines, start=1):
+        try:
+            line = line.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            yield number, None
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+class CourseImporter:
+    """
+    Create the courses of an import file for an instructor, in batches.
+
+    Only the current batch is kept in memory, and at most max_errors row errors
+    are reported, so memory stays flat whatever the size of the file.
+    """
+    def __init__(self, instructor, file_format='jsonl', batch_size=1000, max_errors=1000):
+        """
+        Args:
+            instructor (User): The instructor of the imported courses.
+            file_format (str): 'csv' or 'jsonl', the format of the rows.
+            batch_size (int): Courses per bulk_create.
+            max_errors (int): Maximum row errors reported.
+        """
+        self.instructor = instructor
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.serializer = CourseImportSerializer(context={'prohibit_surrogates': file_format != 'csv'})
+
+    def run(self, rows):
+        """
+        Validate and create the courses of the rows.
+
+        Args:
+            rows (iterable): Tuples of row number and row, as given by read_rows.
+
+        Returns:
+            dict: The number of created courses, the number of invalid rows and the row errors.
+
+        Raises:
+            serializers.ValidationError: If the user is not a professor.
+        """
+        self.serializer.validate_instructor(self.instructor)
+        report = {'created': 0, 'error_count': 0, 'errors': []}
+        batch = []
+        for number, row in rows:
+            if row is None:
+                self.add_error(report, number, {'non_field_errors': ['The row could not be read.']})
+                continue
+            try:
+                data = self.serializer.run_validation(row)
+            except serializers.ValidationError as e:
+                self.add_error(report, number, e.detail)
+                continue
+            course = Course(instructor=self.instructor, **data)
+            course.update_prompt_metadata()
+            batch.append(course)
+            if len(batch) >= self.batch_size:
+                report['created'] += self.save(batch)
+                batch = []
+        if batch:
+            report['created'] += self.save(batch)
+        return report
+
+    def add_error(self, report, number, detail):
+        report['error_count'] += 1
+        if len(report['errors']) < self.max_errors:
+            report['errors'].append({'row': number, 'errors': detail})
+
+    def save(self, batch):
+        """
+        Create a batch of courses with their chunks.
+
+        Returns:
+            int: The number of created courses.
+        """
+        with transaction.atomic():
+            courses = Course.objects.bulk_create(batch)
+            build_new_course_indexes(courses)
+        # bulk_create sends no signals
+        bump_versions(*course_scopes(self.instructor.pk), *(f'course:{course.pk}' for course in courses))
+        return len(courses)
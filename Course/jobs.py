@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from .chat import answer_question
+from .models import ChatJob, Course
+from .utils import NO_RESPONSE
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_question(course_id, student, question):
+    """
+    Create a job to answer a question and wake up the chat workers.
+
+    The priority of the job is the one of its course in settings.CHAT_JOBS['COURSE_PRIORITY'].
+
+    Args:
+        course_id (int): The ID of the course.
+        student (User): The student asking the question, or the TokenClaimsUser built from their token.
+        question (str): The question to answer.
+
+    Returns:
+        ChatJob: The created job.
+
+    Raises:
+        Http404: If the course does not exist.
+    """
+    get_object_or_404(Course.objects.only('id'), pk=course_id)
+    priority = settings.CHAT_JOBS['COURSE_PRIORITY'].get(course_id, 0)
+    job = ChatJob.objects.create(course_id=course_id, student_id=student.id, question=question, priority=priority)
+    if settings.CHAT_JOBS['RUN_IN_PROCESS']:
+        get_worker_pool().notify()
+    return job
+
+
+def claim_next_job():
+    """
+    Take the pending job with the highest priority, oldest first, among the ones not postponed.
+
+    The job is claimed with a conditional UPDATE, so that two workers never
+    take the same job, on any database.
+
+    Returns:
+        ChatJob: The claimed job, or None if there are no pending jobs.
+    """
+    now = timezone.now()
+    candidates = ChatJob.objects.filter(Q(not_before__isnull=True) | Q(not_before__lte=now), status='pending').order_by('-priority', 'creation_date')
+    for job_id in candidates.values_list('id', flat=True)[:10]:
+        if ChatJob.objects.filter(pk=job_id, status='pending').update(status='running', start_date=now):
+            return ChatJob.objects.get(pk=job_id)
+    return None
+
+
+def requeue_stale_jobs():
+    """
+    Put back in the queue the running jobs whose worker stopped without finishing them.
+
+    Returns:
+        int: The number of requeued jobs.
+    """
+    limit = timezone.now() - timedelta(seconds=settings.CHAT_JOBS['JOB_TIMEOUT'])
+    return ChatJob.objects.filter(status='running', start_date__lt=limit).update(status='pending', start_date=None)
+
+
+def process_next_job():
+    """
+    Answer the next pending job.
+
+    If the model is busy (too many questions at once) the job goes back to the queue,
+    postponed by the wait of the Throttled exception, so that the workers do not take it
+    again right away.
+
+    Returns:
+        bool: True if a job was taken, False if the queue was empty.
+    """
+    job = claim_next_job()
+    if job is None:
+        return False
+    try:
+        answer = answer_question(job.course_id, job.question)
+    except Throttled as e:
+        wait = e.wait or settings.CHAT_JOBS['POLL_INTERVAL']
+        not_before = timezone.now() + timedelta(seconds=wait)
+        ChatJob.objects.filter(pk=job.pk).update(status='pending', start_date=None, not_before=not_before)
+        return True
+    except Exception:
+        logger.exception('Could not answer the chat job %s', job.pk)
+        answer = NO_RESPONSE
+    job.answer = answer
+    job.status = 'failed' if answer == NO_RESPONSE else 'done'
+    job.finish_date = timezone.now()
+    job.save(update_fields=['answer', 'status', 'finish_date'])
+    return True
+
+
+def wait_for_job(job, timeout):
+    """
+    Wait until a job is finished or timeout seconds have passed.
+
+    Args:
+        job (ChatJob): The job.
+        timeout (float): Maximum seconds to wait.
+
+    Returns:
+        ChatJob: The job with its last status.
+    """
+    deadline = time.monotonic() + timeout
+    while job.status in ('pending', 'running') and time.monotonic() < deadline:
+        time.sleep(min(settings.CHAT_JOBS['POLL_INTERVAL'], max(deadline - time.monotonic(), 0)))
+        job.refresh_from_db(fields=['status', 'answer', 'finish_date'])
+    return job
+
+
+class ChatJobWorkerPool:
+    """
+    Pool of threads answering the pending chat jobs.
+    """
+    def __init__(self, size, poll_interval):
+        """
+        Args:
+            size (int): Number of worker threads.
+            poll_interval (float): Seconds between checks of the queue when it is empty,
+                to take the jobs created by other processes.
+        """
+        self.size = size
+        self.poll_interval = poll_interval
+        self._wake_up = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        for index in range(self.size):
+            thread = threading.Thread(target=self.run, name=f'chat-job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """
+        Wake up the workers waiting for jobs.
+        """
+        self._wake_up.set()
+
+    def stop(self):
+        """
+        Stop the workers once they finish their current job.
+        """
+        self._stop.set()
+        self._wake_up.set()
+        for thread in self._threads:
+            thread.join()
+
+    def run(self):
+        """
+        Answer jobs until the pool is stopped.
+        """
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                requeue_stale_jobs()
+                while not self._stop.is_set() and process_next_job():
+                    pass
+            except Exception:
+                logger.exception('The chat job worker failed')
+            self._wake_up.wait(self.poll_interval)
+            self._wake_up.clear()
+        close_old_connections()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """
+    Get the worker pool of this process, started on first use with settings.CHAT_JOBS.
+
+    Returns:
+        ChatJobWorkerPool: The started pool.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = settings.CHAT_JOBS
+                _pool = ChatJobWorkerPool(config['WORKERS'], config['POLL_INTERVAL'])
+                _pool.start()
+    return _pool
@@ -0,0 +1,121 @@
+import asyncio
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from Course.cache import answer_cache
+from Course.models import Course
+from Course.views import Chat, chat_async
+from Users.models import User
+
+
+class Command(BaseCommand):
+    """
+    Compare the concurrent-request capacity of the sync and async chat paths
+    against the local StubProvider with a fixed latency.
+
+    With --limit, --queue-size and --queue-timeout the concurrency limiter of the
+    model is enabled, to check that latency stays bounded under overload and the
+    excess requests are rejected quickly with 429.
+    """
+    help = 'Benchmark the sync (Chat) and async (chat_async) chat endpoints against a stub LLM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Concurrent questions sent to each path.')
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds the stub LLM takes to answer.')
+        parser.add_argument('--workers', type=int, default=4, help='Sync workers, like gunicorn sync workers.')
+        parser.add_argument('--limit', type=int, default=100000, help='Calls to the model running at once.')
+        parser.add_argument('--queue-size', type=int, default=0, help='Calls waiting for a free slot.')
+        parser.add_argument('--queue-timeout', type=float, default=10, help='Seconds a call waits for a free slot.')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        instructor = User.objects.create_user(
+            email=f'bench-instructor-{suffix}@example.com', password=suffix,
+            first_name='bench', last_name='instructor', rol='Profesor'
+        )
+        student = User.objects.create_user(
+            email=f'bench-student-{suffix}@example.com', password=suffix,
+            first_name='bench', last_name='student', rol='Estudiante'
+        )
+        course = Course.objects.create(
+            name='Benchmark course', instructor=instructor,
+            description='Benchmark course', context='Variables, loops and functions.'
+        )
+        try:
+            self.token = str(AccessToken.for_user(student))
+            self.factory = RequestFactory()
+            self.url = f'/course/student/{course.pk}/chat'
+            self.pk = course.pk
+            stub = {'BACKEND': 'Course.utils.StubProvider', 'OPTIONS': {'latency': options['latency']}}
+            limits = {
+                'USER': {'RATE': 1000, 'BURST': options['requests']},
+                'COURSE': {'RATE': 1000, 'BURST': options['requests']},
+                'CONCURRENCY': {
+                    'LIMIT': options['limit'],
+                    'QUEUE_SIZE': options['queue_size'],
+                    'QUEUE_TIMEOUT': options['queue_timeout'],
+                },
+            }
+            cache.clear()
+            with override_settings(LLM_PROVIDER=stub, CHAT_LIMITS=limits):
+                self.run_sync(options)
+                self.run_async(options)
+        finally:
+            instructor.delete()
+            student.delete()
+
+    def build_request(self, index):
+        return self.factory.post(
+            self.url, {'content': f'benchmark question {index}'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+
+    def run_sync(self, options):
+        view = Chat.as_view()
+
+        def send(index):
+            response = view(self.build_request(index), pk=self.pk).render()
+            connection.close()
+            return response.status_code, time.perf_counter() - start
+
+        answer_cache.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(send, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+        self.report(f'sync ({options["workers"]} workers)', results, elapsed)
+
+    def run_async(self, options):
+        async def send(index):
+            response = await chat_async(self.build_request(index), self.pk)
+            return response.status_code, time.perf_counter() - start
+
+        async def send_all():
+            return await asyncio.gather(*(send(index) for index in range(options['requests'])))
+
+        answer_cache.clear()
+        start = time.perf_counter()
+        results = asyncio.run(send_all())
+        elapsed = time.perf_counter() - start
+        self.report('async (1 worker)', results, elapsed)
+
+    def report(self, label, results, elapsed):
+        # Latencies are measured from the moment every request was sent, so queueing counts
+        answered = sorted(latency for status, latency in results if status == 200)
+        rejected = sorted(latency for status, latency in results if status == 429)
+        line = f'{label:<20} {len(answered) / elapsed:8.1f} answers/s   total {elapsed:6.2f} s'
+        if answered:
+            p95 = answered[max(int(len(answered) * 0.95) - 1, 0)]
+            line += (f'   p50 {statistics.median(answered) * 1000:7.0f} ms   p95 {p95 * 1000:7.0f} ms'
+                     f'   max {answered[-1] * 1000:7.0f} ms')
+        if rejected:
+            line += f'   429: {len(rejected)} (max {rejected[-1] * 1000:.0f} ms)'
+        self.stdout.write(line)
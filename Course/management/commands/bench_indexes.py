@@ -0,0 +1,94 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from Course.models import Course, FavoriteCourse
+from Users.models import User
+
+
+class Command(BaseCommand):
+    """
+    Show the plans and timings of the course and favorite lookups over a large fixture.
+    """
+    help = 'EXPLAIN and time the list and favorite queries, and the favorite upsert, over a large fixture.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000, help='Courses in the fixture.')
+        parser.add_argument('--instructors', type=int, default=100)
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--favorites', type=int, default=50, help='Favorite courses per student.')
+        parser.add_argument('--repeat', type=int, default=20, help='Times each query is run.')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        User.objects.bulk_create(
+            [
+                User(email=f'bench-instructor-{i}-{suffix}@example.com', first_name='bench', last_name='instructor', rol='Profesor')
+                for i in range(options['instructors'])
+            ] + [
+                User(email=f'bench-student-{i}-{suffix}@example.com', first_name='bench', last_name='student', rol='Estudiante')
+                for i in range(options['students'])
+            ]
+        )
+        users = list(User.objects.filter(email__endswith=f'-{suffix}@example.com').order_by('id'))
+        instructors, students = users[:options['instructors']], users[options['instructors']:]
+        try:
+            self.create_fixture(instructors, students, options)
+            self.run(instructors[1], students[0], options['repeat'])
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def create_fixture(self, instructors, students, options):
+        start = time.perf_counter()
+        count = options['courses']
+        for offset in range(0, count, 5000):
+            Course.objects.bulk_create(
+                Course(
+                    name=f'Course {index:07d}', instructor=instructors[index % len(instructors)],
+                    description='Benchmark course', context='Benchmark context', active=index % 10 != 0
+                )
+                for index in range(offset, min(offset + 5000, count))
+            )
+        course_ids = list(Course.objects.filter(instructor__in=instructors).values_list('id', flat=True))
+        favorites = [
+            FavoriteCourse(student=student, course_id=course_ids[(index * 7919 + position) % len(course_ids)], active=position % 5 != 0)
+            for index, student in enumerate(students)
+            for position in range(options['favorites'])
+        ]
+        for offset in range(0, len(favorites), 5000):
+            FavoriteCourse.objects.bulk_create(favorites[offset:offset + 5000], ignore_conflicts=True)
+        self.stdout.write(f'fixture: {count} courses, {len(favorites)} favorites in {time.perf_counter() - start:.1f} s')
+
+    def run(self, instructor, student, repeat):
+        course = Course.objects.filter(active=True).exclude(favoritecourse__student=student).first()
+        queries = {
+            'List': Course.objects.filter(active=True).order_by('name', 'id')[:50],
+            'ListOwnCourse': Course.objects.filter(instructor__id=instructor.id, active=True),
+            'ListFavoriteCourseView': FavoriteCourse.objects.filter(
+                student=student, course__active=True, active=True
+            ).select_related('course__instructor'),
+            'FavoriteCourse.exists': FavoriteCourse.objects.filter(student=student, course=course),
+        }
+
+        def timed(func):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            return (time.perf_counter() - start) / repeat * 1000
+
+        for name, queryset in queries.items():
+            self.stdout.write(f'{name}: {timed(lambda: list(queryset.all())):.2f} ms')
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f'    {line}')
+
+        def exists_filter_save():
+            if not FavoriteCourse.objects.filter(student=student, course=course).exists():
+                FavoriteCourse.objects.create(student=student, course=course)
+            else:
+                favorite = FavoriteCourse.objects.filter(student=student, course=course).first()
+                favorite.active = True
+                favorite.save()
+
+        self.stdout.write(f'exists/filter/save: {timed(exists_filter_save):.2f} ms')
+        self.stdout.write(f'upsert:             {timed(lambda: FavoriteCourse.create(student=student, course=course)):.2f} ms')
@@ -0,0 +1,80 @@
+import random
+import string
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from Course.models import Course
+from Course.pagination import CoursePagination
+from Users.models import User
+
+
+class Command(BaseCommand):
+    """
+    Compare keyset (cursor) and offset pagination of the course list on a large catalog.
+    """
+    help = 'Benchmark keyset against offset pagination of the active courses over a large fixture.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000, help='Courses in the fixture.')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--pages', type=int, default=500, help='Page compared with the first one.')
+        parser.add_argument('--repeat', type=int, default=5, help='Times each page is read.')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        instructor = User.objects.create_user(
+            email=f'bench-instructor-{suffix}@example.com', password=suffix,
+            first_name='bench', last_name='instructor', rol='Profesor'
+        )
+        try:
+            self.create_fixture(instructor, options['courses'])
+            self.run(options)
+        finally:
+            instructor.delete()
+
+    def create_fixture(self, instructor, count):
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for offset in range(0, count, 5000):
+            Course.objects.bulk_create(
+                Course(
+                    name=''.join(rng.choices(string.ascii_lowercase, k=8)), instructor=instructor,
+                    description='Benchmark course', context='Benchmark context'
+                )
+                for _ in range(min(5000, count - offset))
+            )
+        self.stdout.write(f'fixture: {count} courses in {time.perf_counter() - start:.1f} s')
+
+    def run(self, options):
+        page_size, pages, repeat = options['page_size'], options['pages'], options['repeat']
+        queryset = Course.objects.filter(active=True)
+        factory = APIRequestFactory()
+
+        def keyset_page(cursor):
+            params = {'page_size': page_size}
+            if cursor:
+                params['cursor'] = cursor
+            paginator = CoursePagination()
+            rows = paginator.paginate_queryset(queryset, Request(factory.get('/course/student/list', params)))
+            return rows, paginator.next_cursor
+
+        def timed(func):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            return (time.perf_counter() - start) / repeat * 1000
+
+        cursor = None
+        for _ in range(pages - 1):
+            _, cursor = keyset_page(cursor)
+        ordered = queryset.order_by('name', 'id')
+        offset = (pages - 1) * page_size
+
+        self.stdout.write(f'keyset  page 1   {timed(lambda: keyset_page(None)):8.2f} ms')
+        self.stdout.write(f'keyset  page {pages} {timed(lambda: keyset_page(cursor)):8.2f} ms')
+        self.stdout.write(f'offset  page 1   {timed(lambda: list(ordered[:page_size])):8.2f} ms')
+        self.stdout.write(f'offset  page {pages} {timed(lambda: list(ordered[offset:offset + page_size])):8.2f} ms')
@@ -0,0 +1,95 @@
+import itertools
+import random
+import string
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from Course.models import Course
+from Course.search import CourseSearchResults, typeahead_courses
+from Users.models import User
+
+
+class Command(BaseCommand):
+    """
+    Time the full-text search and the typeahead of courses on a large catalog.
+    """
+    help = 'Benchmark the ranked course search and typeahead against icontains over a large fixture.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000, help='Courses in the fixture.')
+        parser.add_argument('--words', type=int, default=5000, help='Distinct words of the fixture.')
+        parser.add_argument('--context-words', type=int, default=60, help='Words of each context.')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20, help='Times each search is run.')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        instructor = User.objects.create_user(
+            email=f'bench-instructor-{suffix}@example.com', password=suffix,
+            first_name='bench', last_name='instructor', rol='Profesor'
+        )
+        try:
+            vocabulary = self.create_fixture(instructor, options)
+            self.run(vocabulary, options)
+        finally:
+            instructor.delete()
+
+    def create_fixture(self, instructor, options):
+        rng = random.Random(0)
+        vocabulary = sorted({''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(options['words'])})
+        rng.shuffle(vocabulary)
+        # Zipf-like frequencies: the first words of the vocabulary are the common ones
+        weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+        def words(count):
+            return ' '.join(rng.choices(vocabulary, cum_weights=weights, k=count))
+
+        start = time.perf_counter()
+        count = options['courses']
+        for offset in range(0, count, 5000):
+            Course.objects.bulk_create(
+                Course(
+                    name=words(3).title(), instructor=instructor, description=words(8),
+                    context=words(options['context_words']), active=index % 10 != 0
+                )
+                for index in range(offset, min(offset + 5000, count))
+            )
+        self.stdout.write(f'fixture: {count} courses in {time.perf_counter() - start:.1f} s (indexed by the triggers)')
+        return vocabulary
+
+    def run(self, vocabulary, options):
+        page_size, repeat = options['page_size'], options['repeat']
+        common, medium, rare = vocabulary[0], vocabulary[50], vocabulary[-1]
+
+        def timed(func):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            return (time.perf_counter() - start) / repeat * 1000
+
+        def search(text, page=1):
+            offset = (page - 1) * page_size
+            return CourseSearchResults(text)[offset:offset + page_size + 1]
+
+        def icontains(text):
+            queryset = Course.objects.filter(active=True)
+            for term in text.split():
+                queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term) | Q(context__icontains=term))
+            return list(queryset.order_by('name', 'id')[:page_size + 1])
+
+        searches = {
+            f'common word ({common})': common,
+            f'medium word ({medium})': medium,
+            f'rare word ({rare})': rare,
+            f'two words ({medium} {rare})': f'{medium} {rare}',
+        }
+        for label, text in searches.items():
+            self.stdout.write(
+                f'search {label}: {timed(lambda: search(text)):.2f} ms, page 5 {timed(lambda: search(text, 5)):.2f} ms, '
+                f'icontains {timed(lambda: icontains(text)):.2f} ms'
+            )
+        for prefix in (common[:2], medium[:3], rare[:4], f'{common[:3]} {medium[:3]}'):
+            self.stdout.write(f'typeahead "{prefix}": {timed(lambda: typeahead_courses(prefix)):.2f} ms')
@@ -0,0 +1,75 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from Course.semantic import CourseVectorIndex, HashingVectorizer
+
+TEMPLATES = [
+    'what is {}?',
+    "what's {}",
+    'explain {} please',
+    'can you explain {} to me?',
+    'how does {} work?',
+    'qué es {}?',
+]
+SYLLABLES = ['ra', 'ko', 'mi', 'tel', 'son', 'var', 'lo', 'pe', 'gun', 'dri', 'fa', 'zen', 'qui', 'bor']
+
+
+class Command(BaseCommand):
+    """
+    Measure hit rate and lookup cost of the semantic cache for a course with many cached questions.
+    """
+    help = 'Benchmark the semantic answer cache: hit rate and lookup cost per 10k cached questions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cached', type=int, default=10000, help='Questions cached in the course index.')
+        parser.add_argument('--lookups', type=int, default=2000, help='Questions looked up.')
+        parser.add_argument('--threshold', type=float, default=0.85, help='Minimum cosine similarity of a hit.')
+        parser.add_argument('--dimensions', type=int, default=1024, help='Size of the question vectors.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        topics = set()
+        while len(topics) < options['cached'] + options['lookups']:
+            topics.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+        topics = list(topics)
+        cached_topics = topics[:options['cached']]
+        new_topics = topics[options['cached']:]
+
+        vectorizer = HashingVectorizer(options['dimensions'])
+        index = CourseVectorIndex(options['dimensions'], options['cached'])
+        start = time.perf_counter()
+        for topic in cached_topics:
+            index.add(vectorizer.transform(TEMPLATES[0].format(topic)), topic)
+        build = time.perf_counter() - start
+
+        # Half of the lookups paraphrase a cached question, the other half ask about something new
+        lookups = []
+        for i in range(options['lookups']):
+            template = rng.choice(TEMPLATES[1:])
+            if i % 2:
+                lookups.append((template.format(rng.choice(cached_topics)), True))
+            else:
+                lookups.append((template.format(new_topics[i]), False))
+
+        hits = false_hits = 0
+        start = time.perf_counter()
+        for question, paraphrase in lookups:
+            score, answer = index.search(vectorizer.transform(question))
+            if score >= options['threshold']:
+                if paraphrase and answer in question:
+                    hits += 1
+                else:
+                    false_hits += 1
+        elapsed = time.perf_counter() - start
+
+        per_10k = options['cached'] / 10000
+        paraphrases = sum(1 for _, paraphrase in lookups if paraphrase)
+        self.stdout.write(f'cached questions      {options["cached"]}')
+        self.stdout.write(f'index build           {build * 1000:.0f} ms')
+        self.stdout.write(f'paraphrase hit rate   {hits / paraphrases:.1%}')
+        self.stdout.write(f'false hit rate        {false_hits / len(lookups):.1%}')
+        self.stdout.write(f'lookup cost           {elapsed / len(lookups) * 1e6:.0f} us '
+                          f'({elapsed / len(lookups) * 1e6 / per_10k:.0f} us per 10k cached)')
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+
+from Course.models import FavoriteCourse
+
+
+class Command(BaseCommand):
+    """
+    Merge the repeated favorites of a student and a course, which must be done before
+    adding the unique_favorite_course constraint to a database created without it.
+
+    The oldest row of each pair is kept, active if any of the repeated rows was active,
+    as the list of favorites showed the course in that case. Only the columns of the
+    table before the migration are used, so the command runs before migrate.
+    """
+    help = 'Delete the repeated favorites of each student and course, run it before migrate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the repeated favorites.')
+
+    def handle(self, *args, **options):
+        pairs = (
+            FavoriteCourse.objects.values('student_id', 'course_id')
+            .annotate(count=Count('id')).filter(count__gt=1).order_by()
+        )
+        removed = 0
+        with transaction.atomic():
+            for pair in list(pairs):
+                rows = list(
+                    FavoriteCourse.objects.filter(student_id=pair['student_id'], course_id=pair['course_id'])
+                    .order_by('id').values_list('id', 'active')
+                )
+                keep, *repeated = [row_id for row_id, _ in rows]
+                removed += len(repeated)
+                if options['dry_run']:
+                    continue
+                FavoriteCourse.objects.filter(pk=keep).update(active=any(active for _, active in rows))
+                # Raw DELETE, the post_delete receivers would load columns missing before the migration
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'DELETE FROM {connection.ops.quote_name(FavoriteCourse._meta.db_table)} '
+                        f'WHERE id IN ({", ".join(["%s"] * len(repeated))})',
+                        repeated
+                    )
+        action = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(f'{removed} repeated favorites {action}.')
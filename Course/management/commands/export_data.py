@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Course.exporting import EXPORT_FORMATS, EXPORTS, export
+
+
+class Command(BaseCommand):
+    """
+    Export every course or favorite course as CSV or JSON, streaming the rows.
+    """
+    help = 'Write all the courses or favorite courses to a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--output', choices=EXPORT_FORMATS, default='csv', help='Format of the file.')
+        parser.add_argument('--columns', default='', help='Comma separated columns, all by default.')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the file.')
+        parser.add_argument('--file', help='The file to write, the standard output by default.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at once.')
+
+    def handle(self, *args, **options):
+        columns = [column for column in options['columns'].split(',') if column]
+        try:
+            blocks = export(options['kind'], columns, options['output'], options['gzip'], options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(e)
+        if options['file']:
+            with open(options['file'], 'wb') as file:
+                for block in blocks:
+                    file.write(block)
+        else:
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.flush()
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+
+from Course.importing import CourseImporter, get_import_format, read_rows
+from Users.models import User
+
+
+class Command(BaseCommand):
+    """
+    Import the courses of a CSV or JSONL file for an instructor.
+    """
+    help = 'Create the courses of a CSV or JSONL file (columns name, description, context, active).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The file to import.')
+        parser.add_argument('--instructor', required=True, help='Email of the instructor of the courses.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Format of the file, by default from its extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Courses per INSERT.')
+
+    def handle(self, *args, **options):
+        file_format = get_import_format(options['path'], options['format'])
+        if file_format is None:
+            raise CommandError('The format must be csv or jsonl.')
+        instructor = User.objects.filter(email=options['instructor']).first()
+        if instructor is None:
+            raise CommandError('User does not exist.')
+
+        start = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as file:
+                report = CourseImporter(instructor, file_format, batch_size=options['batch_size']).run(read_rows(file, file_format))
+        except serializers.ValidationError as e:
+            raise CommandError(e.detail[0])
+        for error in report['errors']:
+            self.stderr.write(f'row {error["row"]}: {error["errors"]}')
+        self.stdout.write(
+            f'{report["created"]} courses created, {report["error_count"]} invalid rows '
+            f'in {time.perf_counter() - start:.1f} s'
+        )
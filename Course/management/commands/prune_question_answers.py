@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from Course.semantic import prune_question_answers
+
+
+class Command(BaseCommand):
+    """
+    Delete the stored questions and answers the semantic cache no longer uses, run it periodically.
+    """
+    help = 'Delete the answered questions older than SEMANTIC_CACHE MAX_AGE, of old contexts or past MAX_SIZE per course.'
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'SEMANTIC_CACHE', {})
+        parser.add_argument('--max-age', type=int, default=config.get('MAX_AGE'), help='Seconds a row is kept.')
+        parser.add_argument('--max-size', type=int, default=config.get('MAX_SIZE', 1000), help='Rows kept per course.')
+
+    def handle(self, *args, **options):
+        deleted = prune_question_answers(options['max_age'], max(options['max_size'], 1))
+        self.stdout.write(f'{deleted} questions and answers deleted.')
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from Course.jobs import ChatJobWorkerPool
+
+
+class Command(BaseCommand):
+    """
+    Run a pool of chat workers answering the queued questions, apart from the web workers.
+    """
+    help = 'Answer the questions queued with ?mode=job until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.CHAT_JOBS['WORKERS'], help='Worker threads.')
+
+    def handle(self, *args, **options):
+        pool = ChatJobWorkerPool(options['workers'], settings.CHAT_JOBS['POLL_INTERVAL'])
+        pool.start()
+        self.stdout.write(f'Answering chat jobs with {options["workers"]} workers, press CTRL-C to stop.')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping the workers...')
+            pool.stop()
@@ -1,4 +1,10 @@
-from django.db import models
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, models
+from django.utils import timezone
+from lab1_pi2.cache import LRUCache, bump_versions_on_commit, get_versions
 from Users.models import User
 
 
@@ -6,6 +12,9 @@ def validate_context(value):
     """
     Validate the context of a course.
 
+    The context is split in chunks and only the relevant ones are sent to the
+    model, so it can be as long as settings.COURSE_CONTEXT_MAX_WORDS.
+
     Args:
         value (str): The context to validate.
 
@@ -13,7 +22,18 @@ def validate_context(value):
         bool: True if the context is valid, False otherwise.
     """
     words = value.split()
-    return len(words) <= 130
+    return len(words) <= settings.COURSE_CONTEXT_MAX_WORDS
+
+
+# Prompt prefix of a course and its metadata, see Course.get_prompt
+CoursePrompt = namedtuple('CoursePrompt', ['prefix', 'words', 'chunks'])
+
+prompt_cache = LRUCache(
+    max_size=getattr(settings, 'PROMPT_CACHE', {}).get('MAX_SIZE', 256),
+    # The entries are (version, prompt), weighed by the characters of the prefix
+    max_weight=getattr(settings, 'PROMPT_CACHE', {}).get('MAX_CHARS', 64 * 1024 * 1024),
+    weigh=lambda entry: len(entry[1].prefix),
+)
 
 
 class Course(models.Model):
@@ -27,10 +47,18 @@ class Course(models.Model):
         verbose_name="Write the topics, context, and a large description for your course",
     )
     creation_date = models.DateTimeField(auto_now_add=True, verbose_name="Creation date")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Last update")
     active = models.BooleanField(null=False, default=True)
+    context_words = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # List: active courses by name (and the keyset pagination on name, id)
+            models.Index(fields=['name', 'id'], condition=models.Q(active=True), name='course_active_name_idx'),
+            # ListOwnCourse: active courses of an instructor
+            models.Index(fields=['instructor', 'name'], condition=models.Q(active=True), name='course_instructor_active_idx'),
+        ]
 
     @staticmethod
     def get_by_id(course_id):
@@ -45,6 +73,55 @@ class Course(models.Model):
         """
         return Course.objects.filter(pk=course_id).first()
 
+    def save(self, *args, **kwargs):
+        """
+        Save the course, precomputing the metadata of its prompt.
+        """
+        self.update_prompt_metadata()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'context' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'context_words'}
+        super().save(*args, **kwargs)
+
+    def update_prompt_metadata(self):
+        """
+        Compute the metadata of the prompt of the course, also for courses created with bulk_create.
+        """
+        self.context_words = len(self.context.split())
+
+    @staticmethod
+    def get_prompt(course_id):
+        """
+        Get the prompt prefix ("name: context") of a course and its metadata.
+
+        They are kept in the prompt cache of this process, checked against the version
+        of the course in the shared cache, so a warm worker does no database work and
+        a course saved in any worker is read again.
+
+        Args:
+            course_id (int): The ID of the course.
+
+        Returns:
+            CoursePrompt: The prefix, words and chunks of the course, or None if not found.
+        """
+        version = get_versions([f'course:{course_id}'])[0]
+        entry = prompt_cache.get(course_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        row = Course.objects.filter(pk=course_id).values_list('name', 'context', 'context_words').first()
+        if row is None:
+            return None
+        name, context, words = row
+        # A context shorter than a chunk is a single chunk, no need to count them
+        if words > settings.COURSE_RETRIEVAL['CHUNK_WORDS']:
+            chunks = CourseChunk.objects.filter(course_id=course_id).count()
+        else:
+            chunks = 1 if words else 0
+        prompt = CoursePrompt(f'{name}: {context}', words, chunks)
+        prompt_cache.set(course_id, (version, prompt))
+        return prompt
+
     @staticmethod
     def get_context(course_id):
         """
@@ -56,11 +133,24 @@ class Course(models.Model):
         Returns:
             str: The context of the course.
         """
-        course = Course.get_by_id(course_id)
-        if course is None:
+        prompt = Course.get_prompt(course_id)
+        if prompt is None:
             return "Without context"
         else:
-            return f'{course.name}: {course.context}'
+            return prompt.prefix
+
+    @staticmethod
+    async def aget_context(course_id):
+        """
+        Asynchronous version of get_context.
+
+        Args:
+            course_id (int): The ID of the course.
+
+        Returns:
+            str: The context of the course.
+        """
+        return await sync_to_async(Course.get_context)(course_id)
 
     @staticmethod
     def create(name, description, context):
@@ -88,12 +178,25 @@ class FavoriteCourse(models.Model):
     student = models.ForeignKey(User, on_delete=models.CASCADE, blank=False, null=False)
     course = models.ForeignKey(Course, on_delete=models.CASCADE, blank=False, null=False)
     active = models.BooleanField(default=True, null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'course'], name='unique_favorite_course'),
+        ]
+        indexes = [
+            # ListFavoriteCourseView: active favorites of a student
+            models.Index(fields=['student'], condition=models.Q(active=True), name='favorite_student_active_idx'),
+        ]
 
     @staticmethod
     def create(student: User, course: Course, active=True):
         """
         Create a new FavoriteCourse entry or reactivate an existing one.
 
+        Done in a single INSERT ... ON CONFLICT statement on the unique (student, course)
+        constraint, so concurrent requests never create duplicates.
+
         Args:
             student (User): The student marking the course as favorite.
             course (Course): The course being marked as favorite.
@@ -102,13 +205,43 @@ class FavoriteCourse(models.Model):
         Returns:
             FavoriteCourse: The created or reactivated FavoriteCourse instance.
         """
-        if not FavoriteCourse.exists(student=student, course=course):
-            return FavoriteCourse.objects.create(student=student, course=course, active=active)
-        else:
-            favorite_course = FavoriteCourse.objects.filter(student=student, course=course).first()
-            favorite_course.active = True
-            favorite_course.save()
-            return favorite_course
+        favorite_id = FavoriteCourse.upsert(student, [course.pk], active)[0]
+        return FavoriteCourse(id=favorite_id, student=student, course=course, active=active)
+
+    @staticmethod
+    def upsert(student: User, course_ids, active=True):
+        """
+        Create or update the FavoriteCourse entries of a student for many courses in one statement.
+
+        Signals are not sent, the favorites list version of the student is bumped here.
+
+        Args:
+            student (User): The student.
+            course_ids (list): The IDs of the courses, which must exist.
+            active (bool): The status of the entries.
+
+        Returns:
+            list: The IDs of the entries, in no particular order.
+        """
+        if not course_ids:
+            return []
+        quote = connection.ops.quote_name
+        updated_at = FavoriteCourse._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+        values = ', '.join(['(%s, %s, %s, %s)'] * len(course_ids))
+        params = [value for course_id in course_ids for value in (student.pk, course_id, active, updated_at)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(FavoriteCourse._meta.db_table)} '
+                f'({quote("student_id")}, {quote("course_id")}, {quote("active")}, {quote("updated_at")}) '
+                f'VALUES {values} '
+                f'ON CONFLICT ({quote("student_id")}, {quote("course_id")}) DO UPDATE SET '
+                f'{quote("active")} = EXCLUDED.{quote("active")}, {quote("updated_at")} = EXCLUDED.{quote("updated_at")} '
+                f'RETURNING {quote("id")}',
+                params
+            )
+            favorite_ids = [row[0] for row in cursor.fetchall()]
+        bump_versions_on_commit(f'favorites:{student.pk}')
+        return favorite_ids
 
     @staticmethod
     def exists(student: User, course: Course):
@@ -123,3 +256,57 @@ class FavoriteCourse(models.Model):
             bool: True if the entry exists, False otherwise.
         """
         return FavoriteCourse.objects.filter(student=student, course=course).exists()
+
+
+class CourseChunk(models.Model):
+    """
+    Model representing a chunk of the context of a course, with its precomputed term counts.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='chunks', blank=False, null=False)
+    position = models.PositiveIntegerField()
+    text = models.TextField()
+    term_counts = models.JSONField(default=dict)
+    length = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['position']
+
+
+class QuestionAnswer(models.Model):
+    """
+    Model representing a question answered by the model, used to rebuild the semantic cache.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, blank=False, null=False)
+    context_hash = models.CharField(max_length=16)
+    question = models.CharField(max_length=200)
+    answer = models.TextField()
+    creation_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['course', 'context_hash'])]
+
+
+class ChatJob(models.Model):
+    """
+    Model representing a question waiting to be answered by the chat workers.
+    """
+    STATUS_TYPE = (
+        ('pending', 'pending'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed')
+    )
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, blank=False, null=False)
+    student = models.ForeignKey(User, on_delete=models.CASCADE, blank=False, null=False)
+    question = models.CharField(max_length=200)
+    status = models.CharField(choices=STATUS_TYPE, max_length=10, default='pending')
+    answer = models.TextField(blank=True, default='')
+    priority = models.IntegerField(default=0)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    start_date = models.DateTimeField(null=True, blank=True)
+    finish_date = models.DateTimeField(null=True, blank=True)
+    not_before = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', '-priority', 'creation_date'])]
@@ -0,0 +1,187 @@
+import base64
+import json
+from operator import attrgetter
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering_field, id).
+
+    Each page is read with an index range from the last row of the previous page,
+    so page 500 costs the same as page 1 and rows inserted meanwhile never shift
+    the pages. Requests without ?page_size get page_size rows.
+    """
+    ordering_field = 'name'
+    tiebreaker_field = 'id'
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Get the rows of the requested page.
+
+        Returns:
+            list: The rows of the page.
+        """
+        params = request.query_params
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(self.ordering_field, self.tiebreaker_field)
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            value, last_id = self.decode_cursor(cursor)
+            # The >= bound lets the database use an index range on ordering_field
+            queryset = queryset.filter(
+                Q(**{f'{self.ordering_field}__gte': value}),
+                Q(**{f'{self.ordering_field}__gt': value}) | Q(**{f'{self.tiebreaker_field}__gt': last_id}),
+            )
+
+        rows = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            self.next_cursor = self.encode_cursor(
+                attrgetter(self.ordering_field.replace('__', '.'))(last),
+                attrgetter(self.tiebreaker_field)(last),
+            )
+        return rows
+
+    def get_page_size(self, request):
+        """
+        Get the page size requested, bounded by max_page_size.
+        """
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, value, last_id):
+        """
+        Encode the position of the last row of a page.
+        """
+        return base64.urlsafe_b64encode(json.dumps([value, last_id]).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Decode the position of the last row of the previous page.
+
+        Raises:
+            NotFound: If the cursor is not valid.
+        """
+        try:
+            value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return value, int(last_id)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SearchPagination(BasePagination):
+    """
+    Page number pagination of ranked search results, without counting them.
+
+    Ranked results have no index order to seek from, and the first pages are the
+    ones read, so each page is an OFFSET of the search. The response tells whether
+    only part of the matches were ranked, see Course/search.py.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    page_query_param = 'page'
+    max_page = 50
+    invalid_page_message = 'Invalid page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Get the rows of the requested page.
+
+        Returns:
+            list: The rows of the page.
+
+        Raises:
+            NotFound: If the page is not a number between 1 and max_page.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.page = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if not 1 <= self.page <= self.max_page:
+            raise NotFound(self.invalid_page_message)
+
+        offset = (self.page - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size and self.page < self.max_page
+        self.truncated = getattr(queryset, 'truncated', False)
+        return rows[:page_size]
+
+    def get_page_size(self, request):
+        """
+        Get the page size requested, bounded by max_page_size.
+        """
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page + 1)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'truncated': self.truncated, 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'truncated': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+
+class CoursePagination(KeysetPagination):
+    """
+    Keyset pagination of courses, in the order of Course.Meta.ordering.
+    """
+    ordering_field = 'name'
+
+
+class FavoriteCoursePagination(KeysetPagination):
+    """
+    Keyset pagination of favorite courses, in the order of the course names.
+    """
+    ordering_field = 'course__name'
@@ -17,7 +17,7 @@ class IsCoursePermission(permissions.BasePermission):
         Returns:
             bool: True if the requesting user is the owner of the object, False otherwise.
         """
-        return obj.instructor.id == request.user.id
+        return obj.instructor_id == request.user.id
 
 
 class IsYourOwnIdInstructor(permissions.BasePermission):
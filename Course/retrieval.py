@@ -0,0 +1,169 @@
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from lab1_pi2.cache import bump_versions
+from .models import Course, CourseChunk
+
+
+def tokenize(text):
+    """
+    Split a text in lowercase terms.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The terms of the text.
+    """
+    return re.findall(r'\w+', text.casefold())
+
+
+def split_into_chunks(text, chunk_words=None, overlap_words=None):
+    """
+    Split a course context in chunks of about chunk_words words.
+
+    Paragraphs are kept together when they fit in a chunk, and consecutive
+    chunks share overlap_words words so that no sentence loses its surroundings.
+
+    Args:
+        text (str): The context of the course.
+        chunk_words (int, optional): Words per chunk.
+        overlap_words (int, optional): Words shared by consecutive chunks.
+
+    Returns:
+        list: The chunks of the context.
+    """
+    config = settings.COURSE_RETRIEVAL
+    chunk_words = chunk_words or config['CHUNK_WORDS']
+    overlap_words = config['OVERLAP_WORDS'] if overlap_words is None else overlap_words
+
+    chunks = []
+    current = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        words = paragraph.split()
+        if current and len(current) + len(words) > chunk_words:
+            chunks.append(' '.join(current))
+            current = current[-overlap_words:] if overlap_words else []
+        current.extend(words)
+        while len(current) > chunk_words:
+            chunks.append(' '.join(current[:chunk_words]))
+            current = current[chunk_words - overlap_words:]
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def course_chunks(course, texts=None):
+    """
+    Build the chunks of the current context of a course, without saving them.
+
+    Args:
+        course (Course): The course to index.
+        texts (list, optional): The context already split with split_into_chunks.
+
+    Returns:
+        list: The CourseChunk instances.
+    """
+    if texts is None:
+        texts = split_into_chunks(course.context)
+    chunks = []
+    for position, text in enumerate(texts):
+        terms = tokenize(text)
+        chunks.append(CourseChunk(
+            course=course, position=position, text=text, term_counts=Counter(terms), length=len(terms)
+        ))
+    return chunks
+
+
+def build_course_index(course):
+    """
+    Replace the chunks of a course with the chunks of its current context.
+
+    Args:
+        course (Course): The course to index.
+    """
+    chunks = course_chunks(course)
+    with transaction.atomic():
+        CourseChunk.objects.filter(course=course).delete()
+        CourseChunk.objects.bulk_create(chunks)
+    # The cached prompt of the course counts its chunks
+    bump_versions(f'course:{course.pk}')
+
+
+def build_new_course_indexes(courses, batch_size=1000):
+    """
+    Save the chunks of courses that have none yet, e.g. created with bulk_create.
+
+    Courses whose context fits in TOP_K chunks are sent whole by retrieve_context,
+    so their chunks are not saved.
+
+    Args:
+        courses (list): The saved courses.
+        batch_size (int): Chunks per INSERT.
+    """
+    top_k = settings.COURSE_RETRIEVAL['TOP_K']
+    chunks = []
+    for course in courses:
+        texts = split_into_chunks(course.context)
+        if len(texts) > top_k:
+            chunks.extend(course_chunks(course, texts))
+    CourseChunk.objects.bulk_create(chunks, batch_size=batch_size)
+
+
+def rank_chunks(chunks, question, k1=1.5, b=0.75):
+    """
+    Score chunks against a question with BM25.
+
+    Args:
+        chunks (list): Tuples of (position, term_counts, length).
+        question (str): The question.
+
+    Returns:
+        list: Tuples of (score, position), best first.
+    """
+    terms = set(tokenize(question))
+    average_length = sum(length for _, _, length in chunks) / len(chunks) or 1
+    document_frequency = Counter(term for _, counts, _ in chunks for term in terms if term in counts)
+    scores = []
+    for position, counts, length in chunks:
+        score = 0.0
+        for term in terms:
+            frequency = counts.get(term)
+            if frequency:
+                idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append((score, position))
+    scores.sort(key=lambda item: (-item[0], item[1]))
+    return scores
+
+
+def retrieve_context(course_id, question, default, top_k=None):
+    """
+    Build the context of a question with only the chunks of the course relevant to it.
+
+    Args:
+        course_id (int): The ID of the course.
+        question (str): The question.
+        default (str): Context used when the whole course fits in top_k chunks.
+        top_k (int, optional): Maximum number of chunks used.
+
+    Returns:
+        str: The course name followed by the relevant chunks, in the order of the course,
+        or default if the chunks were rebuilt meanwhile and none of them is left.
+    """
+    top_k = top_k or settings.COURSE_RETRIEVAL['TOP_K']
+    prompt = Course.get_prompt(course_id)
+    if prompt is None or prompt.chunks <= top_k:
+        return default
+    chunks = list(CourseChunk.objects.filter(course_id=course_id).values_list('position', 'term_counts', 'length'))
+    if len(chunks) <= top_k:
+        return default
+    positions = sorted(position for score, position in rank_chunks(chunks, question)[:top_k])
+    rows = list(CourseChunk.objects.filter(course_id=course_id, position__in=positions).values_list('course__name', 'text'))
+    if not rows:
+        return default
+    return f'{rows[0][0]}: ' + '\n\n'.join(text for _, text in rows)
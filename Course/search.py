@@ -0,0 +1,252 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from .models import Course
+
+SEARCH_TABLE = 'course_search'
+SEARCH_INDEX = 'course_search_idx'
+NAME_INDEX = 'course_name_search_idx'
+
+
+def get_terms(text):
+    """
+    Split a search in lowercase words, dropping any operator of the search syntax.
+
+    Args:
+        text (str): The search typed by the user.
+
+    Returns:
+        list: At most COURSE_SEARCH['MAX_TERMS'] words.
+    """
+    return re.findall(r'\w+', text.lower())[:settings.COURSE_SEARCH['MAX_TERMS']]
+
+
+def get_search_config():
+    """
+    Get the Postgres text search configuration, e.g. 'simple' or 'spanish'.
+
+    Raises:
+        ValueError: If the name is not a plain identifier, it is written in the SQL.
+    """
+    config = settings.COURSE_SEARCH['CONFIG']
+    if not re.fullmatch(r'\w+', config):
+        raise ValueError(f'Invalid text search configuration: {config}')
+    return config
+
+
+def postgres_document(config):
+    """
+    Get the SQL of the weighted tsvector of a course: name (A), description (B) and context (C).
+
+    The same expression is used by the GIN index and the queries, so they can use it.
+    """
+    return ' || '.join(
+        f"setweight(to_tsvector('{config}'::regconfig, {column}), '{weight}')"
+        for column, weight in (('name', 'A'), ('description', 'B'), ('context', 'C'))
+    )
+
+
+def install_search_index(using='default'):
+    """
+    Create the full-text indexes of the courses if missing.
+
+    On Postgres, GIN indexes on the weighted tsvector of the active courses and on the
+    tsvector of their names. On SQLite, an FTS5 table over the course table with prefix
+    indexes, kept up to date by triggers, so bulk_create and update() are indexed too.
+    Other databases search with icontains.
+
+    Args:
+        using (str): The database alias.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(Course._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            config = get_search_config()
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON {table} '
+                f'USING gin (({postgres_document(config)})) WHERE active'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {NAME_INDEX} ON {table} '
+                f"USING gin (to_tsvector('{config}'::regconfig, name)) WHERE active"
+            )
+        elif connection.vendor == 'sqlite':
+            if SEARCH_TABLE in connection.introspection.table_names(cursor):
+                return
+            columns = 'new.id, new.name, new.description, new.context'
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5('
+                f"name, description, context, content={table}, content_rowid='id', "
+                f"prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {SEARCH_TABLE}(rowid, name, description, context) VALUES ({columns}); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, description, context) "
+                f"VALUES ('delete', {columns.replace('new.', 'old.')}); END"
+            )
+            # Toggles and updated_at do not change the indexed text
+            cursor.execute(
+                f'CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF name, description, context ON {table} BEGIN '
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, description, context) "
+                f"VALUES ('delete', {columns.replace('new.', 'old.')}); "
+                f'INSERT INTO {SEARCH_TABLE}(rowid, name, description, context) VALUES ({columns}); END'
+            )
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def ranked_sql(source, score, columns, descending=False, rowid='course.id', count=False):
+    """
+    Build the SQL ranking the newest active courses matching a search.
+
+    Scoring every match of a word found in most courses takes longer than the rest of
+    the request, so only the newest COURSE_SEARCH['MAX_CANDIDATES'] matches are scored:
+    the ranking is exact for searches matching fewer courses, and ranks the newest ones
+    of broader searches. Reading the matches in ID order follows the full-text index.
+
+    Args:
+        source (str): FROM and WHERE clauses of the matches, the course table aliased as course.
+        score (str): SQL of the score of a match.
+        columns (list): Columns of the course selected.
+        descending (bool): Whether higher scores are better.
+        rowid (str): The ID of the course as known to the full-text index, to read it in order.
+        count (bool): Whether to also select the number of candidates, after the columns,
+            to tell if the matches were cut.
+
+    Returns:
+        str: The SQL, taking the parameters of source, then the number of candidates, limit and offset.
+    """
+    return (
+        f'SELECT {", ".join(columns)}{", COUNT(*) OVER ()" if count else ""} FROM ('
+        f'SELECT {", ".join(f"course.{column}" for column in columns)}, {score} AS score FROM {source} '
+        f'ORDER BY {rowid} DESC LIMIT %s'
+        f') candidates ORDER BY score{" DESC" if descending else ""}, id LIMIT %s OFFSET %s'
+    )
+
+
+def sqlite_source(table):
+    """
+    Get the FROM and WHERE clauses of the active courses matching an FTS5 query.
+    """
+    return f'{SEARCH_TABLE} JOIN {table} course ON course.id = {SEARCH_TABLE}.rowid WHERE {SEARCH_TABLE} MATCH %s AND course.active'
+
+
+def search_course_ids(text, offset=0, limit=20, using='default'):
+    """
+    Get the IDs of the active courses matching every word of a search, best first.
+
+    Matches in the name weigh more than in the description, and these more than in the
+    context. Only the newest COURSE_SEARCH['MAX_CANDIDATES'] matches are ranked, see ranked_sql.
+
+    Args:
+        text (str): The search.
+        offset (int): Courses skipped.
+        limit (int): Maximum number of courses.
+        using (str): The database alias.
+
+    Returns:
+        tuple: The IDs of the courses, and whether the search matched more courses than
+        the ones ranked, so that older matches may be missing.
+    """
+    terms = get_terms(text)
+    if not terms:
+        return [], False
+    connection = connections[using]
+    table = connection.ops.quote_name(Course._meta.db_table)
+    cap = settings.COURSE_SEARCH['MAX_CANDIDATES']
+    if connection.vendor == 'postgresql':
+        document = postgres_document(get_search_config())
+        sql = ranked_sql(
+            f'{table} course, plainto_tsquery(%s::regconfig, %s) query WHERE course.active AND ({document}) @@ query',
+            f'ts_rank({document}, query)', ['id'], descending=True, count=True,
+        )
+        # One candidate more than the cap tells if the matches were cut
+        params = [get_search_config(), ' '.join(terms), cap + 1, limit, offset]
+    elif connection.vendor == 'sqlite':
+        sql = ranked_sql(
+            sqlite_source(table), f'bm25({SEARCH_TABLE}, 10.0, 4.0, 1.0)', ['id'], rowid=f'{SEARCH_TABLE}.rowid', count=True
+        )
+        params = [' '.join(f'"{term}"' for term in terms), cap + 1, limit, offset]
+    else:
+        queryset = Course.objects.filter(active=True)
+        for term in terms:
+            queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term) | Q(context__icontains=term))
+        return list(queryset.order_by('name', 'id').values_list('id', flat=True)[offset:offset + limit]), False
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return [row[0] for row in rows], bool(rows) and rows[0][1] > cap
+
+
+def typeahead_courses(text, limit=None, using='default'):
+    """
+    Get the active courses with a word of the name starting with each word typed.
+
+    Args:
+        text (str): The beginning of the words, e.g. 'intro pro'.
+        limit (int, optional): Maximum number of courses, COURSE_SEARCH['TYPEAHEAD_LIMIT'] by default.
+        using (str): The database alias.
+
+    Returns:
+        list: Dicts with the id and name of the courses, best first.
+    """
+    config = settings.COURSE_SEARCH
+    limit = limit or config['TYPEAHEAD_LIMIT']
+    terms = get_terms(text)
+    if not terms or len(terms[-1]) < config['TYPEAHEAD_MIN_LENGTH']:
+        return []
+    connection = connections[using]
+    table = connection.ops.quote_name(Course._meta.db_table)
+    cap = config['TYPEAHEAD_MAX_CANDIDATES']
+    if connection.vendor == 'postgresql':
+        name = f"to_tsvector('{get_search_config()}'::regconfig, name)"
+        sql = ranked_sql(
+            f'{table} course, to_tsquery(%s::regconfig, %s) query WHERE course.active AND {name} @@ query',
+            f'ts_rank({name}, query)', ['id', 'name'], descending=True,
+        )
+        params = [get_search_config(), ' & '.join(f'{term}:*' for term in terms), cap, limit, 0]
+    elif connection.vendor == 'sqlite':
+        sql = ranked_sql(sqlite_source(table), f'bm25({SEARCH_TABLE})', ['id', 'name'], rowid=f'{SEARCH_TABLE}.rowid')
+        params = ['name : (' + ' '.join(f'"{term}"*' for term in terms) + ')', cap, limit, 0]
+    else:
+        queryset = Course.objects.filter(active=True)
+        for term in terms:
+            queryset = queryset.filter(name__icontains=term)
+        return list(queryset.order_by('name', 'id').values('id', 'name')[:limit])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [{'id': course_id, 'name': name} for course_id, name in cursor.fetchall()]
+
+
+class CourseSearchResults:
+    """
+    Lazy results of a course search, sliced by the pagination.
+
+    Each slice runs the ranked search for the IDs of the page, then reads those
+    courses with their instructors in a second query. After a slice, truncated tells
+    whether the search matched more courses than the ones ranked.
+    """
+    def __init__(self, text, queryset=None):
+        """
+        Args:
+            text (str): The search.
+            queryset (QuerySet, optional): Courses read for the IDs found.
+        """
+        self.text = text
+        self.queryset = queryset if queryset is not None else Course.objects.select_related('instructor')
+        self.truncated = False
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('CourseSearchResults only supports slices without step')
+        offset = index.start or 0
+        course_ids, self.truncated = search_course_ids(self.text, offset, index.stop - offset)
+        courses = self.queryset.in_bulk(course_ids)
+        return [courses[course_id] for course_id in course_ids if course_id in courses]
@@ -0,0 +1,364 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import context_hash, normalize_question
+from .models import Course, QuestionAnswer
+
+STOP_WORDS = {
+    # English
+    'a', 'an', 'the', 'is', 'are', 'was', 's', 'does', 'do', 'can', 'you', 'i', 'me', 'please',
+    'explain', 'tell', 'about', 'of', 'in', 'to', 'and', 'or', 'mean', 'means',
+    'isn', 'aren', 'wasn', 'don', 'doesn', 'didn', 'won',
+    # Spanish
+    'el', 'la', 'los', 'las', 'un', 'una', 'es', 'son', 'de', 'del', 'en', 'y', 'o', 'por', 'favor',
+    'explica', 'explícame', 'explicame', 'sobre', 'significa',
+}
+
+# Words that change what is asked: questions only reuse the answers of questions with the same ones
+QUESTION_WORDS = {
+    'what', 'whats', 'how', 'why', 'when', 'where', 'which', 'who',
+    'qué', 'que', 'cómo', 'como', 'porqué', 'porque', 'cuándo', 'cuando', 'dónde', 'donde', 'cuál', 'cual',
+    'cuáles', 'cuales', 'quién', 'quien',
+}
+NEGATIONS = {
+    'not', 'no', 'never', 'nor', 'without', 'cannot',
+    'nunca', 'ni', 'sin', 'tampoco', 'jamás', 'jamas',
+}
+
+
+class HashingVectorizer:
+    """
+    Turn questions into fixed-size vectors of hashed word and character n-grams.
+
+    Runs on the CPU without any trained model, so it can be used in every worker.
+    """
+    def __init__(self, dimensions=1024, ngram=3):
+        """
+        Args:
+            dimensions (int): Size of the vectors.
+            ngram (int): Length of the character n-grams.
+        """
+        self.dimensions = dimensions
+        self.ngram = ngram
+
+    def words(self, question):
+        """
+        Get the words of a question, without stop words, with "n't" read as "not".
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            list: The words.
+        """
+        question = re.sub(r'(?<=n) t\b', ' not', normalize_question(question))
+        return [word for word in question.split() if word not in STOP_WORDS]
+
+    def markers(self, question):
+        """
+        Get a key of the question words and negations of a question.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            int: The same number for questions with the same question words and negations.
+        """
+        markers = sorted({word for word in self.words(question) if word in QUESTION_WORDS or word in NEGATIONS})
+        return zlib.crc32(' '.join(markers).encode())
+
+    def features(self, question):
+        """
+        Get the n-grams of the words of a question.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            list: The word and character n-grams.
+        """
+        words = self.words(question)
+        features = list(words)
+        for word in words:
+            padded = f' {word} '
+            features.extend(padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1))
+        return features
+
+    def transform(self, question):
+        """
+        Get the unit vector of a question.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            numpy.ndarray: The L2-normalized vector of the question.
+        """
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self.features(question):
+            digest = zlib.crc32(feature.encode())
+            vector[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class CourseVectorIndex:
+    """
+    Bounded index of the answered questions of a course. When full, the oldest question is replaced.
+
+    The arrays start with room for initial_size questions and double when full, up to
+    max_size, so courses with few answered questions take little memory.
+    """
+    def __init__(self, dimensions, max_size, initial_size=16):
+        """
+        Args:
+            dimensions (int): Size of the vectors.
+            max_size (int): Maximum number of questions kept in the index.
+            initial_size (int): Questions the arrays have room for before growing.
+        """
+        capacity = min(initial_size, max_size)
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.markers = np.zeros(capacity, dtype=np.int64)
+        self.answers = []
+        self.max_size = max_size
+        self.size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _grow(self):
+        capacity = min(len(self.vectors) * 2, self.max_size)
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        markers = np.zeros(capacity, dtype=np.int64)
+        markers[:self.size] = self.markers[:self.size]
+        self.vectors, self.markers = vectors, markers
+
+    def add(self, vector, answer, markers=0):
+        """
+        Add an answered question to the index.
+
+        Args:
+            vector (numpy.ndarray): The vector of the question.
+            answer (str): The answer of the question.
+            markers (int): The key of the question words and negations of the question.
+        """
+        with self._lock:
+            if self._next == len(self.vectors):
+                self._grow()
+            self.vectors[self._next] = vector
+            self.markers[self._next] = markers
+            if self._next == len(self.answers):
+                self.answers.append(answer)
+            else:
+                self.answers[self._next] = answer
+            self._next = (self._next + 1) % self.max_size
+            self.size = min(self.size + 1, self.max_size)
+
+    def search(self, vector, markers=0):
+        """
+        Find the most similar question in the index with the same question words and negations.
+
+        Args:
+            vector (numpy.ndarray): The vector of the question.
+            markers (int): The key of the question words and negations of the question.
+
+        Returns:
+            tuple: The cosine similarity and the answer of the closest question,
+            or (0.0, None) if there is none.
+        """
+        with self._lock:
+            same = self.markers[:self.size] == markers
+            if not same.any():
+                return 0.0, None
+            scores = np.where(same, self.vectors[:self.size] @ vector, -np.inf)
+            best = int(np.argmax(scores))
+            return float(scores[best]), self.answers[best]
+
+
+class SemanticAnswerCache:
+    """
+    Serve answers of previously asked questions that are similar enough to a new one.
+
+    Keeps one CourseVectorIndex per course context, the least recently used ones
+    are evicted and rebuilt from the stored QuestionAnswer rows when needed again.
+    Rows older than max_age are not used, prune_question_answers deletes them.
+    """
+    def __init__(self, threshold=0.85, max_size=1000, max_courses=100, dimensions=1024, max_age=None):
+        """
+        Args:
+            threshold (float): Minimum cosine similarity to reuse an answer.
+            max_size (int): Maximum number of questions indexed per course.
+            max_courses (int): Maximum number of course indexes kept in memory.
+            dimensions (int): Size of the question vectors.
+            max_age (int, optional): Seconds an answer is reused. None means no expiration.
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.max_courses = max_courses
+        self.max_age = max_age
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.hits = 0
+        self.misses = 0
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_index(self, course_id, context):
+        """
+        Get the index of a course context, rebuilding it if it is not in memory.
+
+        Args:
+            course_id (int): The ID of the course.
+            context (str): The context of the course.
+
+        Returns:
+            CourseVectorIndex: The index of the course.
+        """
+        key = (course_id, context_hash(context))
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = self.rebuild(course_id, context)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_courses:
+                self._indexes.popitem(last=False)
+        return index
+
+    def rebuild(self, course_id, context):
+        """
+        Build the index of a course context from the stored questions and answers.
+
+        Args:
+            course_id (int): The ID of the course.
+            context (str): The context of the course.
+
+        Returns:
+            CourseVectorIndex: The rebuilt index.
+        """
+        index = CourseVectorIndex(self.vectorizer.dimensions, self.max_size)
+        pairs = QuestionAnswer.objects.filter(course_id=course_id, context_hash=context_hash(context))
+        if self.max_age is not None:
+            pairs = pairs.filter(creation_date__gte=timezone.now() - timedelta(seconds=self.max_age))
+        pairs = pairs.order_by('-creation_date').values_list('question', 'answer')[:self.max_size]
+        for question, answer in reversed(list(pairs)):
+            index.add(self.vectorizer.transform(question), answer, self.vectorizer.markers(question))
+        return index
+
+    def get(self, course_id, context, question):
+        """
+        Get the answer of the most similar question already answered in a course.
+
+        Returns:
+            str: The answer, or None if no question is similar enough.
+        """
+        index = self.get_index(course_id, context)
+        score, answer = index.search(self.vectorizer.transform(question), self.vectorizer.markers(question))
+        if answer is not None and score >= self.threshold:
+            self.hits += 1
+            return answer
+        self.misses += 1
+        return None
+
+    def set(self, course_id, context, question, answer, store=True):
+        """
+        Index the answer of a question, storing it so the index can be rebuilt.
+
+        Args:
+            store (bool): Whether to save the question and answer in the database.
+        """
+        index = self.get_index(course_id, context)
+        if store:
+            QuestionAnswer.objects.create(
+                course_id=course_id, context_hash=context_hash(context), question=question, answer=answer
+            )
+        index.add(self.vectorizer.transform(question), answer, self.vectorizer.markers(question))
+
+    def invalidate_course(self, course_id):
+        """
+        Drop every in-memory index of a course.
+
+        Args:
+            course_id (int): The ID of the course.
+        """
+        with self._lock:
+            for key in [key for key in self._indexes if key[0] == course_id]:
+                del self._indexes[key]
+
+    def clear(self):
+        """
+        Drop every in-memory index and reset the counters.
+        """
+        with self._lock:
+            self._indexes.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Get the usage counters of the cache.
+
+        Returns:
+            dict: Hits, misses and number of course indexes in memory.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'courses': len(self._indexes)}
+
+
+def get_semantic_cache():
+    """
+    Build the semantic cache configured in settings.SEMANTIC_CACHE.
+
+    Returns:
+        SemanticAnswerCache: The configured cache, or None if it is disabled.
+    """
+    config = getattr(settings, 'SEMANTIC_CACHE', {})
+    if not config.get('ENABLED'):
+        return None
+    return SemanticAnswerCache(
+        threshold=config.get('THRESHOLD', 0.85),
+        max_size=config.get('MAX_SIZE', 1000),
+        max_courses=config.get('MAX_COURSES', 100),
+        dimensions=config.get('DIMENSIONS', 1024),
+        max_age=config.get('MAX_AGE'),
+    )
+
+
+def prune_question_answers(max_age=None, max_size=None):
+    """
+    Delete the stored questions and answers that the semantic cache no longer uses.
+
+    These are the ones older than max_age, the ones of a previous context of their
+    course, and past the newest max_size of each course, as only those are indexed.
+
+    Args:
+        max_age (int, optional): Seconds a row is kept. None keeps them regardless of age.
+        max_size (int, optional): Rows kept per course. None keeps them all.
+
+    Returns:
+        int: The number of deleted rows.
+    """
+    deleted = 0
+    if max_age is not None:
+        limit = timezone.now() - timedelta(seconds=max_age)
+        deleted += QuestionAnswer.objects.filter(creation_date__lt=limit).delete()[0]
+    for course_id in QuestionAnswer.objects.values_list('course_id', flat=True).distinct().order_by():
+        current = context_hash(Course.get_context(course_id))
+        deleted += QuestionAnswer.objects.filter(course_id=course_id).exclude(context_hash=current).delete()[0]
+        if max_size is None:
+            continue
+        # The IDs grow with the creation date
+        oldest_kept = QuestionAnswer.objects.filter(course_id=course_id).order_by('-id').values_list('id', flat=True)[max_size - 1:max_size]
+        if oldest_kept:
+            deleted += QuestionAnswer.objects.filter(course_id=course_id, id__lt=oldest_kept[0]).delete()[0]
+    return deleted
+
+
+semantic_cache = get_semantic_cache()
@@ -1,6 +1,11 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
 from rest_framework import serializers
+from lab1_pi2.cache import bump_versions_on_commit
 from Users.models import User
-from .models import Course, FavoriteCourse
+from .models import ChatJob, Course, FavoriteCourse, validate_context
+from .retrieval import build_course_index
 
 
 class BaseCourseSerializer(serializers.ModelSerializer):
@@ -28,6 +33,23 @@ class BaseCourseSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('User does not exist.')
         return value
 
+    def validate_context(self, value):
+        """
+        Validate that the context is not too long.
+
+        Args:
+            value (str): The context.
+
+        Returns:
+            str: The validated context.
+
+        Raises:
+            serializers.ValidationError: If the context has too many words.
+        """
+        if not validate_context(value):
+            raise serializers.ValidationError('The context is too long.')
+        return value
+
 
 class CourseCreateSerializer(BaseCourseSerializer):
     """
@@ -56,6 +78,7 @@ class CourseCreateSerializer(BaseCourseSerializer):
         """
         course = Course(**validated_data)
         course.save()
+        build_course_index(course)
         return course
 
 
@@ -67,6 +90,23 @@ class CourseUpdateSerializer(BaseCourseSerializer):
         model = Course
         fields = ["name", "description", "context", "active"]
 
+    def update(self, instance, validated_data):
+        """
+        Update a course, rebuilding its chunks if the context changed.
+
+        Args:
+            instance (Course): The course to update.
+            validated_data (dict): Validated data for the course.
+
+        Returns:
+            Course: The updated course instance.
+        """
+        context_changed = 'context' in validated_data and validated_data['context'] != instance.context
+        course = super().update(instance, validated_data)
+        if context_changed:
+            build_course_index(course)
+        return course
+
 
 class QuestionSerializer(serializers.Serializer):
     """
@@ -75,6 +115,15 @@ class QuestionSerializer(serializers.Serializer):
     content = serializers.CharField(max_length=200)
 
 
+class ChatJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the status and answer of a chat job.
+    """
+    class Meta:
+        model = ChatJob
+        fields = ["id", "course", "question", "status", "answer", "creation_date", "finish_date"]
+
+
 class CourseListSerializer(serializers.ModelSerializer):
     """
     Serializer for listing courses.
@@ -98,6 +147,14 @@ class CourseListSerializer(serializers.ModelSerializer):
         return f"{obj.instructor.first_name} {obj.instructor.last_name}"
 
 
+class CourseTypeaheadSerializer(serializers.Serializer):
+    """
+    Serializer for the course names suggested while typing a search.
+    """
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+
 class BaseFavoriteCourseSerializer(serializers.ModelSerializer):
     """
     Base serializer for FavoriteCourse with common validation.
@@ -110,6 +167,8 @@ class BaseFavoriteCourseSerializer(serializers.ModelSerializer):
                 "course": {"required": True},
                 "active": {"required": False}
             }
+        # Adding an existing (student, course) pair reactivates it, see FavoriteCourse.create
+        validators = []
         
     def validate_student(self, value):
         """
@@ -176,18 +235,92 @@ class DeleteFavoriteCourseSerializer(BaseFavoriteCourseSerializer):
             course (Course): The course.
 
         Returns:
-            FavoriteCourse: The updated FavoriteCourse instance or None if not found.
+            int: The number of deactivated entries.
 
         Raises:
             serializers.ValidationError: If the FavoriteCourse does not exist.
         """
-        try:
-            favorite_course = FavoriteCourse.objects.get(student=student, course=course)
-            favorite_course.active = False
-            favorite_course.save()
-            return favorite_course
-        except FavoriteCourse.DoesNotExist:
+        updated = FavoriteCourse.objects.filter(student=student, course=course).update(active=False, updated_at=timezone.now())
+        if not updated:
             raise serializers.ValidationError('FavoriteCourse does not exist.')
+        bump_versions_on_commit(f'favorites:{student.pk}')
+        return updated
+
+class BulkFavoriteCourseSerializer(serializers.Serializer):
+    """
+    Serializer for adding or removing many courses to/from favorite courses.
+
+    Every course gets a result: 'added', 'removed', 'unchanged' (already in that
+    state), 'inactive' (the course is not active) or 'not_found'.
+    """
+    student = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    courses = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+
+    def validate_student(self, value):
+        """
+        Validate that the user is a student.
+
+        Args:
+            value (User): The student.
+
+        Returns:
+            User: The validated user.
+
+        Raises:
+            serializers.ValidationError: If the user is not a student.
+        """
+        if value.rol != "Estudiante":
+            raise serializers.ValidationError('Only students can add courses to favorite courses.')
+        return value
+
+    def get_courses(self):
+        """
+        Get the requested courses with one query.
+
+        Returns:
+            dict: (active, is_favorite) by course ID, for the courses that exist.
+        """
+        student = self.validated_data['student']
+        favorites = FavoriteCourse.objects.filter(student=student, course=OuterRef('pk'), active=True)
+        rows = Course.objects.filter(pk__in=self.validated_data['courses']).annotate(
+            is_favorite=Exists(favorites)
+        ).values_list('id', 'active', 'is_favorite')
+        return {course_id: (active, is_favorite) for course_id, active, is_favorite in rows}
+
+    def apply(self, add):
+        """
+        Add or remove the requested courses in a single transaction.
+
+        Args:
+            add (bool): True to add the courses, False to remove them.
+
+        Returns:
+            list: The result of each course, in the order of the request.
+        """
+        student = self.validated_data['student']
+        course_ids = list(dict.fromkeys(self.validated_data['courses']))
+        with transaction.atomic():
+            courses = self.get_courses()
+            results = []
+            changed = []
+            for course_id in course_ids:
+                if course_id not in courses:
+                    result = 'not_found'
+                elif not courses[course_id][0]:
+                    result = 'inactive'
+                elif courses[course_id][1] == add:
+                    result = 'unchanged'
+                else:
+                    result = 'added' if add else 'removed'
+                    changed.append(course_id)
+                results.append({'course': course_id, 'result': result})
+            if add:
+                FavoriteCourse.upsert(student, changed)
+            elif changed:
+                FavoriteCourse.objects.filter(student=student, course_id__in=changed).update(active=False, updated_at=timezone.now())
+                bump_versions_on_commit(f'favorites:{student.pk}')
+        return results
+
 
 class ListFavoriteCourseSerializer(serializers.ModelSerializer):
     """
@@ -204,3 +337,4 @@ class ListFavoriteCourseSerializer(serializers.ModelSerializer):
     class Meta:
         model = FavoriteCourse
         fields = ["student","course","name","instructor", "description", "context", "creation_date","active"]
+        validators = []
@@ -0,0 +1,41 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from lab1_pi2.cache import bump_versions_on_commit
+from Users.models import User
+from .models import Course, FavoriteCourse
+from .search import install_search_index
+
+
+def course_scopes(instructor_id):
+    """
+    Get the list scopes changed by a change of a course of an instructor.
+    """
+    return ['courses', f'instructor:{instructor_id}']
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    bump_versions_on_commit(*course_scopes(instance.instructor_id), f'course:{instance.pk}')
+
+
+@receiver(post_save, sender=FavoriteCourse)
+@receiver(post_delete, sender=FavoriteCourse)
+def favorite_course_changed(sender, instance, **kwargs):
+    bump_versions_on_commit(f'favorites:{instance.student_id}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # The course lists show the name and email of the instructors, logins only touch last_login
+    if instance.rol == 'Profesor' and update_fields != frozenset(['last_login']):
+        bump_versions_on_commit(*course_scopes(instance.pk))
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using='default', **kwargs):
+    # The full-text indexes depend on the database, they are not in the models
+    if sender.name == 'Course':
+        install_search_index(using)
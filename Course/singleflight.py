@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+
+class _Call:
+    """
+    A call in progress in this process, awaited by the duplicates of its key.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key so that only one of them does the work.
+
+    Within a process duplicates wait for the call in progress. Across processes the
+    first caller takes a lock in the shared cache and publishes its result under its
+    lock token, and the callers that saw that token poll for it. Callers arriving after
+    the work finished do it again, so the result is never served as a stale cache.
+    A result of None is never published, so duplicates retry instead of sharing a failure.
+    """
+    def __init__(self, cache, lock_timeout=60, result_timeout=10, poll_interval=0.05):
+        """
+        Args:
+            cache: Django cache shared by every worker.
+            lock_timeout (int): Seconds a caller holds the lock before others give up waiting.
+            result_timeout (int): Seconds a result stays available to the waiting duplicates.
+            poll_interval (float): Seconds between checks for the result of another worker.
+        """
+        self.cache = cache
+        self.lock_timeout = lock_timeout
+        self.result_timeout = result_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Call func, unless a call with the same key is in progress, then return its result.
+
+        Args:
+            key (str): The key identifying duplicate calls.
+            func (callable): The work to do.
+
+        Returns:
+            The result of func, or of the duplicate call that did the work.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, func)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _do_shared(self, key, func):
+        lock_key = f'singleflight:lock:{key}'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            if self.cache.add(lock_key, token, self.lock_timeout):
+                try:
+                    result = func()
+                    if result is not None:
+                        self.cache.set(f'singleflight:result:{token}', result, self.result_timeout)
+                    return result
+                finally:
+                    if self.cache.get(lock_key) == token:
+                        self.cache.delete(lock_key)
+            leader = self.cache.get(lock_key)
+            while leader is not None:
+                if time.monotonic() > deadline:
+                    return func()
+                time.sleep(self.poll_interval)
+                result = self.cache.get(f'singleflight:result:{leader}')
+                if result is not None:
+                    return result
+                if self.cache.get(lock_key) != leader:
+                    break
+
+    async def ado(self, key, func):
+        """
+        Asynchronous version of do.
+
+        Args:
+            key (str): The key identifying duplicate calls.
+            func (callable): Coroutine function doing the work.
+
+        Returns:
+            The result of func, or of the duplicate call that did the work.
+        """
+        future = self._async_calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._ado_shared(key, func)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved, it is raised below anyway
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_calls[key]
+
+    async def _ado_shared(self, key, func):
+        lock_key = f'singleflight:lock:{key}'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            if await self.cache.aadd(lock_key, token, self.lock_timeout):
+                try:
+                    result = await func()
+                    if result is not None:
+                        await self.cache.aset(f'singleflight:result:{token}', result, self.result_timeout)
+                    return result
+                finally:
+                    if await self.cache.aget(lock_key) == token:
+                        await self.cache.adelete(lock_key)
+            leader = await self.cache.aget(lock_key)
+            while leader is not None:
+                if time.monotonic() > deadline:
+                    return await func()
+                await asyncio.sleep(self.poll_interval)
+                result = await self.cache.aget(f'singleflight:result:{leader}')
+                if result is not None:
+                    return result
+                if await self.cache.aget(lock_key) != leader:
+                    break
+
+
+def get_single_flight():
+    """
+    Build the request coalescer configured in settings.SINGLE_FLIGHT.
+
+    Returns:
+        SingleFlight: The configured coalescer.
+    """
+    config = getattr(settings, 'SINGLE_FLIGHT', {})
+    return SingleFlight(
+        ConnectionProxy(caches, config.get('CACHE', 'default')),
+        lock_timeout=config.get('LOCK_TIMEOUT', 60),
+        result_timeout=config.get('RESULT_TIMEOUT', 10),
+        poll_interval=config.get('POLL_INTERVAL', 0.05),
+    )
+
+
+single_flight = get_single_flight()
@@ -1,8 +1,47 @@
+import asyncio
+import csv
+import gzip
+import io
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import markdown
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import Throttled
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from lab1_pi2.cache import TwoTierCache, check_shared_cache, get_versions
+from lab1_pi2.profiling import QueryBudgetMixin, endpoint_stats
 from Users.models import User
-from .models import Course
+from Users.testing import UserFixturesMixin
+from .cache import LRUCache, answer_cache, normalize_question
+from .chat import answer_question
+from .jobs import process_next_job
+from .models import ChatJob, Course, CourseChunk, FavoriteCourse, QuestionAnswer
+from .pagination import KeysetPagination
+from .retrieval import retrieve_context, split_into_chunks
+from .semantic import CourseVectorIndex, SemanticAnswerCache
+from .singleflight import SingleFlight
+from .throttling import ConcurrencyLimiter, UserChatThrottle, backoff, get_llm_limiter
+from .utils import NO_RESPONSE, ask_google_ai, check_llm_provider, get_provider, render_markdown_stream, require_llm_provider
 
 
 class CourseAPITestCase(APITestCase):
@@ -41,7 +80,7 @@ class CourseAPITestCase(APITestCase):
         url = reverse('instructor_list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_create_course(self):
         self.client.login(username='instructor@gmail.com', password='password')
@@ -76,3 +115,1106 @@ class CourseAPITestCase(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('answer', response.data)
+
+
+class ChatTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.instructor_user,
+            description='A test course',
+            context='Test context'
+        )
+        answer_cache.clear()
+        caches['default'].clear()
+
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question('  What is a VARIABLE?! '), 'what is a variable')
+
+    def test_lru_eviction_and_counters(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 2})
+
+    def test_lru_eviction_by_weight(self):
+        cache = LRUCache(max_size=10, max_weight=10, weigh=len)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('a', 'x' * 3)
+        self.assertEqual(cache.weight, 7)
+        cache.set('c', 'x' * 5)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.weight, 8)
+        cache.set('d', 'x' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    def test_chat_reuses_cached_answer(self, ask):
+        self.client.force_authenticate(user=self.student_user)
+        url = reverse('chat', args=[self.course.pk])
+        self.client.post(url, {'content': 'What is a variable?'})
+        response = self.client.post(url, {'content': 'what is a variable'})
+        self.assertEqual(response.data['answer'], '<p>An answer</p>')
+        self.assertEqual(ask.call_count, 1)
+
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    def test_modify_invalidates_cached_answers(self, ask):
+        url = reverse('chat', args=[self.course.pk])
+        self.client.force_authenticate(user=self.student_user)
+        self.client.post(url, {'content': 'What is a variable?'})
+        self.client.force_authenticate(user=self.instructor_user)
+        self.client.post(reverse('instructor_delete', args=[self.course.pk]))
+        self.client.force_authenticate(user=self.student_user)
+        self.client.post(url, {'content': 'What is a variable?'})
+        self.assertEqual(ask.call_count, 2)
+
+    def test_render_markdown_stream_keeps_code_fences_whole(self):
+        chunks = ['# Title\n', '\nSome text', '\n\n```\na\n\nb', '\n```\n']
+        blocks = list(render_markdown_stream(chunks))
+        self.assertEqual(blocks[0], '<h1>Title</h1>')
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual(blocks[2], markdown.markdown('```\na\n\nb\n```\n'))
+
+    @mock.patch('Course.chat.stream_google_ai', return_value=iter(['First part.\n\n', 'Second part.']))
+    def test_chat_stream_sends_chunks_and_done(self, stream):
+        self.client.force_authenticate(user=self.student_user)
+        url = reverse('chat_stream', args=[self.course.pk])
+        response = self.client.post(url, {'content': 'What is a variable?'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.count('event: chunk'), 2)
+        self.assertIn('event: done', body)
+        self.assertIsNotNone(answer_cache.get(self.course.pk, Course.get_context(self.course.pk), 'what is a variable'))
+
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    @mock.patch('Course.chat.stream_google_ai')
+    def test_chat_stream_error_is_not_cached(self, stream, ask):
+        def failing(context, question):
+            yield 'Partial first block.\n\n'
+            raise RuntimeError('The provider closed the stream')
+        stream.side_effect = failing
+        self.client.force_authenticate(user=self.student_user)
+        with self.assertLogs('Course.chat', 'ERROR'):
+            response = self.client.post(reverse('chat_stream', args=[self.course.pk]), {'content': 'What is a variable?'})
+            body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.count('event: chunk'), 1)
+        self.assertTrue(body.rstrip().split('\n\n')[-1].startswith('event: error'))
+        self.assertNotIn('event: done', body)
+
+        response = self.client.post(reverse('chat', args=[self.course.pk]), {'content': 'What is a variable?'})
+        self.assertEqual(response.data['answer'], '<p>An answer</p>')
+        self.assertEqual(ask.call_count, 1)
+
+    @override_settings(CHAT_LIMITS={
+        **settings.CHAT_LIMITS, 'CONCURRENCY': {'LIMIT': 1, 'QUEUE_SIZE': 0, 'QUEUE_TIMEOUT': 3},
+    })
+    @mock.patch('Course.chat.stream_google_ai', return_value=iter(['An answer.']))
+    def test_chat_stream_busy_model(self, stream):
+        slot = get_llm_limiter().acquire()
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.post(reverse('chat_stream', args=[self.course.pk]), {'content': 'What is a variable?'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertFalse(stream.called)
+        get_llm_limiter().release(slot)
+
+    @mock.patch('Course.chat.ask_google_ai_async', new_callable=mock.AsyncMock, return_value='<p>An answer</p>')
+    def test_chat_async(self, ask):
+        url = reverse('chat_async', args=[self.course.pk])
+        response = self.client.post(url, {'content': 'What is a variable?'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        token = AccessToken.for_user(self.student_user)
+        response = self.client.post(url, {'content': 'What is a variable?'}, format='json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.json(), {'answer': '<p>An answer</p>'})
+
+    @override_settings(CHAT_LIMITS={**settings.CHAT_LIMITS, 'USER': {'RATE': 0.001, 'BURST': 1}})
+    @mock.patch('Course.chat.ask_google_ai_async', new_callable=mock.AsyncMock, return_value='<p>An answer</p>')
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    def test_chat_endpoints_reject_the_same_requests(self, ask, ask_async):
+        token = AccessToken.for_user(self.student_user)
+        results = {}
+        for name in ('chat', 'chat_async'):
+            caches['default'].clear()
+            url = reverse(name, args=[self.course.pk])
+            responses = [
+                self.client.post(url, {'content': 'What is a variable?'}, format='json'),
+                self.client.post(url, {'content': 'What is a variable?'}, format='json', HTTP_AUTHORIZATION='Bearer invalid'),
+                self.client.post(url, '{', content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}'),
+                self.client.post(url, {'content': 'What is a variable?'}, format='json', HTTP_AUTHORIZATION=f'Bearer {token}'),
+            ]
+            results[name] = [(response.status_code, response.get('Retry-After')) for response in responses]
+        self.assertEqual(results['chat'], results['chat_async'])
+        self.assertEqual([code for code, _ in results['chat']], [401, 401, 400, 429])
+
+    @override_settings(LLM_PROVIDER={'BACKEND': 'Course.utils.StubProvider'})
+    def test_chat_with_stub_provider(self):
+        self.assertIs(get_provider(), get_provider())
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.post(reverse('chat', args=[self.course.pk]), {'content': 'What is a variable?'})
+        self.assertTrue(response.data['answer'].startswith('<p>Stub answer'))
+
+    @override_settings(LLM_PROVIDER={'BACKEND': 'Course.utils.GoogleAIProvider', 'OPTIONS': {'api_key': None}})
+    def test_chat_without_api_key(self):
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.post(reverse('chat', args=[self.course.pk]), {'content': 'What is a variable?'})
+        self.assertEqual(response.data['answer'], NO_RESPONSE)
+
+    @override_settings(LLM_PROVIDER={'BACKEND': 'Course.utils.GoogleAIProvider', 'OPTIONS': {'api_key': None}, 'REQUIRED': True})
+    def test_provider_check_without_api_key(self):
+        with self.assertLogs('Course.utils', 'ERROR') as logs:
+            self.assertEqual([error.id for error in check_llm_provider(None)], ['Course.E001'])
+            for _ in range(3):
+                self.assertEqual(ask_google_ai('Context', 'What is a variable?'), NO_RESPONSE)
+        self.assertEqual(len(logs.records), 1)
+        with self.assertRaises(ImproperlyConfigured):
+            require_llm_provider()
+
+    def test_semantic_cache_serves_paraphrases_and_rebuilds(self):
+        cache = SemanticAnswerCache(threshold=0.8, max_size=10)
+        context = Course.get_context(self.course.pk)
+        cache.set(self.course.pk, context, "What's recursion?", '<p>Recursion</p>')
+        self.assertEqual(cache.get(self.course.pk, context, 'what is recursion please'), '<p>Recursion</p>')
+        self.assertIsNone(cache.get(self.course.pk, context, 'what is a loop?'))
+        self.assertEqual(QuestionAnswer.objects.filter(course=self.course).count(), 1)
+
+        cache.invalidate_course(self.course.pk)
+        self.assertEqual(cache.get(self.course.pk, context, 'What is recursion?'), '<p>Recursion</p>')
+        self.assertIsNone(cache.get(self.course.pk, 'Another context', 'What is recursion?'))
+
+    def test_semantic_cache_keeps_question_words_and_negations(self):
+        cache = SemanticAnswerCache(threshold=0.8, max_size=10)
+        context = Course.get_context(self.course.pk)
+        cache.set(self.course.pk, context, 'What is recursion?', '<p>Recursion</p>')
+        cache.set(self.course.pk, context, 'Why is recursion slow?', '<p>Slow</p>')
+        self.assertIsNone(cache.get(self.course.pk, context, 'How is recursion?'))
+        self.assertIsNone(cache.get(self.course.pk, context, "Why isn't recursion slow?"))
+        self.assertEqual(cache.get(self.course.pk, context, 'why is recursion so slow'), '<p>Slow</p>')
+
+    def test_vector_index_grows(self):
+        index = CourseVectorIndex(dimensions=8, max_size=40, initial_size=4)
+        self.assertEqual(index.vectors.shape, (4, 8))
+        for i in range(50):
+            index.add(np.eye(8, dtype=np.float32)[i % 8], i)
+            self.assertEqual(index.size, min(i + 1, 40))
+        self.assertEqual(index.vectors.shape, (40, 8))
+        # The oldest answers were replaced
+        self.assertEqual(sorted(index.answers), list(range(10, 50)))
+        score, answer = index.search(np.eye(8, dtype=np.float32)[1])
+        self.assertEqual((score, answer % 8), (1.0, 1))
+
+    def test_prune_question_answers(self):
+        cache = SemanticAnswerCache(threshold=0.8, max_size=10, max_age=3600)
+        context = Course.get_context(self.course.pk)
+        for topic in ('recursion', 'loops', 'variables', 'classes'):
+            cache.set(self.course.pk, context, f'What is {topic}?', f'<p>{topic}</p>')
+        cache.set(self.course.pk, 'Previous context', 'What is a module?', '<p>Modules</p>')
+        QuestionAnswer.objects.filter(question='What is recursion?').update(creation_date=timezone.now() - timedelta(hours=2))
+        cache.clear()
+        self.assertIsNone(cache.get(self.course.pk, context, 'What is recursion?'))
+
+        out = io.StringIO()
+        call_command('prune_question_answers', '--max-age', '3600', '--max-size', '2', stdout=out)
+        self.assertIn('3 questions and answers deleted', out.getvalue())
+        self.assertEqual(
+            list(QuestionAnswer.objects.order_by('id').values_list('question', flat=True)), ['What is variables?', 'What is classes?']
+        )
+
+    @override_settings(CHAT_LIMITS={
+        'USER': {'RATE': 0.1, 'BURST': 2},
+        'COURSE': {'RATE': 100, 'BURST': 100},
+        'CONCURRENCY': {'LIMIT': 4, 'QUEUE_SIZE': 4, 'QUEUE_TIMEOUT': 1},
+    })
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    def test_chat_user_throttle(self, ask):
+        self.client.force_authenticate(user=self.student_user)
+        url = reverse('chat', args=[self.course.pk])
+        for i in range(2):
+            self.assertEqual(self.client.post(url, {'content': f'Question {i}'}).status_code, status.HTTP_200_OK)
+        response = self.client.post(url, {'content': 'Question 3'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '10')
+
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    def test_chat_job_mode(self, ask):
+        self.client.force_authenticate(user=self.student_user)
+        url = reverse('chat', args=[self.course.pk]) + '?mode=job'
+        with self.settings(CHAT_JOBS={**settings.CHAT_JOBS, 'RUN_IN_PROCESS': False}):
+            response = self.client.post(url, {'content': 'What is a variable?'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        job_url = reverse('chat_job', args=[response.data['id']])
+
+        self.assertTrue(process_next_job())
+        self.assertFalse(process_next_job())
+        response = self.client.get(job_url + '?wait=5')
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(response.data['answer'], '<p>An answer</p>')
+
+        self.client.force_authenticate(user=self.instructor_user)
+        self.assertEqual(self.client.get(job_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CHAT_JOBS={**settings.CHAT_JOBS, 'MAX_WAIT': 0.2, 'POLL_INTERVAL': 0.05})
+    def test_chat_job_wait_is_capped(self):
+        self.assertFalse(settings.CHAT_JOBS['RUN_IN_PROCESS'])
+        job = ChatJob.objects.create(course=self.course, student=self.student_user, question='Pending')
+        self.client.force_authenticate(user=self.student_user)
+        start = time.monotonic()
+        response = self.client.get(reverse('chat_job', args=[job.pk]) + '?wait=60')
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(response.data['status'], 'pending')
+
+    def test_chat_jobs_are_taken_by_priority(self):
+        other_course = Course.objects.create(
+            name='Other Course', instructor=self.instructor_user, description='Other', context='Other'
+        )
+        first = ChatJob.objects.create(course=self.course, student=self.student_user, question='First')
+        urgent = ChatJob.objects.create(course=other_course, student=self.student_user, question='Urgent', priority=5)
+        with mock.patch('Course.jobs.answer_question', return_value='<p>An answer</p>') as answer:
+            process_next_job()
+            process_next_job()
+        self.assertEqual([call.args[1] for call in answer.call_args_list], [urgent.question, first.question])
+
+    def test_throttled_chat_job_is_postponed(self):
+        job = ChatJob.objects.create(course=self.course, student=self.student_user, question='Busy')
+        with mock.patch('Course.jobs.answer_question', side_effect=Throttled(wait=10)) as answer:
+            self.assertTrue(process_next_job())
+            self.assertFalse(process_next_job())
+        self.assertEqual(answer.call_count, 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertGreater(job.not_before, timezone.now() + timedelta(seconds=5))
+
+    def test_chat_job_for_missing_course(self):
+        self.client.force_authenticate(user=self.student_user)
+        url = reverse('chat', args=[self.course.pk + 100]) + '?mode=job'
+        with self.settings(CHAT_JOBS={**settings.CHAT_JOBS, 'RUN_IN_PROCESS': False}):
+            response = self.client.post(url, {'content': 'What is a variable?'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(ChatJob.objects.exists())
+
+
+class CourseRetrievalTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.topics = ['variables', 'loops', 'recursion', 'classes', 'exceptions', 'modules']
+        self.context = '\n\n'.join(f'{topic} ' + ' '.join(['filler'] * 80) for topic in self.topics)
+
+    def test_split_into_chunks(self):
+        chunks = split_into_chunks(' '.join(str(i) for i in range(250)), chunk_words=100, overlap_words=10)
+        self.assertEqual([len(chunk.split()) for chunk in chunks], [100, 100, 70])
+        self.assertEqual(chunks[1].split()[0], '90')
+
+    def test_create_course_builds_chunks_and_chat_retrieves_relevant_ones(self):
+        self.client.force_authenticate(user=self.instructor_user)
+        data = {
+            'name': 'Python',
+            'instructor': self.instructor_user.id,
+            'description': 'A long course',
+            'context': self.context
+        }
+        response = self.client.post(reverse('instructor_register'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        course_id = response.data['id']
+        self.assertEqual(CourseChunk.objects.filter(course_id=course_id).count(), len(self.topics))
+
+        context = retrieve_context(course_id, 'How does recursion work?', Course.get_context(course_id), top_k=1)
+        self.assertTrue(context.startswith('Python: '))
+        self.assertIn('recursion', context)
+        self.assertNotIn('loops', context)
+
+        # The chunks are rebuilt between the two queries
+        with mock.patch('Course.retrieval.rank_chunks', return_value=[(1.0, len(self.topics) + 1)]):
+            self.assertEqual(retrieve_context(course_id, 'recursion', 'Whole context', top_k=1), 'Whole context')
+
+
+class SingleFlightTestCase(SimpleTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.calls = 0
+
+    def slow_answer(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return 'answer'
+
+    def test_concurrent_duplicates_share_one_call(self):
+        flight = SingleFlight(caches['default'])
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda _: flight.do('key', self.slow_answer), range(10)))
+        self.assertEqual(results, ['answer'] * 10)
+        self.assertEqual(self.calls, 1)
+
+    def test_duplicates_in_other_workers_wait_for_the_shared_result(self):
+        # Two coalescers sharing the cache stand for two worker processes
+        first, second = SingleFlight(caches['default']), SingleFlight(caches['default'], poll_interval=0.01)
+        thread = threading.Thread(target=first.do, args=('key', self.slow_answer))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(second.do('key', self.slow_answer), 'answer')
+        thread.join()
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_async_duplicates_share_one_call(self):
+        flight = SingleFlight(caches['default'])
+
+        async def slow_answer():
+            self.calls += 1
+            await asyncio.sleep(0.1)
+            return 'answer'
+
+        async def ask_all():
+            return await asyncio.gather(*(flight.ado('key', slow_answer) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(ask_all()), ['answer'] * 10)
+        self.assertEqual(self.calls, 1)
+
+    def test_failures_are_not_shared(self):
+        flight = SingleFlight(caches['default'])
+        self.assertIsNone(flight.do('key', lambda: None))
+        self.assertEqual(flight.do('key', self.slow_answer), 'answer')
+
+
+class ConcurrencyLimiterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_rejects_when_queue_is_full(self):
+        limiter = ConcurrencyLimiter(limit=1, queue_size=0, queue_timeout=1)
+        slot = limiter.acquire()
+        with self.assertRaises(Throttled):
+            limiter.acquire()
+        limiter.release(slot)
+        limiter.release(limiter.acquire())
+
+    def test_queued_call_gets_the_freed_slot(self):
+        limiter = ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=2, poll_interval=0.01)
+        slot = limiter.acquire()
+        threading.Timer(0.1, limiter.release, args=[slot]).start()
+        start = time.monotonic()
+        limiter.release(limiter.acquire())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_waiting_call_times_out(self):
+        limiter = ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=0.1, poll_interval=0.01)
+        limiter.acquire()
+        with self.assertRaises(Throttled):
+            limiter.acquire()
+
+    def test_waiting_calls_back_off(self):
+        with mock.patch('Course.throttling.random.uniform', side_effect=lambda low, high: high):
+            delays = list(itertools.islice(backoff(0.01, 0.05, time.monotonic() + 60), 5))
+        self.assertEqual(delays, [0.01, 0.02, 0.04, 0.05, 0.05])
+        self.assertEqual(list(backoff(0.01, 0.05, time.monotonic())), [])
+
+    @override_settings(CHAT_LIMITS={**settings.CHAT_LIMITS, 'USER': {'RATE': 0.001, 'BURST': 5}})
+    def test_token_bucket_under_concurrent_requests(self):
+        request = SimpleNamespace(user=SimpleNamespace(id=1))
+        get = LocMemCache.get
+
+        def slow_get(cache, *args, **kwargs):
+            # A round trip to a shared cache, long enough for the requests to interleave
+            value = get(cache, *args, **kwargs)
+            time.sleep(0.002)
+            return value
+
+        with mock.patch.object(LocMemCache, 'get', slow_get), ThreadPoolExecutor(max_workers=8) as executor:
+            allowed = list(executor.map(lambda _: UserChatThrottle().allow_request(request, None), range(40)))
+        self.assertEqual(allowed.count(True), 5)
+
+
+class CoursePaginationTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        Course.objects.bulk_create(
+            Course(name=f'Course {i % 3}', instructor=self.instructor_user, description='A course', context='Context')
+            for i in range(7)
+        )
+        caches['default'].clear()
+        self.client.force_authenticate(user=self.student_user)
+
+    def test_list_without_pagination_params_gets_first_page(self):
+        response = self.client.get(reverse('student_list'))
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+        caches['default'].clear()
+        with mock.patch.object(KeysetPagination, 'page_size', 5):
+            response = self.client.get(reverse('student_list'))
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_cursor_pages_cover_every_course_once_in_order(self):
+        url = reverse('student_list') + '?page_size=3'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend((course['name'], course['id']) for course in response.data['results'])
+            url = response.data['next']
+            # Rows inserted before the cursor must not shift the next pages
+            Course.objects.create(name='A new course', instructor=self.instructor_user, description='New', context='New')
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('student_list') + '?cursor=nope')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CourseListQueriesTestCase(UserFixturesMixin, APITestCase):
+
+    def create_courses(self, count):
+        User.objects.bulk_create(
+            User(first_name=f'instructor{i}', last_name='test', email=f'instructor{i}@gmail.com', rol='Profesor')
+            for i in range(count)
+        )
+        instructors = User.objects.filter(rol='Profesor')
+        Course.objects.bulk_create(
+            Course(name=f'Course {i}', instructor=instructor, description='A course', context='Context')
+            for i, instructor in enumerate(instructors)
+        )
+        courses = Course.objects.all()
+        FavoriteCourse.objects.bulk_create(FavoriteCourse(student=self.student_user, course=course) for course in courses)
+        return instructors[0]
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        for count in (1, 100, 1000):
+            with self.subTest(count=count):
+                FavoriteCourse.objects.all().delete()
+                Course.objects.all().delete()
+                User.objects.filter(rol='Profesor').delete()
+                instructor = self.create_courses(count)
+                caches['default'].clear()
+
+                self.client.force_authenticate(user=self.student_user)
+                with self.assertNumQueries(1):
+                    response = self.client.get(reverse('student_list'))
+                self.assertEqual(len(response.data['results']), min(count, 50))
+                with self.assertNumQueries(1):
+                    response = self.client.get(reverse('student_courses_favorites_list'))
+                self.assertEqual(len(response.data['results']), min(count, 50))
+
+                self.client.force_authenticate(user=instructor)
+                with self.assertNumQueries(1):
+                    self.client.get(reverse('instructor_list'))
+
+
+class CourseQueryBudgetTestCase(QueryBudgetMixin, UserFixturesMixin, APITestCase):
+    query_budgets = {
+        'student_list': 1,
+        'instructor_list': 1,
+        'student_courses_favorites_list': 1,
+        'chat': 2,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.instructor_user,
+            description='A test course',
+            context='Test context'
+        )
+        FavoriteCourse.objects.create(student=self.student_user, course=self.course)
+        answer_cache.clear()
+        caches['default'].clear()
+
+    def test_endpoints_within_budget(self):
+        self.client.force_authenticate(user=self.student_user)
+        self.client.get(reverse('student_list'))
+        self.client.get(reverse('student_courses_favorites_list'))
+        with override_settings(LLM_PROVIDER={'BACKEND': 'Course.utils.StubProvider'}):
+            self.client.post(reverse('chat', args=[self.course.pk]), {'content': 'What is the context?'}, format='json')
+        self.client.force_authenticate(user=self.instructor_user)
+        self.client.get(reverse('instructor_list'))
+
+        self.assertEqual(endpoint_stats.get('student_list')['requests'], 1)
+        self.assertEqual(endpoint_stats.get('chat')['requests'], 1)
+
+    def test_budget_exceeded_fails(self):
+        self.client.force_authenticate(user=self.student_user)
+        self.client.get(reverse('student_list'))
+        self.query_budgets = {'student_list': 0}
+        with self.assertRaises(AssertionError):
+            self.assertQueryBudgets()
+        self.query_budgets = CourseQueryBudgetTestCase.query_budgets
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.get(reverse('student_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;desc="1 queries";dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+
+
+class FavoriteCourseIndexTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.instructor_user,
+            description='A test course',
+            context='Test context'
+        )
+
+    def test_create_is_a_single_upsert(self):
+        with self.assertNumQueries(1):
+            favorite = FavoriteCourse.create(student=self.student_user, course=self.course)
+        self.assertIsNotNone(favorite.id)
+
+        FavoriteCourse.objects.filter(pk=favorite.id).update(active=False)
+        with self.assertNumQueries(1):
+            reactivated = FavoriteCourse.create(student=self.student_user, course=self.course)
+        self.assertEqual(reactivated.id, favorite.id)
+        self.assertEqual(FavoriteCourse.objects.filter(student=self.student_user, course=self.course).count(), 1)
+        self.assertTrue(FavoriteCourse.objects.get(pk=favorite.id).active)
+
+    def test_add_and_delete_favorite_endpoints(self):
+        self.client.force_authenticate(user=self.student_user)
+        data = {'student': self.student_user.id, 'course': self.course.id}
+        for _ in range(2):
+            response = self.client.post(reverse('student_courses_favorites_add'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(FavoriteCourse.objects.count(), 1)
+
+        response = self.client.post(reverse('student_courses_favorites_delete'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(FavoriteCourse.objects.get().active)
+
+    def test_list_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The plans checked are the ones of SQLite.')
+        Course.objects.bulk_create(
+            Course(name=f'Course {i}', instructor=self.instructor_user, description='A course', context='Context')
+            for i in range(2000)
+        )
+        FavoriteCourse.create(student=self.student_user, course=self.course)
+
+        self.assertIn('course_active_name_idx', Course.objects.filter(active=True).explain())
+        self.assertIn(
+            'course_instructor_active_idx',
+            Course.objects.filter(instructor__id=self.instructor_user.id, active=True).explain()
+        )
+        self.assertIn(
+            'favorite_student_active_idx',
+            FavoriteCourse.objects.filter(student=self.student_user, course__active=True, active=True).explain()
+        )
+
+
+class DedupeFavoritesTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.student_user = User.objects.create_user(
+            first_name='student',
+            last_name='test',
+            email='student@gmail.com',
+            password='password',
+            rol='Estudiante'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.student_user,
+            description='A test course',
+            context='Test context'
+        )
+        # A table created before the unique constraint
+        self.constraint = FavoriteCourse._meta.constraints[0]
+        # SQLite rebuilds the table from the constraints of the model
+        with mock.patch.object(FavoriteCourse._meta, 'constraints', []), connection.schema_editor() as editor:
+            editor.remove_constraint(FavoriteCourse, self.constraint)
+
+    def tearDown(self):
+        FavoriteCourse.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(FavoriteCourse, self.constraint)
+
+    def test_repeated_favorites_are_merged(self):
+        first, *_ = FavoriteCourse.objects.bulk_create(
+            FavoriteCourse(student=self.student_user, course=self.course, active=active) for active in (False, True, False)
+        )
+        out = io.StringIO()
+        call_command('dedupe_favorites', stdout=out)
+        self.assertIn('2 repeated favorites deleted', out.getvalue())
+        favorite = FavoriteCourse.objects.get()
+        self.assertEqual(favorite.id, first.id)
+        self.assertTrue(favorite.active)
+
+
+class BulkFavoriteCourseTestCase(QueryBudgetMixin, UserFixturesMixin, APITestCase):
+    # Includes the savepoint queries of the transaction inside the test transaction
+    query_budgets = {
+        'student_courses_favorites_bulk_add': 5,
+        'student_courses_favorites_bulk_delete': 5,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.courses = [
+            Course.objects.create(name=f'Course {i}', instructor=self.instructor_user, description='A course', context='Context')
+            for i in range(3)
+        ]
+        self.inactive_course = Course.objects.create(
+            name='Inactive', instructor=self.instructor_user, description='A course', context='Context', active=False
+        )
+
+    def test_bulk_add_and_delete(self):
+        self.client.force_authenticate(user=self.student_user)
+        FavoriteCourse.create(student=self.student_user, course=self.courses[0])
+        ids = [course.id for course in self.courses]
+        data = {'student': self.student_user.id, 'courses': ids + [self.inactive_course.id, 9999, ids[1]]}
+
+        response = self.client.post(reverse('student_courses_favorites_bulk_add'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'course': ids[0], 'result': 'unchanged'},
+            {'course': ids[1], 'result': 'added'},
+            {'course': ids[2], 'result': 'added'},
+            {'course': self.inactive_course.id, 'result': 'inactive'},
+            {'course': 9999, 'result': 'not_found'},
+        ])
+        self.assertEqual(FavoriteCourse.objects.filter(student=self.student_user, active=True).count(), 3)
+
+        data = {'student': self.student_user.id, 'courses': ids[:2]}
+        response = self.client.post(reverse('student_courses_favorites_bulk_delete'), data, format='json')
+        self.assertEqual(response.data['results'], [
+            {'course': ids[0], 'result': 'removed'},
+            {'course': ids[1], 'result': 'removed'},
+        ])
+        self.assertEqual(list(FavoriteCourse.objects.filter(active=True).values_list('course_id', flat=True)), [ids[2]])
+
+        response = self.client.post(reverse('student_courses_favorites_bulk_add'), data, format='json')
+        self.assertEqual([result['result'] for result in response.data['results']], ['added', 'added'])
+        self.assertEqual(FavoriteCourse.objects.count(), 3)
+
+    def test_bulk_add_for_another_student_is_forbidden(self):
+        self.client.force_authenticate(user=self.student_user)
+        data = {'student': self.instructor_user.id, 'courses': [self.courses[0].id]}
+        response = self.client.post(reverse('student_courses_favorites_bulk_add'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_add_only_for_students(self):
+        self.client.force_authenticate(user=self.instructor_user)
+        data = {'student': self.instructor_user.id, 'courses': [self.courses[0].id]}
+        response = self.client.post(reverse('student_courses_favorites_bulk_add'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(FavoriteCourse.objects.exists())
+
+
+class CourseImportTestCase(UserFixturesMixin, APITestCase):
+
+    def upload(self, name, content):
+        return SimpleUploadedFile(name, content.encode())
+
+    def test_import_csv(self):
+        long_context = '\n\n'.join(' '.join(f'topic{i}' for _ in range(100)) for i in range(8))
+        content = (
+            'name,description,context,active\n'
+            'Course A,First course,"Some context",true\n'
+            ',No name,Context,true\n'
+            f'Course B,Long course,"{long_context}",false\n'
+        )
+        self.client.force_authenticate(user=self.instructor_user)
+        response = self.client.post(reverse('instructor_import'), {'file': self.upload('courses.csv', content)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['error_count'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        self.assertIn('name', response.data['errors'][0]['errors'])
+
+        course_a = Course.objects.get(name='Course A')
+        course_b = Course.objects.get(name='Course B')
+        self.assertEqual(course_a.instructor, self.instructor_user)
+        self.assertFalse(course_b.active)
+        self.assertFalse(CourseChunk.objects.filter(course=course_a).exists())
+        self.assertTrue(CourseChunk.objects.filter(course=course_b).exists())
+
+    def test_import_jsonl(self):
+        content = (
+            '{"name": "Course A", "description": "First course", "context": "Some context"}\n'
+            'not json\n'
+            '\n'
+            '{"name": "Course B", "description": "Second course", "context": "' + 'word ' * 300000 + '"}\n'
+        )
+        self.client.force_authenticate(user=self.instructor_user)
+        response = self.client.post(reverse('instructor_import'), {'file': self.upload('courses.txt', content), 'format': 'jsonl'})
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 4])
+        self.assertEqual(response.data['errors'][1]['errors']['context'], ['The context is too long.'])
+
+    def test_import_rows_not_utf8(self):
+        content = (
+            'name,description,context\n'
+            'Course A,First course,Some context\n'.encode()
+            + 'Curso B,Descripción,Contexto\n'.encode('latin-1')
+            + 'Course C,Third course,"Multi\nline context"\n'.encode()
+            + 'Curso D,Introducción,Contexto\n'.encode('latin-1')
+        )
+        self.client.force_authenticate(user=self.instructor_user)
+        response = self.client.post(reverse('instructor_import'), {'file': SimpleUploadedFile('courses.csv', content)})
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 6])
+
+        content = b'{"name": "Course E", "description": "\xe9", "context": "Context"}\n'
+        response = self.client.post(reverse('instructor_import'), {'file': SimpleUploadedFile('courses.jsonl', content)})
+        self.assertEqual([error['row'] for error in response.data['errors']], [1])
+
+    def test_import_jsonl_surrogates(self):
+        content = '{"name": "Course A", "description": "Bad \\ud800 escape", "context": "Context"}\n'
+        self.client.force_authenticate(user=self.instructor_user)
+        response = self.client.post(reverse('instructor_import'), {'file': self.upload('courses.jsonl', content)})
+        self.assertEqual(response.data['created'], 0)
+        self.assertIn('description', response.data['errors'][0]['errors'])
+
+    def test_import_only_for_professors(self):
+        self.client.force_authenticate(user=self.student_user)
+        content = 'name,description,context\nCourse A,First course,Some context\n'
+        response = self.client.post(reverse('instructor_import'), {'file': self.upload('courses.csv', content)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Course.objects.exists())
+
+    def test_import_unknown_format(self):
+        self.client.force_authenticate(user=self.instructor_user)
+        response = self.client.post(reverse('instructor_import'), {'file': self.upload('courses.xlsx', 'x')})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            first_name='admin',
+            last_name='test',
+            email='admin@gmail.com',
+            password='password',
+            rol='Profesor'
+        )
+        self.courses = [
+            Course.objects.create(name=f'Course {i}', instructor=self.admin_user, description='A course', context=f'Context, "{i}"')
+            for i in range(3)
+        ]
+        FavoriteCourse.create(student=self.student_user, course=self.courses[1])
+
+    def get_export(self, kind, **params):
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.get(reverse('export', args=[kind]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_export_courses_csv(self):
+        response, content = self.get_export('courses', columns='id,name,context')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], ['id', 'name', 'context'])
+        self.assertEqual(rows[1:], [[str(course.id), course.name, course.context] for course in self.courses])
+
+    def test_export_favorites_json_gzip(self):
+        response, content = self.get_export('favorites', output='json', columns='student_email,course_name,active', gzip='true')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="favorites.json.gz"')
+        self.assertEqual(json.loads(gzip.decompress(content)), [
+            {'student_email': 'student@gmail.com', 'course_name': 'Course 1', 'active': True},
+        ])
+
+    def test_export_unknown_column(self):
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.get(reverse('export', args=['courses']), {'columns': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_only_for_admins(self):
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.get(reverse('export', args=['courses']))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ConditionalListTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.other_instructor = User.objects.create_user(
+            first_name='other',
+            last_name='test',
+            email='other@gmail.com',
+            password='password',
+            rol='Profesor'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.instructor_user,
+            description='A test course',
+            context='Test context'
+        )
+        caches['default'].clear()
+
+    def get_etag(self, url_name, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_not_modified_without_queries(self):
+        etag = self.get_etag('student_list', self.student_user)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('student_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.name = 'Renamed'
+            self.course.save()
+        response = self.client.get(reverse('student_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_query_string(self):
+        self.client.force_authenticate(user=self.student_user)
+        etag = self.client.get(reverse('student_list'))['ETag']
+        response = self.client.get(reverse('student_list'), {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_instructor_list_scopes(self):
+        etag = self.get_etag('instructor_list', self.instructor_user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Course.objects.create(name='Other', instructor=self.other_instructor, description='A course', context='Context')
+            self.other_instructor.first_name = 'renamed'
+            self.other_instructor.save()
+            self.instructor_user.last_login = timezone.now()
+            self.instructor_user.save(update_fields=['last_login'])
+        self.assertEqual(self.get_etag('instructor_list', self.instructor_user), etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instructor_user.first_name = 'renamed'
+            self.instructor_user.save()
+        self.assertNotEqual(self.get_etag('instructor_list', self.instructor_user), etag)
+
+    def test_favorites_list_bumped_by_bulk_paths(self):
+        etag = self.get_etag('student_courses_favorites_list', self.student_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteCourse.create(student=self.student_user, course=self.course)
+        new_etag = self.get_etag('student_courses_favorites_list', self.student_user)
+        self.assertNotEqual(new_etag, etag)
+        self.assertGreater(FavoriteCourse.objects.get().updated_at, self.course.creation_date)
+
+        data = {'student': self.student_user.id, 'courses': [self.course.id]}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('student_courses_favorites_bulk_delete'), data, format='json')
+        self.assertNotEqual(self.get_etag('student_courses_favorites_list', self.student_user), new_etag)
+
+    def test_favorites_bumped_after_commit(self):
+        scope = f'favorites:{self.student_user.pk}'
+        versions = get_versions([scope])
+        with self.captureOnCommitCallbacks() as callbacks:
+            data = {'student': self.student_user.id, 'courses': [self.course.id]}
+            self.client.force_authenticate(user=self.student_user)
+            self.client.post(reverse('student_courses_favorites_bulk_add'), data, format='json')
+            # Readers of the old rows must not cache them under a new version
+            self.assertEqual(get_versions([scope]), versions)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_versions([scope]), versions)
+
+    def test_import_bumps_course_lists(self):
+        etag = self.get_etag('student_list', self.student_user)
+        upload = SimpleUploadedFile('courses.csv', b'name,description,context\nNew,A course,Context\n')
+        self.client.force_authenticate(user=self.instructor_user)
+        self.client.post(reverse('instructor_import'), {'file': upload})
+        self.assertNotEqual(self.get_etag('student_list', self.student_user), etag)
+
+
+class TwoTierCacheTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_l1_hit_and_cross_worker_invalidation(self):
+        # Two workers: their own L1, the same L2
+        worker_a = TwoTierCache(caches['default'])
+        worker_b = TwoTierCache(caches['default'])
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(worker_a.get_or_set('value', ['courses'], compute), 1)
+        self.assertEqual(worker_a.get_or_set('value', ['courses'], compute), 1)
+        self.assertEqual(worker_a.l1.stats()['hits'], 1)
+        # Worker B finds the value in L2
+        self.assertEqual(worker_b.get_or_set('value', ['courses'], compute), 1)
+        self.assertEqual(len(calls), 1)
+
+        worker_b.bump('courses')
+        self.assertEqual(worker_a.get_or_set('value', ['courses'], compute), 2)
+        self.assertEqual(worker_b.get_or_set('value', ['courses'], compute), 2)
+
+    def test_model_signals_invalidate(self):
+        worker_a = TwoTierCache(caches['default'])
+        worker_b = TwoTierCache(caches['default'])
+
+        @worker_a.cached(key=lambda: 'names', scopes=lambda: ['courses'])
+        def course_names():
+            return list(Course.objects.values_list('name', flat=True))
+
+        self.assertEqual(course_names(), [])
+        # Saved in another worker, the signal bumps the shared version
+        with mock.patch('lab1_pi2.cache.tiered_cache', worker_b), self.captureOnCommitCallbacks(execute=True):
+            Course.objects.create(name='New', instructor=self.instructor_user, description='A course', context='Context')
+        self.assertEqual(course_names(), ['New'])
+
+    def test_queryset_helper(self):
+        worker = TwoTierCache(caches['default'])
+        Course.objects.create(name='New', instructor=self.instructor_user, description='A course', context='Context')
+        courses = worker.get_queryset('courses', ['courses'], Course.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(worker.get_queryset('courses', ['courses'], Course.objects.all()), courses)
+
+    def test_course_list_served_from_cache(self):
+        self.client.force_authenticate(user=self.instructor_user)
+        self.client.get(reverse('student_list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('student_list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Course.objects.create(name='New', instructor=self.instructor_user, description='A course', context='Context')
+        response = self.client.get(reverse('student_list'))
+        self.assertEqual([course['name'] for course in response.data['results']], ['New'])
+
+    def test_shared_cache_check(self):
+        with override_settings(TIERED_CACHE={**settings.TIERED_CACHE, 'REQUIRE_SHARED': True}):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['lab1_pi2.E001'])
+        with override_settings(TIERED_CACHE={**settings.TIERED_CACHE, 'REQUIRE_SHARED': False}):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['lab1_pi2.W001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/0'}}
+        with override_settings(CACHES=redis, TIERED_CACHE={**settings.TIERED_CACHE, 'REQUIRE_SHARED': True}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class CoursePromptCacheTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.instructor_user,
+            description='A test course',
+            context='Test context about variables'
+        )
+        answer_cache.clear()
+        caches['default'].clear()
+
+    def test_context_words_computed_on_save(self):
+        self.assertEqual(self.course.context_words, 4)
+        self.course.context = 'Shorter context'
+        self.course.save(update_fields=['context'])
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.context_words, 2)
+
+    def test_get_context_cached_until_saved(self):
+        Course.get_context(self.course.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(Course.get_context(self.course.pk), 'Test Course: Test context about variables')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.context = 'New context'
+            self.course.save()
+        self.assertEqual(Course.get_context(self.course.pk), 'Test Course: New context')
+        self.assertEqual(Course.get_context(0), 'Without context')
+
+    def test_toggle_invalidates_prompt(self):
+        Course.get_context(self.course.pk)
+        self.client.force_authenticate(user=self.instructor_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('instructor_delete', args=[self.course.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            Course.get_context(self.course.pk)
+
+    @mock.patch('Course.chat.ask_google_ai', return_value='<p>An answer</p>')
+    def test_warm_answer_does_no_queries(self, ask):
+        answer_question(self.course.pk, 'What is a variable?')
+        with self.assertNumQueries(0):
+            self.assertEqual(answer_question(self.course.pk, 'What is a variable?'), '<p>An answer</p>')
+        ask.assert_called_once()
+
+
+class CourseSearchTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.python = Course.objects.create(
+            name='Introducción a Python', instructor=self.instructor_user,
+            description='Programming basics', context='Variables, loops and functions'
+        )
+        self.algorithms = Course.objects.create(
+            name='Algorithms', instructor=self.instructor_user,
+            description='Sorting and graphs', context='Examples written in Python'
+        )
+        self.history = Course.objects.create(
+            name='History', instructor=self.instructor_user,
+            description='Ancient history', context='Rome and Greece'
+        )
+        caches['default'].clear()
+        self.client.force_authenticate(user=self.student_user)
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('student_search'), {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search_ranks_name_matches_first(self):
+        data = self.search('python')
+        self.assertEqual([course['id'] for course in data['results']], [self.python.pk, self.algorithms.pk])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.search('python loops')['results'][0]['id'], self.python.pk)
+        self.assertEqual(self.search('introduccion')['results'][0]['id'], self.python.pk)
+        self.assertEqual(self.search('"python" -* (')['results'][0]['id'], self.python.pk)
+        self.assertEqual(self.search('')['results'], [])
+
+    def test_search_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.history.context = 'Rome, Greece and the first Python scripts'
+            self.history.save()
+            Course.objects.filter(pk=self.algorithms.pk).update(active=False)
+        self.assertEqual({course['id'] for course in self.search('python')['results']}, {self.python.pk, self.history.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.python.delete()
+        self.assertEqual([course['id'] for course in self.search('python')['results']], [self.history.pk])
+
+    def test_search_paginated(self):
+        Course.objects.bulk_create(
+            Course(name=f'Python {i}', instructor=self.instructor_user, description='More', context='Python')
+            for i in range(5)
+        )
+        first = self.search('python', page_size=3)
+        self.assertEqual(len(first['results']), 3)
+        second = self.client.get(first['next']).data
+        self.assertEqual(len(second['results']), 3)
+        self.assertIsNotNone(second['next'])
+        ids = [course['id'] for course in first['results'] + second['results']]
+        self.assertEqual(len(set(ids)), 6)
+        response = self.client.get(reverse('student_search'), {'q': 'python', 'page': 0})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_reports_truncated_matches(self):
+        self.assertFalse(self.search('python')['truncated'])
+        # Another search, the previous response is cached
+        with self.settings(COURSE_SEARCH={**settings.COURSE_SEARCH, 'MAX_CANDIDATES': 1}):
+            self.assertFalse(self.search('python functions')['truncated'])
+            data = self.search('Python')
+        self.assertTrue(data['truncated'])
+        self.assertEqual(len(data['results']), 2)
+
+    def test_typeahead(self):
+        url = reverse('student_search_typeahead')
+        response = self.client.get(url, {'q': 'intro pyt'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'id': self.python.pk, 'name': 'Introducción a Python'}])
+        self.assertEqual(self.client.get(url, {'q': 'alg'}).data[0]['id'], self.algorithms.pk)
+        # Only the names are suggested, and a single letter is not enough
+        self.assertEqual(self.client.get(url, {'q': 'sorting'}).data, [])
+        self.assertEqual(self.client.get(url, {'q': 'h'}).data, [])
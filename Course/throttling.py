@@ -0,0 +1,277 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+
+def backoff(initial, maximum, deadline):
+    """
+    Get the delays between retries until a deadline, doubling from initial up to maximum.
+
+    Each delay is taken at random between half and all of its value, so that waiting
+    callers do not retry together, and never goes past the deadline.
+
+    Args:
+        initial (float): Seconds of the first delay.
+        maximum (float): Maximum seconds of a delay.
+        deadline (float): Value of time.monotonic after which no more delays are given.
+
+    Yields:
+        float: Seconds to wait before the next retry.
+    """
+    delay = initial
+    while (remaining := deadline - time.monotonic()) > 0:
+        yield min(random.uniform(delay / 2, delay), remaining)
+        delay = min(delay * 2, maximum)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle requests with a token bucket kept in the Django cache, so the limit holds across workers.
+
+    Each request takes a token; tokens refill at RATE per second up to BURST.
+    Subclasses set scope, the entry of settings.CHAT_LIMITS with the rate, and get_ident.
+
+    The bucket is read and written holding a lock key taken with cache.add, so that
+    concurrent requests in different workers do not take the same token. Requests
+    waiting for the lock retry with exponential backoff, and a request that cannot
+    take it in lock_wait seconds is throttled.
+    """
+    scope = None
+    lock_timeout = 1
+    lock_wait = 0.5
+    lock_poll_interval = 0.002
+    lock_max_interval = 0.1
+
+    def __init__(self):
+        config = settings.CHAT_LIMITS[self.scope]
+        self.rate = config['RATE']
+        self.burst = config['BURST']
+        self.retry_after = None
+
+    def get_ident(self, request, view):
+        """
+        Get the identifier of the bucket of a request.
+
+        Returns:
+            str: The identifier, or None to not throttle the request.
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        """
+        Take a token from the bucket of the request.
+
+        Returns:
+            bool: True if there was a token, False otherwise.
+        """
+        ident = self.get_ident(request, view)
+        if ident is None:
+            return True
+        key = f'throttle:{self.scope}:{ident}'
+        lock = uuid.uuid4().hex
+        if not self._lock(key, lock):
+            self.retry_after = self.lock_wait
+            return False
+        try:
+            now = time.time()
+            tokens, updated = cache.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.retry_after = (1 - tokens) / self.rate
+                return False
+            cache.set(key, (tokens - 1, now), math.ceil(self.burst / self.rate))
+            return True
+        finally:
+            if cache.get(f'{key}:lock') == lock:
+                cache.delete(f'{key}:lock')
+
+    def _lock(self, key, lock):
+        # The lock expires after lock_timeout seconds, in case its worker dies holding it
+        delays = backoff(self.lock_poll_interval, self.lock_max_interval, time.monotonic() + self.lock_wait)
+        while not cache.add(f'{key}:lock', lock, self.lock_timeout):
+            delay = next(delays, None)
+            if delay is None:
+                return False
+            time.sleep(delay)
+        return True
+
+    def wait(self):
+        """
+        Get the seconds until the next token, sent as the Retry-After header.
+        """
+        return self.retry_after
+
+
+class UserChatThrottle(TokenBucketThrottle):
+    """
+    Limit the questions a user can ask.
+    """
+    scope = 'USER'
+
+    def get_ident(self, request, view):
+        return request.user.id
+
+
+class CourseChatThrottle(TokenBucketThrottle):
+    """
+    Limit the questions asked in a course.
+    """
+    scope = 'COURSE'
+
+    def get_ident(self, request, view):
+        return view.kwargs.get('pk')
+
+
+class ConcurrencyLimiter:
+    """
+    Bound the calls to the model running at once in every worker, with a bounded wait queue.
+
+    Running calls and waiting calls hold slots in the Django cache that expire
+    after slot_timeout seconds, so slots of a worker that dies are not lost. Waiting
+    calls check for a free slot with exponential backoff, from poll_interval up to
+    max_poll_interval seconds, so a long queue does not keep the cache busy.
+    """
+    def __init__(self, limit, queue_size, queue_timeout, slot_timeout=120, poll_interval=0.05,
+                 max_poll_interval=1):
+        """
+        Args:
+            limit (int): Maximum calls running at once.
+            queue_size (int): Maximum calls waiting for a free slot.
+            queue_timeout (float): Seconds a call waits before giving up.
+            slot_timeout (int): Seconds after which a slot is freed even if not released.
+            poll_interval (float): Seconds before the first check for a free slot.
+            max_poll_interval (float): Maximum seconds between checks for a free slot.
+        """
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.slot_timeout = slot_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def _keys(self, prefix, count):
+        # Probe from a random slot so that concurrent callers rarely try the same ones
+        start = random.randrange(count) if count else 0
+        return (f'llm:{prefix}:{(start + offset) % count}' for offset in range(count))
+
+    def _take(self, prefix, count, token):
+        for key in self._keys(prefix, count):
+            if cache.add(key, token, self.slot_timeout):
+                return key
+        return None
+
+    def _free(self, key, token):
+        if key is not None and cache.get(key) == token:
+            cache.delete(key)
+
+    async def _atake(self, prefix, count, token):
+        for key in self._keys(prefix, count):
+            if await cache.aadd(key, token, self.slot_timeout):
+                return key
+        return None
+
+    async def _afree(self, key, token):
+        if key is not None and await cache.aget(key) == token:
+            await cache.adelete(key)
+
+    def _delays(self):
+        return backoff(self.poll_interval, self.max_poll_interval, time.monotonic() + self.queue_timeout)
+
+    def acquire(self):
+        """
+        Wait for a free slot.
+
+        Returns:
+            tuple: The slot, to be given to release.
+
+        Raises:
+            Throttled: If the queue is full or no slot was freed in queue_timeout seconds.
+        """
+        token = uuid.uuid4().hex
+        slot = self._take('slot', self.limit, token)
+        if slot is not None:
+            return slot, token
+        ticket = self._take('queue', self.queue_size, token)
+        if ticket is None:
+            raise Throttled(wait=self.queue_timeout, detail='Too many questions at once, try again later.')
+        try:
+            for delay in self._delays():
+                time.sleep(delay)
+                slot = self._take('slot', self.limit, token)
+                if slot is not None:
+                    return slot, token
+        finally:
+            self._free(ticket, token)
+        raise Throttled(wait=self.queue_timeout, detail='Too many questions at once, try again later.')
+
+    async def aacquire(self):
+        """
+        Asynchronous version of acquire.
+        """
+        token = uuid.uuid4().hex
+        slot = await self._atake('slot', self.limit, token)
+        if slot is not None:
+            return slot, token
+        ticket = await self._atake('queue', self.queue_size, token)
+        if ticket is None:
+            raise Throttled(wait=self.queue_timeout, detail='Too many questions at once, try again later.')
+        try:
+            for delay in self._delays():
+                await asyncio.sleep(delay)
+                slot = await self._atake('slot', self.limit, token)
+                if slot is not None:
+                    return slot, token
+        finally:
+            await self._afree(ticket, token)
+        raise Throttled(wait=self.queue_timeout, detail='Too many questions at once, try again later.')
+
+    def release(self, slot):
+        """
+        Free a slot taken with acquire.
+
+        Args:
+            slot (tuple): The slot returned by acquire.
+        """
+        self._free(*slot)
+
+    async def arelease(self, slot):
+        """
+        Asynchronous version of release.
+        """
+        await self._afree(*slot)
+
+
+_limiter = None
+
+
+def get_llm_limiter():
+    """
+    Get the limiter of calls to the model of this process, built once from settings.CHAT_LIMITS.
+
+    Returns:
+        ConcurrencyLimiter: The configured limiter.
+    """
+    global _limiter
+    if _limiter is None:
+        config = settings.CHAT_LIMITS['CONCURRENCY']
+        _limiter = ConcurrencyLimiter(config['LIMIT'], config['QUEUE_SIZE'], config['QUEUE_TIMEOUT'])
+    return _limiter
+
+
+@receiver(setting_changed)
+def reset_llm_limiter(setting, **kwargs):
+    """
+    Forget the configured limiter when settings.CHAT_LIMITS changes, e.g. in tests.
+    """
+    global _limiter
+    if setting == 'CHAT_LIMITS':
+        _limiter = None
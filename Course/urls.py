@@ -3,13 +3,23 @@ from .views import *
 
 urlpatterns = [
     path('instructor/create', Create.as_view(), name='instructor_register'),
+    path('instructor/import', ImportCourseView.as_view(), name='instructor_import'),
     path('instructor/list', ListOwnCourse.as_view(), name='instructor_list'),
     path('instructor/modify/<int:pk>', Modify.as_view(), name='instructor_modify'),
     path('instructor/delete/<int:pk>', DeleteCourseView.as_view(), name='instructor_delete'),
 
     path('student/<int:pk>/chat', Chat.as_view(), name='chat'),
+    path('student/<int:pk>/chat/async', chat_async, name='chat_async'),
+    path('student/chat/jobs/<int:pk>', ChatJobView.as_view(), name='chat_job'),
+    path('student/<int:pk>/chat/stream', ChatStream.as_view(), name='chat_stream'),
+    path('export/<str:kind>', ExportView.as_view(), name='export'),
+    path('chat/cache/stats', ChatCacheStats.as_view(), name='chat_cache_stats'),
     path('student/list', List.as_view(), name='student_list'),
+    path('student/search', SearchCourseView.as_view(), name='student_search'),
+    path('student/search/typeahead', TypeaheadCourseView.as_view(), name='student_search_typeahead'),
     path('student/course/favorites/add', AddCourseFavoriteView.as_view(), name='student_courses_favorites_add'),
     path('student/course/favorites/delete', DeleteFavoriteCourseView.as_view(), name='student_courses_favorites_delete'),
+    path('student/course/favorites/bulk/add', BulkAddFavoriteCourseView.as_view(), name='student_courses_favorites_bulk_add'),
+    path('student/course/favorites/bulk/delete', BulkDeleteFavoriteCourseView.as_view(), name='student_courses_favorites_bulk_delete'),
     path('student/course/favorites/list', ListFavoriteCourseView.as_view(), name='student_courses_favorites_list'),
 ]
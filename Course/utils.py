@@ -1,7 +1,21 @@
-import json
+import asyncio
+import hashlib
+import logging
+import threading
+import time
 
 import google.generativeai as genai
 import markdown
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+NO_RESPONSE = "No response"
 
 
 def validate_context(value):
@@ -18,48 +32,304 @@ def validate_context(value):
     return len(words) <= 40
 
 
-def get_secret_key():
+def build_prompt(context, question):
     """
-    Get the OpenAI API key from secrets.json.
+    Build the prompt sent to the model.
+
+    Args:
+        context (str): The context to use for the question.
+        question (str): The question to ask.
 
     Returns:
-        str: The OpenAI API key.
+        str: The prompt.
+    """
+    return f'''using the context: {context}
+answer the next question: {question} in maximum 150 words. 
+If the answer is not related to the context, 
+give the following answer: "The question is not related to the course". 
+Provide your answer using the language used in the question.'''
+
+
+class LLMProvider:
+    """
+    Base class of the language model backends used to answer questions.
     """
-    with open('secrets.json') as f:
-        secrets = json.load(f)
-    return secrets.get('api_key')
+    def generate(self, prompt):
+        """
+        Generate the answer to a prompt.
+
+        Args:
+            prompt (str): The prompt.
+
+        Returns:
+            str: The raw markdown answer.
+        """
+        raise NotImplementedError
+
+    async def agenerate(self, prompt):
+        """
+        Asynchronous version of generate.
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """
+        Generate the answer to a prompt as it is produced.
+
+        Args:
+            prompt (str): The prompt.
+
+        Yields:
+            str: Raw markdown chunks of the answer.
+        """
+        raise NotImplementedError
+
+
+class GoogleAIProvider(LLMProvider):
+    """
+    Google AI (Gemini) backend.
+
+    The client is configured once, so its connections are reused across questions.
+    """
+    def __init__(self, api_key=None, model='gemini-pro'):
+        """
+        Args:
+            api_key (str): The Google AI API key.
+            model (str): The name of the Gemini model.
+
+        Raises:
+            ImproperlyConfigured: If no API key is given.
+        """
+        if not api_key:
+            raise ImproperlyConfigured('LLM_PROVIDER needs an api_key for GoogleAIProvider.')
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    async def agenerate(self, prompt):
+        response = await self.model.generate_content_async(prompt)
+        return response.text
 
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
 
 
-def ask_google_ai(context, question, model="gpt-3.5-turbo-16k"):
+class StubProvider(LLMProvider):
     """
-    Ask a question to the OpenAI model.
+    Deterministic local backend with a configurable latency, for tests and benchmarks.
+    """
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency (float): Seconds taken to generate each answer.
+        """
+        self.latency = latency
+
+    def answer(self, prompt):
+        """
+        Get the answer to a prompt, always the same for the same prompt.
+
+        Args:
+            prompt (str): The prompt.
+
+        Returns:
+            str: The answer.
+        """
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:12]
+        return f'Stub answer {digest}.\n\nGenerated without calling any model.'
+
+    def generate(self, prompt):
+        time.sleep(self.latency)
+        return self.answer(prompt)
+
+    async def agenerate(self, prompt):
+        await asyncio.sleep(self.latency)
+        return self.answer(prompt)
+
+    def stream(self, prompt):
+        words = self.answer(prompt).split(' ')
+        for index, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            yield word if index == 0 else f' {word}'
+
+
+_provider = None
+_provider_error = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """
+    Get the language model backend of this process, built once from settings.LLM_PROVIDER.
+
+    A backend that cannot be built is logged once, later calls raise the same error.
+
+    Returns:
+        LLMProvider: The configured backend.
+
+    Raises:
+        ImproperlyConfigured: If the backend is not configured correctly.
+    """
+    global _provider, _provider_error
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None and _provider_error is None:
+                config = settings.LLM_PROVIDER
+                provider_class = import_string(config['BACKEND'])
+                try:
+                    _provider = provider_class(**config.get('OPTIONS', {}))
+                except ImproperlyConfigured as e:
+                    logger.error('The model is not configured: %s', e)
+                    _provider_error = e
+            if _provider_error is not None:
+                raise _provider_error
+    return _provider
+
+
+@receiver(setting_changed)
+def reset_provider(setting, **kwargs):
+    """
+    Forget the configured backend when settings.LLM_PROVIDER changes, e.g. in tests.
+    """
+    global _provider, _provider_error
+    if setting == 'LLM_PROVIDER':
+        _provider = None
+        _provider_error = None
+
+
+@checks.register()
+def check_llm_provider(app_configs, **kwargs):
+    """
+    Check that the backend of LLM_PROVIDER can be built, e.g. that GOOGLE_AI_API_KEY is set.
+
+    Otherwise every question to the chat fails. An error if LLM_PROVIDER['REQUIRED'], a warning otherwise.
+    """
+    try:
+        get_provider()
+    except ImproperlyConfigured as e:
+        hint = 'Set GOOGLE_AI_API_KEY, or LLM_BACKEND=stub to answer with the local stub.'
+        if settings.LLM_PROVIDER.get('REQUIRED'):
+            return [checks.Error(str(e), hint=hint, id='Course.E001')]
+        return [checks.Warning(str(e), hint=hint, id='Course.W001')]
+    return []
+
+
+def require_llm_provider():
+    """
+    Stop a server starting with a model that cannot be used, see check_llm_provider.
+
+    Called by wsgi.py and asgi.py, as gunicorn and uvicorn do not run the system checks.
+
+    Raises:
+        ImproperlyConfigured: If check_llm_provider finds an error.
+    """
+    errors = [error for error in check_llm_provider(None) if error.is_serious()]
+    if errors:
+        raise ImproperlyConfigured('\n'.join(str(error) for error in errors))
+
+
+def ask_google_ai(context, question):
+    """
+    Ask a question to the configured model.
 
     Args:
         context (str): The context to use for the question.
         question (str): The question to ask.
-        model (str, optional): The OpenAI model to use. Defaults to "gpt-3.5-turbo-16k".
 
     Returns:
-        str: The model's response to the question.
+        str: The model's response to the question, rendered to HTML.
     """
-    prompt = f'''using the context: {context}
-answer the next question: {question} in maximum 150 words. 
-If the answer is not related to the context, 
-give the following answer: "The question is not related to the course". 
-Provide your answer using the language used in the question.'''
+    try:
+        response = get_provider().generate(build_prompt(context, question))
+        answer = markdown.markdown(response)
+    except ImproperlyConfigured:
+        # Logged once by get_provider
+        answer = None
+    except Exception:
+        logger.exception('The model could not answer')
+        answer = None
+    return answer if answer else NO_RESPONSE
+
 
+async def ask_google_ai_async(context, question):
+    """
+    Asynchronous version of ask_google_ai, waiting for the model without blocking a thread.
+
+    Args:
+        context (str): The context to use for the question.
+        question (str): The question to ask.
+
+    Returns:
+        str: The model's response to the question, rendered to HTML.
+    """
     try:
-        api_key = get_secret_key()
-        if api_key:
-            genai.configure(api_key = api_key)
-            model = genai.GenerativeModel('gemini-pro')
-        
-        response = model.generate_content(prompt)
-        response = response.text
+        response = await get_provider().agenerate(build_prompt(context, question))
         answer = markdown.markdown(response)
-    except Exception as e:
-        print(e)
+    except ImproperlyConfigured:
+        answer = None
+    except Exception:
+        logger.exception('The model could not answer')
         answer = None
-        # Handle exceptions, such as logging errors or returning an error response to the user
-    return answer if answer else "No response"
+    return answer if answer else NO_RESPONSE
+
+
+def stream_google_ai(context, question):
+    """
+    Ask a question to the configured model, yielding the answer as it is generated.
+
+    Args:
+        context (str): The context to use for the question.
+        question (str): The question to ask.
+
+    Yields:
+        str: Raw markdown chunks of the model's response.
+
+    Raises:
+        Exception: Any error of the model, also after some chunks, so the answer is known to be incomplete.
+    """
+    yield from get_provider().stream(build_prompt(context, question))
+
+
+def _block_boundary(text):
+    """
+    Find the end of the last complete markdown block in a text.
+
+    Blocks end on a blank line; blank lines inside an open code fence are ignored.
+
+    Args:
+        text (str): The markdown received so far.
+
+    Returns:
+        int: The position where the last complete block ends, or 0 if there is none.
+    """
+    boundary = text.rfind('\n\n')
+    while boundary > 0 and text.count('```', 0, boundary) % 2:
+        boundary = text.rfind('\n\n', 0, boundary)
+    return max(boundary, 0)
+
+
+def render_markdown_stream(chunks):
+    """
+    Render a stream of markdown chunks to HTML one complete block at a time.
+
+    Blocks are only rendered once they are closed, so an unfinished list,
+    paragraph or code fence is never sent to the client half-rendered.
+
+    Args:
+        chunks (iterable): Raw markdown chunks.
+
+    Yields:
+        str: HTML of each complete block.
+    """
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        boundary = _block_boundary(buffer)
+        if boundary:
+            yield markdown.markdown(buffer[:boundary])
+            buffer = buffer[boundary:]
+    if buffer.strip():
+        yield markdown.markdown(buffer)
@@ -1,31 +1,93 @@
-from Course.utils import ask_google_ai, validate_context
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from Course.utils import validate_context
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import MethodNotAllowed, Throttled
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .models import Course, FavoriteCourse
+from .cache import answer_cache
+from .conditional import ConditionalListMixin
+from .exporting import EXPORT_FORMATS, EXPORTS, export
+from .importing import CourseImporter, get_import_format, read_rows
+from .chat import aanswer_question, answer_question, invalidate_course_answers, stream_answer
+from .jobs import enqueue_question, wait_for_job
+from .models import ChatJob, Course, FavoriteCourse
+from .pagination import CoursePagination, FavoriteCoursePagination, SearchPagination
+from .search import CourseSearchResults, typeahead_courses
+from .semantic import semantic_cache
+from .throttling import CourseChatThrottle, UserChatThrottle
 from .permissions import IsCoursePermission, IsYourOwnIdInstructor, IsYourOwnIdStudent
-from .serializers import AddFavoriteCourseSerializer, CourseCreateSerializer, CourseListSerializer, CourseUpdateSerializer, DeleteFavoriteCourseSerializer, QuestionSerializer, ListFavoriteCourseSerializer
+from .serializers import AddFavoriteCourseSerializer, BulkFavoriteCourseSerializer, ChatJobSerializer, CourseCreateSerializer, CourseListSerializer, CourseTypeaheadSerializer, CourseUpdateSerializer, DeleteFavoriteCourseSerializer, QuestionSerializer, ListFavoriteCourseSerializer
 
 
-class List(generics.ListAPIView):
+class List(ConditionalListMixin, generics.ListAPIView):
     """
     List all courses. (for students)
     """
-    queryset = Course.objects.filter(active=True)
+    queryset = Course.objects.filter(active=True).select_related('instructor')
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = CourseListSerializer
+    pagination_class = CoursePagination
+    per_user = False
+
+    def get_version_scopes(self):
+        return ['courses']
+
+
+class SearchCourseView(ConditionalListMixin, generics.ListAPIView):
+    """
+    Search the active courses by name, description and context, best matches first. (for students)
+
+    The words are given in ?q, every word must appear in the course.
+    """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = CourseListSerializer
+    pagination_class = SearchPagination
+    per_user = False
+
+    def get_queryset(self):
+        return CourseSearchResults(self.request.query_params.get('q', ''), Course.objects.select_related('instructor'))
 
+    def get_version_scopes(self):
+        return ['courses']
 
-class ListOwnCourse(generics.ListAPIView):
+
+class TypeaheadCourseView(ConditionalListMixin, generics.ListAPIView):
+    """
+    Suggest the names of active courses while a search is typed in ?q. (for students)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = CourseTypeaheadSerializer
+    pagination_class = None
+    per_user = False
+
+    def get_queryset(self):
+        return typeahead_courses(self.request.query_params.get('q', ''))
+
+    def get_version_scopes(self):
+        return ['courses']
+
+
+class ListOwnCourse(ConditionalListMixin, generics.ListAPIView):
     """
     List courses owned by the authenticated user. (for instructors)
     """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = CourseListSerializer
+    pagination_class = CoursePagination
 
     def get_queryset(self):
         instructor_pk = self.request.user.id
-        return Course.objects.filter(instructor__id=instructor_pk, active=True)
+        return Course.objects.filter(instructor__id=instructor_pk, active=True).select_related('instructor')
+
+    def get_version_scopes(self):
+        return [f'instructor:{self.request.user.id}']
 
 
 class Create(generics.CreateAPIView):
@@ -36,6 +98,29 @@ class Create(generics.CreateAPIView):
     serializer_class = CourseCreateSerializer
 
 
+class ImportCourseView(generics.GenericAPIView):
+    """
+    Create many courses from a CSV or JSONL file. (for instructors)
+
+    The file is sent as 'file' in a multipart form, with columns name, description,
+    context and optionally active. The format comes from 'format' or the file extension.
+    """
+    # The importer stores the instructor, it needs the full model
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = get_import_format(upload.name, request.data.get('format'))
+        if file_format is None:
+            return Response({'format': ['The format must be csv or jsonl.']}, status=status.HTTP_400_BAD_REQUEST)
+        report = CourseImporter(request.user, file_format).run(read_rows(upload, file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+
 class Modify(generics.UpdateAPIView):
     """
     Update a course. (for instructors)
@@ -45,6 +130,13 @@ class Modify(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated, IsCoursePermission]
     serializer_class = CourseUpdateSerializer
 
+    def perform_update(self, serializer):
+        """
+        Save the course and drop the cached answers built on its previous context.
+        """
+        course = serializer.save()
+        invalidate_course_answers(course.pk)
+
 
 class DeleteCourseView(generics.GenericAPIView):
     queryset = Course.objects.filter(active=True)
@@ -61,6 +153,7 @@ class DeleteCourseView(generics.GenericAPIView):
         new_value = instance.active
         instance.active = not new_value
         instance.save()
+        invalidate_course_answers(instance.pk)
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -90,7 +183,29 @@ class DeleteFavoriteCourseView(generics.GenericAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ListFavoriteCourseView(generics.ListAPIView):
+class BulkAddFavoriteCourseView(generics.GenericAPIView):
+    """
+    Add many courses to favorites. (for students)
+    """
+    permission_classes = [permissions.IsAuthenticated, IsYourOwnIdStudent]
+    serializer_class = BulkFavoriteCourseSerializer
+    add = True
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            return Response({'results': serializer.apply(add=self.add)}, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BulkDeleteFavoriteCourseView(BulkAddFavoriteCourseView):
+    """
+    Delete many courses from favorites. (for students)
+    """
+    add = False
+
+
+class ListFavoriteCourseView(ConditionalListMixin, generics.ListAPIView):
     """
     List favorite courses of student
     """
@@ -99,10 +214,17 @@ class ListFavoriteCourseView(generics.ListAPIView):
         Customize queryset for retrieve only active and favorite courses of the authenticated user
         """
         user = self.request.user
-        return FavoriteCourse.objects.filter(student=user,course__active=True,active=True)
-    
+        return FavoriteCourse.objects.filter(student_id=user.id,course__active=True,active=True).select_related('course__instructor')
+
+    def get_version_scopes(self):
+        """
+        The favorites of the user and, since the list shows their data, every course.
+        """
+        return ['courses', f'favorites:{self.request.user.id}']
+
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ListFavoriteCourseSerializer
+    pagination_class = FavoriteCoursePagination
 
 
 class Chat(generics.GenericAPIView):
@@ -110,12 +232,16 @@ class Chat(generics.GenericAPIView):
     Chat with the OpenAI model. (for students)
     """
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UserChatThrottle, CourseChatThrottle]
     serializer_class = QuestionSerializer
 
     def post(self, request, pk):
         """
         Handle POST requests to chat with the OpenAI model.
 
+        With ?mode=job the question is queued and the id of its job is returned
+        right away, the answer is then retrieved from ChatJobView.
+
         Args:
             request: The HTTP request object.
             pk (int): The primary key of the course.
@@ -127,9 +253,208 @@ class Chat(generics.GenericAPIView):
         if serializer.is_valid():
             question = serializer.validated_data.get('content')
             if validate_context(question):
-                context = Course.get_context(pk)
-                answer = ask_google_ai(context, question)
+                if request.query_params.get('mode') == 'job':
+                    job = enqueue_question(pk, request.user, question)
+                    return Response(ChatJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+                answer = answer_question(pk, question)
                 return Response({'answer': answer})
             else:
                 return Response({'error': 'Invalid question'}, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ChatJobView(generics.RetrieveAPIView):
+    """
+    Status and answer of a queued question. (for students)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = ChatJobSerializer
+
+    def get_queryset(self):
+        return ChatJob.objects.filter(student_id=self.request.user.id)
+
+    def get_object(self):
+        """
+        Get the job, waiting up to ?wait=<seconds> for it to finish (long-poll).
+
+        The wait holds the request worker, so it is capped at CHAT_JOBS['MAX_WAIT'] seconds,
+        clients ask again while the job is pending.
+        """
+        job = super().get_object()
+        try:
+            wait = float(self.request.query_params.get('wait', 0))
+        except ValueError:
+            wait = 0
+        return wait_for_job(job, min(max(wait, 0), settings.CHAT_JOBS['MAX_WAIT']))
+
+
+class ChatStream(generics.GenericAPIView):
+    """
+    Chat with the model, streaming the answer as Server-Sent Events. (for students)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UserChatThrottle, CourseChatThrottle]
+    serializer_class = QuestionSerializer
+
+    def post(self, request, pk):
+        """
+        Handle POST requests to chat with the model, streaming the answer.
+
+        Each rendered block of the answer is sent as a 'chunk' event and the
+        whole answer is sent at the end as a 'done' event. If too many questions
+        are being answered, a 429 response with Retry-After is returned instead.
+
+        Args:
+            request: The HTTP request object.
+            pk (int): The primary key of the course.
+
+        Returns:
+            StreamingHttpResponse: The text/event-stream with the answer.
+        """
+        serializer = self.serializer_class(data=request.data)
+        if serializer.is_valid():
+            question = serializer.validated_data.get('content')
+            if validate_context(question):
+                # Raises Throttled before the response starts if the model is busy
+                answer_events = stream_answer(pk, question)
+                events = (f'event: {event}\ndata: {json.dumps(data)}\n\n' for event, data in answer_events)
+                response = StreamingHttpResponse(events, content_type='text/event-stream')
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no'
+                return response
+            else:
+                return Response({'error': 'Invalid question'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def throttled_response(exc):
+    """
+    Build the 429 response of a throttled request outside of Django REST framework views.
+
+    Args:
+        exc (Throttled): The throttling exception.
+
+    Returns:
+        JsonResponse: The response, with the Retry-After header.
+    """
+    response = JsonResponse({'detail': str(exc.detail)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if exc.wait is not None:
+        response['Retry-After'] = str(math.ceil(exc.wait))
+    return response
+
+
+def check_drf_request(view_class, request, **kwargs):
+    """
+    Run the checks of a Django REST framework view on a request served outside of it.
+
+    The request is authenticated, checked against the permissions and throttles and
+    its body parsed with the classes of view_class, so a plain (e.g. async) view
+    accepts and rejects the same requests as the DRF view.
+
+    Args:
+        view_class (type): The APIView whose authentication, permission, throttle and parser classes are used.
+        request: The HTTP request object.
+        **kwargs: The URL keyword arguments of the request.
+
+    Returns:
+        tuple: The DRF request, with its user and parsed data, and None if the checks
+        passed, or the DRF request and the rendered error response otherwise.
+    """
+    view = view_class(args=(), kwargs=kwargs)
+    request = view.initialize_request(request, **kwargs)
+    view.request = request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(request, **kwargs)
+        if getattr(view, request.method.lower(), None) is None:
+            raise MethodNotAllowed(request.method)
+        # Parse the body here, so that parse errors get the response of the view
+        request.data
+    except Exception as exc:
+        response = view.finalize_response(request, view.handle_exception(exc), **kwargs)
+        return request, response.render()
+    return request, None
+
+
+async def chat_async(request, pk):
+    """
+    Chat with the model without holding a worker thread while it answers. (for students)
+
+    Served natively when the project runs under lab1_pi2/asgi.py, so a single
+    worker can wait on many answers at once. Same contract as Chat, whose
+    authentication, permission and throttle classes check the request.
+
+    Args:
+        request: The HTTP request object.
+        pk (int): The primary key of the course.
+
+    Returns:
+        JsonResponse: The model's response to the question.
+    """
+    request, error = await sync_to_async(check_drf_request)(Chat, request, pk=pk)
+    if error is not None:
+        return error
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    serializer = QuestionSerializer(data=request.data)
+    if serializer.is_valid():
+        question = serializer.validated_data.get('content')
+        if validate_context(question):
+            try:
+                answer = await aanswer_question(pk, question)
+            except Throttled as e:
+                return throttled_response(e)
+            return JsonResponse({'answer': answer})
+        else:
+            return JsonResponse({'error': 'Invalid question'}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# Authentication is done with the JWT header, not with the session cookie
+chat_async.csrf_exempt = True
+
+
+class ExportView(generics.GenericAPIView):
+    """
+    Stream every course or favorite course as CSV or JSON. (for admins)
+
+    Query parameters: output (csv or json), columns (comma separated) and gzip (true or false).
+    """
+    # is_staff is read from the database, never trusted from the token
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, kind):
+        if kind not in EXPORTS:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        file_format = request.query_params.get('output', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response({'output': ['The output must be csv or json.']}, status=status.HTTP_400_BAD_REQUEST)
+        columns = [column for column in request.query_params.get('columns', '').split(',') if column]
+        compress = request.query_params.get('gzip') == 'true'
+        try:
+            blocks = export(kind, columns, file_format, compress)
+        except ValueError as e:
+            return Response({'columns': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+
+        filename = f'{kind}.{file_format}' + ('.gz' if compress else '')
+        content_type = 'application/gzip' if compress else ('text/csv' if file_format == 'csv' else 'application/json')
+        response = StreamingHttpResponse(blocks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ChatCacheStats(generics.GenericAPIView):
+    """
+    Hit/miss counters of the chat answer cache. (for admins)
+    """
+    # is_staff is read from the database, never trusted from the token
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        stats = answer_cache.stats()
+        if semantic_cache is not None:
+            stats['semantic'] = semantic_cache.stats()
+        return Response(stats)
@@ -0,0 +1,46 @@
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+class TokenClaimsUser(TokenUser):
+    """
+    User built from the claims of an access token, without reading the database.
+
+    Returned by JWTStatelessUserAuthentication (enabled with STATELESS_JWT_AUTH) as
+    settings.SIMPLE_JWT['TOKEN_USER_CLASS']. It has the id, email and rol of the user
+    as MyTokenObtainPairSerializer.get_token wrote them, so the permissions comparing
+    request.user.id or reading request.user.rol work as with the User model. Views
+    needing the full model set authentication_classes to JWTAuthentication.
+    """
+    @cached_property
+    def id(self):
+        """
+        The ID of the user, as an int like User.id (the token stores it as a string).
+        """
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def rol(self):
+        return self.token.get('rol', '')
+
+    @cached_property
+    def full_name(self):
+        return self.token.get('full_name', '')
+
+    def __str__(self):
+        """
+        Method to return a string representation of the user.
+
+        Returns:
+            str: The email of the user.
+        """
+        return f'user email: {self.email}'
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iterations of PASSWORD_HASHING, passwords hashed with others are rehashed on login.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHING['PBKDF2_ITERATIONS']
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """
+    Argon2 with the costs of PASSWORD_HASHING, needs argon2-cffi.
+    """
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_HASHING['ARGON2_TIME_COST']
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_HASHING['ARGON2_MEMORY_COST']
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_HASHING['ARGON2_PARALLELISM']
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """
+    Scrypt with the work factor of PASSWORD_HASHING.
+    """
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_HASHING['SCRYPT_WORK_FACTOR']
+
+
+class HashingPool:
+    """
+    Threads hashing the passwords of a process, at most PASSWORD_HASHING['WORKERS'] at once.
+
+    hashlib and argon2-cffi release the GIL while hashing, so the threads use every core,
+    while the request threads past the limit wait instead of slowing each other down.
+    The async functions wait for the hash without holding a thread, so an ASGI worker
+    keeps serving other requests during a login. With 0 workers, hashing runs inline.
+    """
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING['WORKERS'], thread_name_prefix='hashing'
+                )
+            return self._executor
+
+    def run(self, func, *args):
+        if not settings.PASSWORD_HASHING['WORKERS']:
+            return func(*args)
+        return self.executor.submit(func, *args).result()
+
+    async def arun(self, func, *args):
+        if not settings.PASSWORD_HASHING['WORKERS']:
+            return func(*args)
+        return await asyncio.wrap_future(self.executor.submit(func, *args))
+
+    def shutdown(self):
+        """
+        Stop the threads, e.g. after changing PASSWORD_HASHING['WORKERS'], they are started again when needed.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+hashing_pool = HashingPool()
+
+
+def setup_hashing_process(password_hashers, password_hashing):
+    """
+    Set up Django in a spawned process hashing passwords, with the hashers of the process that started it.
+
+    Kept in this module, which does not import the models, so that it can be loaded before the setup.
+    """
+    django.setup()
+    settings.PASSWORD_HASHERS = password_hashers
+    settings.PASSWORD_HASHING = password_hashing
+
+
+def verify(password, encoded):
+    """
+    Check a password against its hash.
+
+    Args:
+        password (str): The raw password.
+        encoded (str): The stored hash.
+
+    Returns:
+        tuple: Whether the password is correct, and whether it must be hashed again with the
+        preferred hasher, because the hasher or its parameters changed.
+    """
+    updates = []
+    correct = hashers.check_password(password, encoded, updates.append)
+    return correct, bool(updates)
+
+
+def hash_password(password):
+    """
+    Hash a password with the preferred hasher in the hashing pool.
+    """
+    return hashing_pool.run(hashers.make_password, password)
+
+
+async def ahash_password(password):
+    return await hashing_pool.arun(hashers.make_password, password)
+
+
+def verify_password(password, encoded):
+    """
+    Check a password in the hashing pool, see verify.
+    """
+    return hashing_pool.run(verify, password, encoded)
+
+
+async def averify_password(password, encoded):
+    return await hashing_pool.arun(verify, password, encoded)
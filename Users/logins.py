@@ -0,0 +1,129 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginBuffer:
+    """
+    Last login times waiting to be written with one bulk UPDATE.
+
+    With LAST_LOGIN['BUFFERED'], logins record the time here instead of saving the user,
+    so the start of a class does not queue hundreds of UPDATEs on the users table. The
+    times are written once LAST_LOGIN['BATCH_SIZE'] users are waiting or the oldest has
+    waited LAST_LOGIN['FLUSH_INTERVAL'] seconds, checked at the end of each request and,
+    with LAST_LOGIN['FLUSH_TIMER'], by a thread running while times are waiting, so that
+    they are written even if no more requests come, and on exit. Only the latest login
+    of each user is kept, and a row is only updated with a later time than the one it
+    has, so workers writing in any order agree. Times that could not be written are
+    kept for the next flush.
+    """
+    def __init__(self):
+        self.logins = {}
+        self.oldest = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, user, when=None):
+        """
+        Record a login of a user, also setting user.last_login.
+
+        Args:
+            user (User): The user logged in.
+            when (datetime, optional): The time of the login, now by default.
+        """
+        user.last_login = when or timezone.now()
+        with self._lock:
+            previous = self.logins.get(user.pk)
+            if previous is None or previous < user.last_login:
+                self.logins[user.pk] = user.last_login
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self._timer is None and settings.LAST_LOGIN['FLUSH_TIMER']:
+                self._timer = threading.Thread(target=self.run_timer, name='last-login-flush', daemon=True)
+                self._timer.start()
+            full = len(self.logins) >= settings.LAST_LOGIN['BATCH_SIZE']
+        if full:
+            self.flush()
+
+    def run_timer(self):
+        """
+        Write the buffered times when due, until none are waiting.
+        """
+        while True:
+            time.sleep(settings.LAST_LOGIN['FLUSH_INTERVAL'])
+            try:
+                self.flush_if_due()
+            except Exception:
+                logger.exception('Could not write the buffered login times')
+            finally:
+                close_old_connections()
+            with self._lock:
+                if not self.logins:
+                    self._timer = None
+                    return
+
+    def flush(self):
+        """
+        Write the buffered login times, put back in the buffer if the UPDATE fails.
+
+        Returns:
+            int: The number of users whose time was written.
+        """
+        with self._lock:
+            logins, self.logins, self.oldest = self.logins, {}, None
+        if not logins:
+            return 0
+        # One UPDATE ... SET last_login = CASE WHEN id = ... for the whole batch
+        later = [
+            When(Q(pk=user_id) & (Q(last_login__isnull=True) | Q(last_login__lt=when)), then=Value(when))
+            for user_id, when in logins.items()
+        ]
+        try:
+            User.objects.filter(pk__in=list(logins)).update(last_login=Case(*later, default=F('last_login')))
+        except Exception:
+            with self._lock:
+                for user_id, when in logins.items():
+                    previous = self.logins.get(user_id)
+                    if previous is None or previous < when:
+                        self.logins[user_id] = when
+                if self.oldest is None:
+                    self.oldest = time.monotonic()
+            raise
+        return len(logins)
+
+    def flush_if_due(self):
+        """
+        Write the buffered login times if the oldest one has waited FLUSH_INTERVAL seconds.
+        """
+        if self.oldest is not None and time.monotonic() - self.oldest >= settings.LAST_LOGIN['FLUSH_INTERVAL']:
+            self.flush()
+
+    def clear(self):
+        """
+        Drop the buffered login times without writing them.
+        """
+        with self._lock:
+            self.logins, self.oldest = {}, None
+
+
+last_logins = LastLoginBuffer()
+
+
+def flush_last_logins():
+    try:
+        last_logins.flush()
+    except Exception:
+        logger.exception('Could not write the buffered login times on exit')
+
+
+atexit.register(flush_last_logins)
@@ -0,0 +1,85 @@
+import time
+import uuid
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+
+from Course.models import Course, FavoriteCourse
+from Users.models import User
+from Users.serializers import MyTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compare the requests per second of the JWT authentication reading the user from
+    the database with the stateless one building it from the token claims.
+    """
+    help = 'Benchmark requests per second with JWTAuthentication and JWTStatelessUserAuthentication.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests sent to each endpoint.')
+        parser.add_argument('--courses', type=int, default=20, help='Courses of the fixture.')
+        parser.add_argument(
+            '--query-latency', type=float, default=0,
+            help='Milliseconds added to every query, like the round trip to a database server.'
+        )
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        instructor = User.objects.create_user(
+            email=f'bench-instructor-{suffix}@example.com', password=suffix,
+            first_name='bench', last_name='instructor', rol='Profesor'
+        )
+        student = User.objects.create_user(
+            email=f'bench-student-{suffix}@example.com', password=suffix,
+            first_name='bench', last_name='student', rol='Estudiante'
+        )
+        try:
+            courses = Course.objects.bulk_create(
+                Course(name=f'Course {i}', instructor=instructor, description='Benchmark course', context='Benchmark context')
+                for i in range(options['courses'])
+            )
+            FavoriteCourse.upsert(student, [course.pk for course in courses[:5]])
+            token = MyTokenObtainPairSerializer.get_token(student).access_token
+            client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+            urls = {
+                'student_list': reverse('student_list'),
+                'student_courses_favorites_list': reverse('student_courses_favorites_list'),
+                'retrieve_user_info': reverse('retrieve_user_info', args=[student.pk]),
+            }
+            self.run(client, urls, options)
+        finally:
+            instructor.delete()
+            student.delete()
+
+    def run(self, client, urls, options):
+        latency = options['query_latency'] / 1000
+        queries = []
+
+        def slow_query(execute, sql, params, many, context):
+            # The query log of the connection is reset by every request
+            queries.append(sql)
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        modes = {'JWTAuthentication': JWTAuthentication, 'JWTStatelessUserAuthentication': JWTStatelessUserAuthentication}
+        for name, url in urls.items():
+            for mode, authentication in modes.items():
+                with mock.patch.object(APIView, 'authentication_classes', [authentication]), \
+                        connection.execute_wrapper(slow_query):
+                    # The lists and the user are cached after the first request
+                    response = client.get(url)
+                    assert response.status_code == 200, response.status_code
+                    queries.clear()
+                    start = time.perf_counter()
+                    for _ in range(options['requests']):
+                        client.get(url)
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{name:32} {mode:32} {options["requests"] / elapsed:8.0f} req/s  {len(queries) / options["requests"]:.1f} queries/request'
+                )
@@ -0,0 +1,94 @@
+import importlib.util
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from Users.hashers import hashing_pool
+from Users.models import User
+from Users.serializers import MyTokenObtainPairSerializer
+from Users.tokens import token_writes
+
+PBKDF2 = 'Users.hashers.PBKDF2PasswordHasher'
+ARGON2 = 'Users.hashers.Argon2PasswordHasher'
+SCRYPT = 'Users.hashers.ScryptPasswordHasher'
+
+# Hasher, then the PASSWORD_HASHING parameters of each configuration
+CONFIGS = {
+    'pbkdf2 390000 iterations': (PBKDF2, {}),
+    'pbkdf2 100000 iterations': (PBKDF2, {'PBKDF2_ITERATIONS': 100000}),
+    'scrypt n=2^14': (SCRYPT, {}),
+    'argon2 t=2 m=100MiB p=8': (ARGON2, {}),
+    'argon2 t=2 m=19MiB p=1': (ARGON2, {'ARGON2_MEMORY_COST': 19456, 'ARGON2_PARALLELISM': 1}),
+}
+
+
+class Command(BaseCommand):
+    """
+    Measure the logins per second per core of each password hashing configuration,
+    with concurrent logins hashing in the hashing pool.
+    """
+    help = 'Benchmark logins per second per core for each PASSWORD_HASHING configuration.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=40, help='Logins of each configuration.')
+        parser.add_argument('--threads', type=int, default=8, help='Logins at the same time.')
+        parser.add_argument(
+            '--workers', type=int, default=settings.PASSWORD_HASHING['WORKERS'],
+            help='Threads of the hashing pool, 0 to hash in the request threads.'
+        )
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        User.objects.bulk_create(
+            User(email=f'bench-user-{i}-{suffix}@example.com', first_name='bench', last_name='user', rol='Estudiante')
+            for i in range(options['logins'])
+        )
+        emails = list(User.objects.filter(email__endswith=f'-{suffix}@example.com').values_list('email', flat=True))
+        cores = min(options['workers'] or options['threads'], options['threads'], os.cpu_count() or 1)
+        self.stdout.write(f'{options["logins"]} logins, {options["threads"]} threads, {options["workers"]} hashing workers, {cores} cores')
+        try:
+            for name, (hasher, parameters) in CONFIGS.items():
+                if hasher == ARGON2 and importlib.util.find_spec('argon2') is None:
+                    self.stdout.write(f'{name:26} skipped, argon2-cffi is not installed')
+                    continue
+                hashing = {**settings.PASSWORD_HASHING, **parameters, 'WORKERS': options['workers']}
+                with override_settings(PASSWORD_HASHERS=[hasher], PASSWORD_HASHING=hashing):
+                    hashing_pool.shutdown()
+                    User.objects.filter(email__in=emails).update(password=make_password(suffix))
+                    self.run(name, emails, suffix, cores, options)
+        finally:
+            hashing_pool.shutdown()
+            token_writes.clear()
+            User.objects.filter(email__in=emails).delete()
+
+    def run(self, name, emails, password, cores, options):
+        errors = []
+
+        def worker(emails):
+            for email in emails:
+                try:
+                    serializer = MyTokenObtainPairSerializer(data={'email': email, 'password': password})
+                    serializer.is_valid(raise_exception=True)
+                except Exception as e:
+                    errors.append(e)
+            connection.close()
+
+        threads = [threading.Thread(target=worker, args=(emails[i::options['threads']],)) for i in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        logins = len(emails) / elapsed
+        self.stdout.write(
+            f'{name:26} {logins:8.1f} logins/s  {logins / cores:8.1f} logins/s/core  '
+            f'{elapsed / len(emails) * cores * 1000:6.0f} ms/login  {len(errors)} errors'
+        )
@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework_simplejwt import serializers as simplejwt_serializers
+
+from Users.logins import last_logins
+from Users.models import User
+from Users.serializers import MyTokenObtainPairSerializer
+from Users.tokens import token_writes
+
+# Hashing the password is most of a login, a fast hasher leaves the database work visible
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+class Command(BaseCommand):
+    """
+    Compare the logins per second of a burst of students logging in at the start of
+    a class, updating last_login in each login or buffering it.
+    """
+    help = 'Benchmark concurrent logins with SIMPLE_JWT["UPDATE_LAST_LOGIN"] and with LAST_LOGIN["BUFFERED"].'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1200, help='Students logging in once each.')
+        parser.add_argument('--threads', type=int, default=8, help='Logins at the same time.')
+        parser.add_argument(
+            '--query-latency', type=float, default=0,
+            help='Milliseconds added to every query, like the round trip to a database server.'
+        )
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        with override_settings(PASSWORD_HASHERS=FAST_HASHERS):
+            password = make_password(suffix)
+            User.objects.bulk_create(
+                User(email=f'bench-user-{i}-{suffix}@example.com', password=password, first_name='bench', last_name='user', rol='Estudiante')
+                for i in range(options['users'])
+            )
+            emails = list(User.objects.filter(email__endswith=f'-{suffix}@example.com').values_list('email', flat=True))
+            try:
+                for mode, buffered in (('UPDATE_LAST_LOGIN', False), ('BUFFERED', True)):
+                    User.objects.filter(email__in=emails).update(last_login=None)
+                    with mock.patch.object(simplejwt_serializers.api_settings, 'UPDATE_LAST_LOGIN', not buffered), \
+                            override_settings(LAST_LOGIN={**settings.LAST_LOGIN, 'BUFFERED': buffered}):
+                        self.run(mode, emails, suffix, options)
+            finally:
+                token_writes.clear()
+                User.objects.filter(email__in=emails).delete()
+
+    def run(self, mode, emails, password, options):
+        latency = options['query_latency'] / 1000
+        lock = threading.Lock()
+        queries = []
+        errors = []
+
+        def slow_query(execute, sql, params, many, context):
+            with lock:
+                queries.append(sql)
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def worker(emails):
+            with connection.execute_wrapper(slow_query):
+                for email in emails:
+                    try:
+                        serializer = MyTokenObtainPairSerializer(data={'email': email, 'password': password})
+                        serializer.is_valid(raise_exception=True)
+                    except Exception as e:
+                        errors.append(e)
+            connection.close()
+
+        threads = [threading.Thread(target=worker, args=(emails[i::options['threads']],)) for i in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        logins = len(queries)
+        flush_start = time.perf_counter()
+        with connection.execute_wrapper(slow_query):
+            written = last_logins.flush()
+        flushed = time.perf_counter() - flush_start
+        token_writes.clear()
+        self.stdout.write(
+            f'{mode:18} {len(emails) / elapsed:8.0f} logins/s  {logins / len(emails):.2f} queries/login  {len(errors)} errors  '
+            f'(+{len(queries) - logins} queries, {flushed * 1000:.0f} ms to write the last {written} last_login)'
+        )
+        stored = User.objects.filter(email__in=emails, last_login__isnull=False).count()
+        if stored != len(emails) - len(errors):
+            self.stdout.write(f'  only {stored} last_login stored')
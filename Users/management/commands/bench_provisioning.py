@@ -0,0 +1,76 @@
+import io
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from Users.hashers import hashing_pool
+from Users.models import User
+from Users.provisioning import UserProvisioner, read_roster
+from Users.serializers import CreateUserSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compare creating the accounts of a roster one by one, like users/create, with the
+    UserProvisioner batches hashing in a pool of processes.
+    """
+    help = 'Benchmark the provisioning of a roster CSV against CreateUserSerializer one account at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=20000, help='Rows of the roster.')
+        parser.add_argument('--baseline', type=int, default=200, help='Accounts created one by one.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes hashing the passwords.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--iterations', type=int, default=settings.PASSWORD_HASHING['PBKDF2_ITERATIONS'],
+            help='PBKDF2 iterations, lower to measure the rest of the work.'
+        )
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        hashing = {**settings.PASSWORD_HASHING, 'PBKDF2_ITERATIONS': options['iterations']}
+        self.stdout.write(f'PBKDF2 {options["iterations"]} iterations, {options["workers"]} processes, {os.cpu_count()} cores')
+        try:
+            with override_settings(PASSWORD_HASHERS=['Users.hashers.PBKDF2PasswordHasher'], PASSWORD_HASHING=hashing):
+                self.run_baseline(suffix, options)
+                self.run_provisioner(suffix, options)
+        finally:
+            hashing_pool.shutdown()
+            User.objects.filter(email__endswith=f'-{suffix}@example.com').delete()
+
+    def run_baseline(self, suffix, options):
+        start = time.perf_counter()
+        for i in range(options['baseline']):
+            serializer = CreateUserSerializer(data={
+                'first_name': 'bench', 'last_name': 'student', 'email': f'one-{i}-{suffix}@example.com',
+                'password': f'password-{i}', 'rol': 'Estudiante',
+            })
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'CreateUserSerializer  {options["baseline"] / elapsed:8.0f} accounts/s  '
+            f'({options["students"] * elapsed / options["baseline"]:.1f} s for {options["students"]})'
+        )
+
+    def run_provisioner(self, suffix, options):
+        roster = io.BytesIO()
+        roster.write(b'first_name,last_name,email,rol,password\n')
+        for i in range(options['students']):
+            roster.write(f'bench,student,many-{i}-{suffix}@example.com,Estudiante,password-{i}\n'.encode())
+        # The last rows again, reported as duplicates
+        for i in range(options['students'] - 10, options['students']):
+            roster.write(f'bench,student,many-{i}-{suffix}@example.com,Estudiante,password-{i}\n'.encode())
+        roster.seek(0)
+
+        start = time.perf_counter()
+        report = UserProvisioner(batch_size=options['batch_size'], workers=options['workers']).run(read_roster(roster))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'UserProvisioner       {report["created"] / elapsed:8.0f} accounts/s  '
+            f'({report["created"]} created, {report["duplicate_count"]} duplicates, {report["error_count"]} invalid in {elapsed:.1f} s)'
+        )
@@ -0,0 +1,84 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from Users.models import User
+from Users.serializers import MyTokenRefreshSerializer
+from Users.tokens import BufferedRefreshToken, prune_expired_tokens, token_writes
+
+
+class Command(BaseCommand):
+    """
+    Compare the refresh throughput of the stock RefreshToken rotation with the buffered
+    one over many sessions, then time the pruning of the expired tokens.
+    """
+    help = 'Benchmark token refresh with TokenRefreshSerializer and MyTokenRefreshSerializer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=10000, help='Refresh tokens refreshed once each.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument(
+            '--query-latency', type=float, default=0,
+            help='Milliseconds added to every query, like the round trip to a database server.'
+        )
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        User.objects.bulk_create(
+            User(email=f'bench-user-{i}-{suffix}@example.com', first_name='bench', last_name='user', rol='Estudiante')
+            for i in range(options['users'])
+        )
+        users = list(User.objects.filter(email__endswith=f'-{suffix}@example.com'))
+        try:
+            for name, serializer_class, token_class in (
+                ('RefreshToken', TokenRefreshSerializer, RefreshToken),
+                ('BufferedRefreshToken', MyTokenRefreshSerializer, BufferedRefreshToken),
+            ):
+                tokens = [str(token_class.for_user(users[i % len(users)])) for i in range(options['sessions'])]
+                token_writes.flush()
+                self.run(name, serializer_class, tokens, options)
+            self.prune(users)
+        finally:
+            OutstandingToken.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, name, serializer_class, tokens, options):
+        latency = options['query_latency'] / 1000
+        queries = []
+
+        def slow_query(execute, sql, params, many, context):
+            queries.append(sql)
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(slow_query):
+            start = time.perf_counter()
+            for token in tokens:
+                serializer = serializer_class(data={'refresh': token})
+                serializer.is_valid(raise_exception=True)
+            elapsed = time.perf_counter() - start
+            refreshes = len(queries)
+            flush_start = time.perf_counter()
+            token_writes.flush()
+            flushed = time.perf_counter() - flush_start
+        self.stdout.write(
+            f'{name:22} {len(tokens) / elapsed:8.0f} refresh/s  {refreshes / len(tokens):.2f} queries/refresh  '
+            f'(+{len(queries) - refreshes} queries, {flushed * 1000:.0f} ms to write the buffer)'
+        )
+
+    def prune(self, users):
+        OutstandingToken.objects.filter(user__in=users).update(expires_at=aware_utcnow() - timedelta(minutes=1))
+        rows = OutstandingToken.objects.filter(user__in=users).count()
+        blacklisted = BlacklistedToken.objects.filter(token__user__in=users).count()
+        start = time.perf_counter()
+        deleted = prune_expired_tokens()
+        self.stdout.write(
+            f'prune: {deleted} of {rows} outstanding ({blacklisted} blacklisted) in {(time.perf_counter() - start) * 1000:.0f} ms'
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Users.provisioning import UserProvisioner, is_utf8, read_roster
+
+
+class Command(BaseCommand):
+    """
+    Create the accounts of a roster CSV.
+    """
+    help = 'Create the accounts of a CSV file (columns first_name, last_name, email, rol, password).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The roster to import.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Accounts per INSERT.')
+        parser.add_argument('--workers', type=int, help='Processes hashing the passwords, one per core by default.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with open(options['path'], 'rb') as file:
+            if not is_utf8(file):
+                raise CommandError(f'{options["path"]} is not UTF-8 encoded.')
+            report = UserProvisioner(batch_size=options['batch_size'], workers=options['workers']).run(read_roster(file))
+        for error in report['errors']:
+            self.stderr.write(f'row {error["row"]}: {error["errors"]}')
+        for duplicate in report['duplicates']:
+            self.stderr.write(f'row {duplicate["row"]}: {duplicate["email"]} already exists')
+        self.stdout.write(
+            f'{report["created"]} accounts created, {report["duplicate_count"]} duplicates, '
+            f'{report["error_count"]} invalid rows in {time.perf_counter() - start:.1f} s'
+        )
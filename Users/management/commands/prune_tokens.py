@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from Users.tokens import prune_expired_tokens, token_writes
+
+
+class Command(BaseCommand):
+    """
+    Write the buffered token rows of this process and delete the expired tokens.
+
+    The workers already prune every TOKEN_REVOCATION['PRUNE_INTERVAL'] seconds,
+    this command is meant for cron when they are idle.
+    """
+    help = 'Delete the outstanding and blacklisted rows of expired tokens, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Tokens deleted at once.')
+
+    def handle(self, *args, **options):
+        written = token_writes.flush()
+        deleted = prune_expired_tokens(options['batch_size'])
+        self.stdout.write(f'{written} buffered tokens written, {deleted} expired tokens deleted')
@@ -1,7 +1,10 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AbstractUser, BaseUserManager, PermissionsMixin
 from django.core import validators
 from django.db import models
 
+from .hashers import ahash_password, averify_password, hash_password, verify_password
+
 
 class CustomUserManager(BaseUserManager):
     """
@@ -76,3 +79,46 @@ class User(AbstractUser, PermissionsMixin):
             str: The email of the user.
         """
         return f'user email: {self.email}'
+
+    def set_password(self, raw_password):
+        """
+        Method to hash a new password in the hashing pool, with the hasher of PASSWORD_HASHING.
+
+        Args:
+            raw_password (str): The new password.
+        """
+        self.password = hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Method to check a password in the hashing pool, hashing it again if the hasher or its parameters changed.
+
+        Args:
+            raw_password (str): The password to check.
+
+        Returns:
+            bool: True if the password is correct.
+        """
+        correct, must_update = verify_password(raw_password, self.password)
+        if correct and must_update:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return correct
+
+    async def acheck_password(self, raw_password):
+        """
+        Method to check a password like check_password, waiting for the hashing pool without holding a thread.
+
+        Args:
+            raw_password (str): The password to check.
+
+        Returns:
+            bool: True if the password is correct.
+        """
+        correct, must_update = await averify_password(raw_password, self.password)
+        if correct and must_update:
+            self.password = await ahash_password(raw_password)
+            await sync_to_async(self.save)(update_fields=['password'])
+        return correct
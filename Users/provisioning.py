@@ -0,0 +1,227 @@
+import codecs
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+
+from .hashers import hashing_pool, setup_hashing_process
+from .models import User
+
+
+class UserProvisionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for a row of a roster, the password is optional.
+    """
+    class Meta:
+        model = User
+        fields = ['first_name', 'last_name', 'email', 'password', 'rol']
+        extra_kwargs = {
+            'email': {'required': True},
+            'password': {'required': False, 'allow_blank': True},
+        }
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Duplicated emails are looked up once per batch, not once per row
+        fields['email'].validators = [
+            validator for validator in fields['email'].validators if not isinstance(validator, UniqueValidator)
+        ]
+        return fields
+
+    def validate(self, attrs):
+        """
+        Validate the password of the row with AUTH_PASSWORD_VALIDATORS.
+        """
+        password = attrs.get('password')
+        if password:
+            user = User(**{key: value for key, value in attrs.items() if key != 'password'})
+            try:
+                validate_password(password, user)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({'password': list(e.messages)})
+        return attrs
+
+
+def is_utf8(file):
+    """
+    Check that a file is UTF-8 encoded, reading it in chunks, then rewind it.
+
+    Args:
+        file (File): The uploaded or opened file, in binary mode.
+
+    Returns:
+        bool: True if the whole file can be decoded.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(64 * 1024), b''):
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+        return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        file.seek(0)
+
+
+def count_rows(file):
+    """
+    Count the rows of a roster CSV, then rewind it.
+
+    Args:
+        file (File): The uploaded or opened file, in binary mode.
+
+    Returns:
+        int: The rows, without the header.
+    """
+    try:
+        return sum(1 for _ in read_roster(file))
+    finally:
+        file.seek(0)
+
+
+def read_roster(lines):
+    """
+    Read the rows of a roster CSV one by one.
+
+    Args:
+        lines (iterable): The lines of the file, as bytes.
+
+    Yields:
+        tuple: The row number and the row as a dict.
+    """
+    reader = csv.DictReader(line.decode('utf-8-sig') for line in lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+class UserProvisioner:
+    """
+    Create the accounts of a roster, in batches.
+
+    The emails of each batch already taken, in the database or earlier in the file, are
+    reported as duplicates with one query, then the passwords of the new accounts are
+    hashed in parallel and the accounts inserted with bulk_create. Accounts created
+    meanwhile by other requests are found by their password hash after the insert, and
+    reported as duplicates too. Rows without password get an unusable one, without hashing.
+    Only the current batch is kept in memory, and at most max_errors errors and duplicates
+    are reported.
+
+    The passwords are hashed by a pool of spawned processes, started for each run, or with
+    processes=False by the threads of the hashing pool of Users.hashers, which is what web
+    requests use, as starting processes from a multithreaded worker is not safe.
+    """
+    def __init__(self, batch_size=1000, max_errors=1000, workers=None, processes=True):
+        """
+        Args:
+            batch_size (int): Accounts per bulk_create.
+            max_errors (int): Maximum row errors and duplicates reported.
+            workers (int, optional): Processes hashing the passwords, one per core by default, 0 to hash inline.
+            processes (bool): Whether to hash in processes, or in the hashing pool threads.
+        """
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.processes = processes
+        self.serializer = UserProvisionSerializer()
+        self.pool = None
+
+    def run(self, rows):
+        """
+        Validate and create the accounts of the rows.
+
+        Args:
+            rows (iterable): Tuples of row number and row, as given by read_roster.
+
+        Returns:
+            dict: The number of created accounts, the duplicated emails and the row errors.
+        """
+        report = {'created': 0, 'duplicate_count': 0, 'duplicates': [], 'error_count': 0, 'errors': []}
+        seen = set()
+        batch = []
+        if self.processes and self.workers:
+            # Spawned, not forked, so the processes do not copy the locks and threads of this one
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_hashing_process, initargs=(settings.PASSWORD_HASHERS, settings.PASSWORD_HASHING)
+            )
+        try:
+            for number, row in rows:
+                try:
+                    data = self.serializer.run_validation(row)
+                except serializers.ValidationError as e:
+                    report['error_count'] += 1
+                    if len(report['errors']) < self.max_errors:
+                        report['errors'].append({'row': number, 'errors': e.detail})
+                    continue
+                data['email'] = User.objects.normalize_email(data['email'])
+                if data['email'] in seen:
+                    self.add_duplicate(report, number, data['email'])
+                    continue
+                seen.add(data['email'])
+                batch.append((number, data))
+                if len(batch) >= self.batch_size:
+                    report['created'] += self.save(batch, report)
+                    batch = []
+            if batch:
+                report['created'] += self.save(batch, report)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+        return report
+
+    def add_duplicate(self, report, number, email):
+        report['duplicate_count'] += 1
+        if len(report['duplicates']) < self.max_errors:
+            report['duplicates'].append({'row': number, 'email': email})
+
+    def hash_passwords(self, passwords):
+        """
+        Hash passwords with the preferred hasher, in the pool of processes or the hashing pool threads.
+
+        Returns:
+            list: The hashes, in the order of the passwords.
+        """
+        if self.pool is not None:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            return list(self.pool.map(make_password, passwords, chunksize=chunksize))
+        if not self.processes and settings.PASSWORD_HASHING['WORKERS']:
+            return list(hashing_pool.executor.map(make_password, passwords))
+        return [make_password(password) for password in passwords]
+
+    def save(self, batch, report):
+        """
+        Create a batch of accounts, reporting the emails already taken as duplicates.
+
+        Returns:
+            int: The number of created accounts.
+        """
+        existing = set(User.objects.filter(email__in=[data['email'] for _, data in batch]).values_list('email', flat=True))
+        new = []
+        for number, data in batch:
+            if data['email'] in existing:
+                self.add_duplicate(report, number, data['email'])
+            else:
+                new.append((number, data))
+        if not new:
+            return 0
+        hashed = self.hash_passwords([data.pop('password', '') or None for _, data in new])
+        users = [User(password=password, **data) for (_, data), password in zip(new, hashed)]
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        # The hashes are salted, so an account with another hash was created meanwhile by someone else
+        stored = dict(User.objects.filter(email__in=[user.email for user in users]).values_list('email', 'password'))
+        created = 0
+        for (number, _), user in zip(new, users):
+            if stored.get(user.email) == user.password:
+                created += 1
+            else:
+                self.add_duplicate(report, number, user.email)
+        return created
@@ -1,9 +1,13 @@
-from django.contrib.auth.hashers import check_password
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
 from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenBlacklistSerializer, TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
+from .logins import last_logins
 from .models import User
+from .tokens import BufferedRefreshToken
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -11,6 +15,8 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     Serializer for obtaining JWT token pair (access token and refresh token) by providing user credentials.
     Extends TokenObtainPairSerializer to customize token generation with additional user information.
     """
+    token_class = BufferedRefreshToken
+
     @classmethod
     def get_token(cls, user):
         """
@@ -27,6 +33,52 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         token['full_name'] = f"{user.first_name} {user.last_name}"
         return token
 
+    def validate(self, attrs):
+        """
+        Method to authenticate the user and issue the tokens.
+        Args:
+            attrs: The credentials of the user.
+
+        Returns:
+            dict: The refresh and access tokens.
+        """
+        # TokenObtainSerializer.validate authenticates and sets self.user
+        super(TokenObtainPairSerializer, self).validate(attrs)
+        return self.login(self.user)
+
+    @classmethod
+    def login(cls, user):
+        """
+        Method to issue the tokens of an authenticated user and record the login.
+        With LAST_LOGIN['BUFFERED'], last_login is written later in a batch instead of by SIMPLE_JWT['UPDATE_LAST_LOGIN'].
+        Args:
+            user: The authenticated user.
+
+        Returns:
+            dict: The refresh and access tokens.
+        """
+        refresh = cls.get_token(user)
+        data = {'refresh': str(refresh), 'access': str(refresh.access_token)}
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
+        if settings.LAST_LOGIN['BUFFERED']:
+            last_logins.add(user)
+        return data
+
+
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Serializer for rotating a refresh token, checking and recording revocations without per-token queries.
+    """
+    token_class = BufferedRefreshToken
+
+
+class MyTokenBlacklistSerializer(TokenBlacklistSerializer):
+    """
+    Serializer for revoking a refresh token on logout, visible at once to every worker.
+    """
+    token_class = BufferedRefreshToken
+
 
 class CreateUserSerializer(serializers.ModelSerializer):
     """
@@ -113,7 +165,8 @@ class PasswordUpdateSerializer(serializers.Serializer):
             raise serializers.ValidationError("New passwords do not match.")
 
         user = self.context['request'].user
-        if not check_password(current_password, user.password):
+        # In the hashing pool, rehashed if the hasher or its parameters changed
+        if not user.check_password(current_password):
             raise serializers.ValidationError("Current password is incorrect.")
         try:
             validate_password(new_password, user)
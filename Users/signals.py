@@ -0,0 +1,37 @@
+import logging
+
+from django.core.signals import request_finished
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from lab1_pi2.cache import bump_versions
+from .logins import last_logins
+from .models import User
+from .tokens import token_writes
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no cached payload shows
+    if update_fields != frozenset(['last_login']):
+        bump_versions(f'user:{instance.pk}')
+
+
+@receiver(request_finished)
+def write_token_rows(sender, **kwargs):
+    # After the response, so refreshes never wait for the batch
+    try:
+        token_writes.flush_if_due()
+    except Exception:
+        logger.exception('Could not write the buffered token rows')
+
+
+@receiver(request_finished)
+def write_last_logins(sender, **kwargs):
+    try:
+        last_logins.flush_if_due()
+    except Exception:
+        logger.exception('Could not write the buffered login times')
@@ -0,0 +1,27 @@
+from .models import User
+
+
+class UserFixturesMixin:
+    """
+    Test case mixin creating a student and an instructor once per test class.
+
+    They are available as student_user and instructor_user, both with the password
+    'password'. Only for TestCase classes, setUpTestData is not called by TransactionTestCase.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.student_user = User.objects.create_user(
+            first_name='student',
+            last_name='test',
+            email='student@gmail.com',
+            password='password',
+            rol='Estudiante'
+        )
+        cls.instructor_user = User.objects.create_user(
+            first_name='instructor',
+            last_name='test',
+            email='instructor@gmail.com',
+            password='password',
+            rol='Profesor'
+        )
@@ -1,3 +1,539 @@
-from django.test import TestCase
+import importlib.util
+import io
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework.views import APIView
+from rest_framework_simplejwt import serializers as simplejwt_serializers
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from Course.models import Course
+from lab1_pi2.profiling import QueryBudgetMixin
+from .authentication import TokenClaimsUser
+from .hashers import hashing_pool, verify_password
+from .logins import LastLoginBuffer, last_logins
+from .models import User
+from .provisioning import UserProvisioner
+from .serializers import MyTokenObtainPairSerializer
+from .testing import UserFixturesMixin
+from .tokens import BloomFilter, prune_expired_tokens, revocations, token_writes
+
+
+class UserQueryBudgetTestCase(QueryBudgetMixin, UserFixturesMixin, APITestCase):
+    query_budgets = {
+        'login': 3,
+        'create': 2,
+        'retrieve_user_info': 1,
+    }
+
+    def tearDown(self):
+        # Logins buffer the rows of their refresh tokens
+        token_writes.clear()
+
+    def test_login(self):
+        response = self.client.post(reverse('login'), {'email': 'student@gmail.com', 'password': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+
+    def test_create(self):
+        data = {
+            'first_name': 'new',
+            'last_name': 'user',
+            'email': 'new@gmail.com',
+            'password': 'password',
+            'rol': 'Profesor'
+        }
+        response = self.client.post(reverse('create'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_retrieve(self):
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.get(reverse('retrieve_user_info', args=[self.student_user.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class RetrieveUserCacheTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.other_user = User.objects.create_user(
+            first_name='other',
+            last_name='test',
+            email='other@gmail.com',
+            password='password',
+            rol='Estudiante'
+        )
+
+    def test_retrieve_cached_until_saved(self):
+        self.client.force_authenticate(user=self.student_user)
+        url = reverse('retrieve_user_info', args=[self.student_user.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['first_name'], 'student')
+
+        self.student_user.first_name = 'renamed'
+        self.student_user.save()
+        self.assertEqual(self.client.get(url).data['first_name'], 'renamed')
+
+    def test_retrieve_other_user_forbidden(self):
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.get(reverse('retrieve_user_info', args=[self.other_user.pk]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@mock.patch.object(APIView, 'authentication_classes', [JWTStatelessUserAuthentication])
+class StatelessJWTAuthenticationTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.course = Course.objects.create(
+            name='Test Course',
+            instructor=self.instructor_user,
+            description='A test course',
+            context='Test context'
+        )
+
+    def tearDown(self):
+        token_writes.clear()
+
+    def authenticate(self, user):
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_built_from_claims(self):
+        token = MyTokenObtainPairSerializer.get_token(self.student_user).access_token
+        user = TokenClaimsUser(token)
+        self.assertEqual(user.id, self.student_user.id)
+        self.assertEqual(user.rol, 'Estudiante')
+        self.assertEqual(user.email, 'student@gmail.com')
+        self.assertEqual(user.full_name, 'student test')
+
+    def test_no_user_query(self):
+        self.authenticate(self.student_user)
+        url = reverse('retrieve_user_info', args=[self.student_user.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_permissions(self):
+        self.authenticate(self.student_user)
+        response = self.client.post(
+            reverse('student_courses_favorites_add'), {'student': self.student_user.id, 'course': self.course.id}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(reverse('retrieve_user_info', args=[self.instructor_user.pk]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.authenticate(self.instructor_user)
+        response = self.client.put(reverse('instructor_modify', args=[self.course.pk]), {'name': 'Renamed'}, format='json')
+        self.assertNotEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            reverse('instructor_register'),
+            {'name': 'Other', 'instructor': self.student_user.id, 'description': 'Other', 'context': 'Other'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_full_model_views(self):
+        self.authenticate(self.student_user)
+        response = self.client.put(
+            reverse('update_password', args=[self.student_user.pk]),
+            {'current_password': 'password', 'new_password': 'a-new-password', 'confirm_new_password': 'a-new-password'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('endpoint_stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TokenRefreshTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        revocations.clear()
+        token_writes.clear()
+
+    def tearDown(self):
+        token_writes.clear()
+
+    def login(self):
+        response = self.client.post(reverse('login'), {'email': 'student@gmail.com', 'password': 'password'})
+        return response.data['refresh']
+
+    def refresh(self, token):
+        return self.client.post(reverse('token_refresh'), {'refresh': token})
+
+    @mock.patch('Users.tokens.is_shared_cache', return_value=True)
+    @override_settings(TOKEN_REVOCATION={**settings.TOKEN_REVOCATION, 'SYNC_INTERVAL': 3600})
+    def test_rotation_revokes_old_token(self, is_shared_cache):
+        old = self.login()
+        self.refresh(self.login())
+        # The active user check, then the revocation: the users, the two INSERTs and
+        # the ID of the outstanding row, in a transaction
+        with self.assertNumQueries(7):
+            response = self.refresh(old)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        self.assertEqual(self.refresh(old).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, status.HTTP_200_OK)
+
+    def test_revocation_found_without_cache(self):
+        old = self.login()
+        self.refresh(old)
+        token_writes.flush()
+        self.assertEqual(BlacklistedToken.objects.filter(token__jti=RefreshToken(old, verify=False)['jti']).count(), 1)
+
+        caches['default'].clear()
+        revocations.clear()
+        self.assertEqual(self.refresh(old).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout(self):
+        token = self.login()
+        response = self.client.post(reverse('logout'), {'refresh': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_batched_writes_and_pruning(self):
+        tokens = [self.login() for _ in range(3)]
+        for token in tokens:
+            self.refresh(token)
+        # The revoked tokens are written at once, the new ones are buffered
+        self.assertEqual(OutstandingToken.objects.count(), 3)
+        self.assertEqual(BlacklistedToken.objects.count(), 3)
+        # The users and the bulk INSERT, in a transaction
+        with self.assertNumQueries(4):
+            self.assertEqual(token_writes.flush(), 3)
+        self.assertEqual(OutstandingToken.objects.count(), 6)
+        self.assertEqual(BlacklistedToken.objects.count(), 3)
+
+        OutstandingToken.objects.filter(jti__in=[RefreshToken(token, verify=False)['jti'] for token in tokens]).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(prune_expired_tokens(batch_size=2), 3)
+        self.assertEqual(OutstandingToken.objects.count(), 3)
+        self.assertEqual(BlacklistedToken.objects.count(), 0)
+
+    def test_revocation_seen_by_other_workers(self):
+        token = self.login()
+        self.client.post(reverse('logout'), {'refresh': token})
+        # Another worker, with its own LocMem cache and Bloom filters
+        caches['default'].clear()
+        revocations.clear()
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_failed_flush_keeps_rows(self):
+        self.login()
+        with mock.patch.object(OutstandingToken.objects, 'bulk_create', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                token_writes.flush()
+        self.assertEqual(token_writes.flush(), 1)
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000)
+        items = [f'token-{i}' for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    @mock.patch('Users.tokens.is_shared_cache', return_value=True)
+    @override_settings(TOKEN_REVOCATION={**settings.TOKEN_REVOCATION, 'BLOOM_CAPACITY': 1000, 'SYNC_INTERVAL': 3600})
+    def test_bloom_filters_loaded_outside_lock(self, is_shared_cache):
+        revoked, other = self.login(), self.login()
+        self.client.post(reverse('logout'), {'refresh': revoked})
+        # A worker started after the revocation, with the cache emptied
+        caches['default'].clear()
+        revocations.clear()
+        add = BloomFilter.add
+        locked = []
+
+        def add_and_check(bloom, item):
+            locked.append(revocations._lock.locked())
+            add(bloom, item)
+
+        with mock.patch.object(BloomFilter, 'add', add_and_check):
+            self.assertIn(RefreshToken(revoked, verify=False), revocations)
+        self.assertEqual(locked, [False])
+        with self.assertNumQueries(0):
+            self.assertNotIn(RefreshToken(other, verify=False), revocations)
+
+
+# The simplejwt serializers keep the api_settings of the start, overriding SIMPLE_JWT does not reach them
+@mock.patch.object(simplejwt_serializers.api_settings, 'UPDATE_LAST_LOGIN', False)
+# The timer thread would write with its own connection, outside the transaction of the test
+@override_settings(LAST_LOGIN={**settings.LAST_LOGIN, 'BUFFERED': True, 'BATCH_SIZE': 3, 'FLUSH_TIMER': False})
+class BufferedLastLoginTestCase(APITestCase):
+
+    def setUp(self):
+        last_logins.clear()
+        self.users = [
+            User.objects.create_user(
+                first_name='student',
+                last_name='test',
+                email=f'student{i}@gmail.com',
+                password='password',
+                rol='Estudiante'
+            )
+            for i in range(3)
+        ]
+
+    def tearDown(self):
+        last_logins.clear()
+
+    def login(self, user):
+        return self.client.post(reverse('login'), {'email': user.email, 'password': 'password'})
+
+    def test_login_does_not_update_user(self):
+        with self.assertNumQueries(1):
+            response = self.login(self.users[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.users[0].refresh_from_db()
+        self.assertIsNone(self.users[0].last_login)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(last_logins.flush(), 1)
+        self.users[0].refresh_from_db()
+        self.assertIsNotNone(self.users[0].last_login)
+
+    def test_batch_written_when_full(self):
+        for user in self.users[:2]:
+            self.login(user)
+        self.assertFalse(User.objects.filter(last_login__isnull=False).exists())
+        self.login(self.users[2])
+        self.assertEqual(User.objects.filter(last_login__isnull=False).count(), 3)
+        self.assertEqual(last_logins.flush(), 0)
+
+    def test_later_login_kept(self):
+        now = timezone.now()
+        User.objects.filter(pk=self.users[0].pk).update(last_login=now)
+        last_logins.add(self.users[0], now - timedelta(minutes=1))
+        last_logins.add(self.users[1], now - timedelta(minutes=2))
+        last_logins.add(self.users[1], now - timedelta(minutes=3))
+        last_logins.flush()
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).last_login, now)
+        self.assertEqual(User.objects.get(pk=self.users[1].pk).last_login, now - timedelta(minutes=2))
+
+    @override_settings(LAST_LOGIN={**settings.LAST_LOGIN, 'BUFFERED': True, 'FLUSH_INTERVAL': 0, 'FLUSH_TIMER': False})
+    def test_written_after_request(self):
+        self.login(self.users[0])
+        self.client.get(reverse('retrieve_user_info', args=[self.users[0].pk]))
+        self.assertFalse(User.objects.filter(last_login__isnull=True, pk=self.users[0].pk).exists())
+
+    @override_settings(LAST_LOGIN={**settings.LAST_LOGIN, 'FLUSH_INTERVAL': 0.05, 'FLUSH_TIMER': True})
+    def test_written_by_timer_without_requests(self):
+        buffer = LastLoginBuffer()
+        flushed = threading.Event()
+        with mock.patch.object(buffer, 'flush', side_effect=lambda: (buffer.clear(), flushed.set())):
+            buffer.add(self.users[0])
+            timer = buffer._timer
+            self.assertTrue(flushed.wait(5))
+            timer.join(5)
+        # The thread stops once nothing is waiting
+        self.assertFalse(timer.is_alive())
+        self.assertIsNone(buffer._timer)
+
+    def test_failed_flush_keeps_times(self):
+        now = timezone.now()
+        last_logins.add(self.users[0], now - timedelta(minutes=2))
+        with mock.patch.object(User.objects, 'filter', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            last_logins.flush()
+        last_logins.add(self.users[0], now - timedelta(minutes=3))
+        last_logins.add(self.users[1], now)
+        self.assertEqual(last_logins.flush(), 2)
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).last_login, now - timedelta(minutes=2))
+
+
+@override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'PBKDF2_ITERATIONS': 1000})
+class PasswordHashingTestCase(UserFixturesMixin, APITestCase):
+
+    def tearDown(self):
+        token_writes.clear()
+
+    def login(self, name='login', password='password'):
+        return self.client.post(reverse(name), {'email': 'student@gmail.com', 'password': password}, format='json')
+
+    def test_rehash_on_login_when_parameters_change(self):
+        self.assertIn('$1000$', self.student_user.password)
+        with override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'PBKDF2_ITERATIONS': 2000}):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.student_user.refresh_from_db()
+        self.assertIn('$2000$', self.student_user.password)
+        self.assertEqual(self.login(password='wrong').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(PASSWORD_HASHERS=['Users.hashers.ScryptPasswordHasher', 'Users.hashers.PBKDF2PasswordHasher'])
+    def test_rehash_on_login_when_hasher_changes(self):
+        with override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'SCRYPT_WORK_FACTOR': 2 ** 10}):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+            self.student_user.refresh_from_db()
+            self.assertTrue(self.student_user.password.startswith('scrypt$'))
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    @skipUnless(importlib.util.find_spec('argon2'), 'argon2-cffi is not installed')
+    @override_settings(PASSWORD_HASHERS=['Users.hashers.Argon2PasswordHasher', 'Users.hashers.PBKDF2PasswordHasher'])
+    def test_argon2(self):
+        with override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'ARGON2_MEMORY_COST': 1024, 'ARGON2_PARALLELISM': 1}):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+            self.student_user.refresh_from_db()
+            self.assertTrue(self.student_user.password.startswith('argon2$argon2id$v=19$m=1024,t=2,p=1$'))
+            self.assertEqual(self.login('login_async').status_code, status.HTTP_200_OK)
+
+    def test_login_async(self):
+        response = self.login('login_async')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.json()['access'])['email'], 'student@gmail.com')
+        self.assertEqual(self.client.post(reverse('token_refresh'), {'refresh': response.json()['refresh']}).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.login('login_async', password='wrong').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('login_async'), {'email': 'other@gmail.com', 'password': 'password'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('login_async'), {'email': 'student@gmail.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.json())
+
+        with override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'PBKDF2_ITERATIONS': 2000}):
+            self.assertEqual(self.login('login_async').status_code, status.HTTP_200_OK)
+        self.student_user.refresh_from_db()
+        self.assertIn('$2000$', self.student_user.password)
+
+    def test_update_password_checks_in_hashing_pool(self):
+        self.client.force_authenticate(user=self.student_user)
+        with mock.patch('Users.models.verify_password', wraps=verify_password) as verify:
+            response = self.client.put(
+                reverse('update_password', args=[self.student_user.pk]),
+                {'current_password': 'password', 'new_password': 'a-new-password', 'confirm_new_password': 'a-new-password'},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        verify.assert_called_once()
+        self.student_user.refresh_from_db()
+        self.assertTrue(self.student_user.check_password('a-new-password'))
+
+    def test_hashing_pool(self):
+        thread_name = lambda: threading.current_thread().name
+        self.assertTrue(hashing_pool.run(thread_name).startswith('hashing'))
+        with override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'WORKERS': 0}):
+            self.assertEqual(hashing_pool.run(thread_name), threading.current_thread().name)
+
+
+@override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'PBKDF2_ITERATIONS': 1000})
+class UserProvisioningTestCase(UserFixturesMixin, APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            first_name='admin',
+            last_name='test',
+            email='admin@gmail.com',
+            password='password',
+            rol='Profesor',
+            is_staff=True
+        )
+        self.roster = (
+            'first_name,last_name,email,rol,password\n'
+            'Ana,Perez,ana@gmail.com,Estudiante,kx8-Tulip-41\n'
+            'Luis,Gomez,not-an-email,Estudiante,kx8-Tulip-42\n'
+            'Eva,Diaz,eva@gmail.com,Decano,kx8-Tulip-43\n'
+            'Ana,Perez,ana@gmail.com,Estudiante,kx8-Tulip-44\n'
+            'Old,Student,student@gmail.com,Estudiante,kx8-Tulip-45\n'
+            'Juan,Ruiz,juan@GMAIL.COM,Profesor,\n'
+            'Weak,Password,weak@gmail.com,Estudiante,password1\n'
+        )
+
+    def test_provision_endpoint(self):
+        upload = lambda: SimpleUploadedFile('roster.csv', self.roster.encode())
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.post(reverse('provision'), {'file': upload()})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(reverse('provision'), {'file': upload()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['error_count'], 3)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4, 8])
+        self.assertIn('email', response.data['errors'][0]['errors'])
+        self.assertIn('rol', response.data['errors'][1]['errors'])
+        self.assertIn('password', response.data['errors'][2]['errors'])
+        self.assertEqual(response.data['duplicate_count'], 2)
+        self.assertEqual(response.data['duplicates'], [{'row': 5, 'email': 'ana@gmail.com'}, {'row': 6, 'email': 'student@gmail.com'}])
+
+        self.assertTrue(User.objects.get(email='ana@gmail.com').check_password('kx8-Tulip-41'))
+        self.assertFalse(User.objects.get(email='juan@gmail.com').has_usable_password())
+        self.assertTrue(User.objects.get(email='student@gmail.com').check_password('password'))
+        self.client.force_authenticate(user=None)
+        response = self.client.post(reverse('login'), {'email': 'ana@gmail.com', 'password': 'kx8-Tulip-41'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_batches(self):
+        rows = [
+            (number, {'first_name': 'student', 'last_name': str(number), 'email': f'student{number}@gmail.com', 'rol': 'Estudiante', 'password': 'kx8-Tulip-40'})
+            for number in range(2, 7)
+        ]
+        # The taken emails, the INSERT and the check of the created accounts of each batch
+        with self.assertNumQueries(9):
+            report = UserProvisioner(batch_size=2, workers=0).run(rows)
+        self.assertEqual(report['created'], 5)
+        self.assertEqual(User.objects.filter(email__startswith='student', rol='Estudiante').count(), 6)
+
+    def test_accounts_created_meanwhile_are_duplicates(self):
+        rows = [
+            (number, {'first_name': 'student', 'last_name': str(number), 'email': f'student{number}@gmail.com', 'rol': 'Estudiante', 'password': 'kx8-Tulip-40'})
+            for number in range(2, 5)
+        ]
+        hash_passwords = UserProvisioner.hash_passwords
+
+        def hash_and_sign_up(provisioner, passwords):
+            # users/create takes an email between the lookup and the INSERT
+            User.objects.create_user(first_name='other', last_name='user', email='student3@gmail.com', password='other', rol='Estudiante')
+            return hash_passwords(provisioner, passwords)
+
+        with mock.patch.object(UserProvisioner, 'hash_passwords', hash_and_sign_up):
+            report = UserProvisioner(workers=0).run(rows)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(report['duplicates'], [{'row': 3, 'email': 'student3@gmail.com'}])
+        self.assertTrue(User.objects.get(email='student3@gmail.com').check_password('other'))
+
+    def test_provision_endpoint_rejects_other_encodings(self):
+        self.client.force_authenticate(user=self.admin)
+        upload = SimpleUploadedFile('roster.csv', self.roster.replace('Perez', 'Pérez').encode('latin-1'))
+        response = self.client.post(reverse('provision'), {'file': upload})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file', response.data)
+        self.assertFalse(User.objects.filter(email='ana@gmail.com').exists())
+
+    @override_settings(PROVISIONING={'MAX_WEB_ROWS': 6})
+    def test_provision_endpoint_rejects_large_rosters(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(reverse('provision'), {'file': SimpleUploadedFile('roster.csv', self.roster.encode())})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('provision_users', response.data['file'][0])
+        self.assertFalse(User.objects.filter(email='ana@gmail.com').exists())
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.roster)
+        try:
+            out, err = io.StringIO(), io.StringIO()
+            call_command('provision_users', file.name, '--workers', '0', stdout=out, stderr=err)
+        finally:
+            os.remove(file.name)
+        self.assertTrue(User.objects.filter(email='ana@gmail.com').exists())
+        self.assertIn('2 accounts created, 2 duplicates, 3 invalid rows', out.getvalue())
+        self.assertIn('row 6: student@gmail.com already exists', err.getvalue())
@@ -0,0 +1,391 @@
+import atexit
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.connection import ConnectionProxy
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+from lab1_pi2.cache import is_shared_cache
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+# Revoked tokens are grouped by the hour they expire, expired groups are dropped
+BUCKET_SECONDS = 3600
+
+
+class BloomFilter:
+    """
+    Set of strings answering "maybe present" or "surely absent" in a fixed amount of memory.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Args:
+            capacity (int): Number of items expected.
+            error_rate (float): Rate of false "maybe present" answers at capacity.
+        """
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    def update(self, other):
+        """
+        Add the items of a Bloom filter of the same size and number of hashes.
+        """
+        bits = int.from_bytes(self.bits, 'little') | int.from_bytes(other.bits, 'little')
+        self.bits = bytearray(bits.to_bytes(len(self.bits), 'little'))
+
+
+class RevocationSet:
+    """
+    Revoked refresh tokens of every worker, checked without querying the database.
+
+    A revoked token is written at once to the blacklist table and to the shared cache, with
+    the remaining lifetime of the token as timeout, so every worker sees it in its next check.
+    Each process also keeps Bloom filters of the blacklist table, synchronized with its new
+    rows every SYNC_INTERVAL seconds, so tokens missing from the cache (e.g. after a restart
+    of Redis) are still found. The table is only queried when a Bloom filter answers "maybe".
+
+    With a cache local to each process (LocMem), a revocation in another worker is neither in
+    the cache nor yet in the Bloom filters, so every check queries the table instead.
+
+    The first synchronization fills new Bloom filters without holding the lock, checking with
+    the table meanwhile, then swaps them in.
+    """
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+        self.cache = ConnectionProxy(caches, cache_alias)
+        self.buckets = {}
+        self.last_id = None
+        self.last_sync = 0
+        self._syncing = False
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def cache_key(self, jti):
+        return f'revoked:{jti}'
+
+    def bucket(self, exp, buckets=None):
+        """
+        Get the Bloom filter of the tokens expiring in the same hour as exp, creating it if missing.
+
+        Args:
+            exp (float): The expiration timestamp of the token.
+            buckets (dict, optional): The Bloom filters to look in, those of this process by default.
+        """
+        buckets = self.buckets if buckets is None else buckets
+        key = int(exp) // BUCKET_SECONDS
+        bloom = buckets.get(key)
+        if bloom is None:
+            config = settings.TOKEN_REVOCATION
+            bloom = buckets[key] = BloomFilter(config['BLOOM_CAPACITY'], config['BLOOM_ERROR_RATE'])
+        return bloom
+
+    def add(self, jti, exp):
+        """
+        Record a revoked token in the shared cache and in the Bloom filters of this process.
+
+        Args:
+            jti (str): The ID of the token.
+            exp (int): The expiration timestamp of the token.
+        """
+        timeout = int(exp - time.time())
+        if timeout > 0:
+            self.cache.set(self.cache_key(jti), True, timeout)
+        with self._lock:
+            self.bucket(exp).add(jti)
+
+    def sync(self):
+        """
+        Add the rows of the blacklist table created since the last synchronization to the Bloom filters.
+
+        The first synchronization reads the rows of the tokens not expired yet into new Bloom
+        filters, outside the lock, and merges them with the revocations added meanwhile. Only
+        one thread synchronizes at a time, the others keep checking with the current filters,
+        or with the table until the first synchronization ends.
+        """
+        now = time.time()
+        with self._lock:
+            if self._syncing or now - self.last_sync < settings.TOKEN_REVOCATION['SYNC_INTERVAL']:
+                return
+            self.last_sync = now
+            self._syncing = True
+            last_id, generation = self.last_id, self._generation
+        first = last_id is None
+        try:
+            queryset = BlacklistedToken.objects.order_by('id')
+            if first:
+                queryset = queryset.filter(token__expires_at__gt=aware_utcnow())
+            else:
+                queryset = queryset.filter(id__gt=last_id)
+            rows = queryset.values_list('id', 'token__jti', 'token__expires_at').iterator(chunk_size=10000)
+            if first:
+                loaded = {}
+                for row_id, jti, expires_at in rows:
+                    self.bucket(expires_at.timestamp(), loaded).add(jti)
+                    last_id = max(last_id or 0, row_id)
+            else:
+                # The rows since the last synchronization, added under the lock
+                rows = list(rows)
+            with self._lock:
+                if generation != self._generation:
+                    return
+                if first:
+                    for key, bloom in loaded.items():
+                        if key in self.buckets:
+                            bloom.update(self.buckets[key])
+                        self.buckets[key] = bloom
+                else:
+                    for row_id, jti, expires_at in rows:
+                        self.bucket(expires_at.timestamp()).add(jti)
+                        last_id = max(last_id, row_id)
+                self.last_id = last_id or 0
+                # Tokens of past buckets are expired and fail verification anyway
+                current = int(now) // BUCKET_SECONDS
+                for key in [key for key in self.buckets if key < current]:
+                    del self.buckets[key]
+        finally:
+            with self._lock:
+                self._syncing = False
+
+    def __contains__(self, token):
+        """
+        Check if a token is revoked.
+
+        Args:
+            token (Token): The token, with its jti and exp claims.
+
+        Returns:
+            bool: True if the token is revoked.
+        """
+        jti, exp = token[api_settings.JTI_CLAIM], token['exp']
+        if self.cache.get(self.cache_key(jti)):
+            return True
+        if not is_shared_cache(self.cache_alias):
+            return BlacklistedToken.objects.filter(token__jti=jti).exists()
+        self.sync()
+        with self._lock:
+            # Until the first synchronization ends, the Bloom filters may miss older revocations
+            maybe = self.last_id is None or jti in self.bucket(exp)
+        return maybe and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def clear(self):
+        """
+        Forget the Bloom filters of this process, they are read again on the next check.
+        """
+        with self._lock:
+            self.buckets.clear()
+            self.last_id = None
+            self.last_sync = 0
+            self._generation += 1
+
+
+class TokenWriteBuffer:
+    """
+    Outstanding token rows waiting to be written in batches.
+
+    Issuing a refresh token writes its outstanding row, which is not needed to answer the
+    request. The rows are written with a few bulk INSERTs once BATCH_SIZE are waiting or the
+    oldest has waited FLUSH_INTERVAL seconds (checked at the end of each request), on exit,
+    and by prune_tokens. Revocations are not buffered: write_blacklisted writes them at once
+    with the outstanding row of the token, so they survive a crash of the worker. Expired
+    tokens are deleted from the tables every PRUNE_INTERVAL seconds by one of the workers.
+    """
+    def __init__(self):
+        self.outstanding = {}
+        self.oldest = None
+        self.last_prune = time.monotonic()
+        self._lock = threading.Lock()
+
+    def row(self, token):
+        return {
+            'user_id': token.get(api_settings.USER_ID_CLAIM),
+            'token': str(token),
+            'created_at': token.current_time,
+            'expires_at': datetime_from_epoch(token['exp']),
+        }
+
+    def add_outstanding(self, token):
+        """
+        Buffer the outstanding row of a refresh token.
+
+        Args:
+            token (Token): The token.
+        """
+        with self._lock:
+            self.outstanding[token[api_settings.JTI_CLAIM]] = self.row(token)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            full = len(self.outstanding) >= settings.TOKEN_REVOCATION['BATCH_SIZE']
+        if full:
+            self.flush()
+
+    def write_blacklisted(self, token):
+        """
+        Write the outstanding and blacklisted rows of a revoked refresh token at once.
+
+        Args:
+            token (Token): The token.
+        """
+        jti = token[api_settings.JTI_CLAIM]
+        with self._lock:
+            row = self.outstanding.pop(jti, None) or self.row(token)
+        self.write({jti: row}, [jti])
+
+    def write(self, rows, blacklisted=()):
+        """
+        Write outstanding rows, and blacklist some of them, in a transaction.
+
+        Args:
+            rows (dict): The rows, by the ID of their token.
+            blacklisted (list): IDs of the tokens to blacklist.
+        """
+        # Tokens of deleted users are kept without user, like OutstandingToken.user on_delete
+        user_ids = {int(row['user_id']) for row in rows.values() if row['user_id'] is not None}
+        existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        with transaction.atomic():
+            OutstandingToken.objects.bulk_create(
+                [
+                    OutstandingToken(
+                        jti=jti,
+                        user_id=int(row['user_id']) if row['user_id'] is not None and int(row['user_id']) in existing else None,
+                        token=row['token'],
+                        created_at=row['created_at'],
+                        expires_at=row['expires_at'],
+                    )
+                    for jti, row in rows.items()
+                ],
+                ignore_conflicts=True,
+            )
+            if blacklisted:
+                token_ids = OutstandingToken.objects.filter(jti__in=list(blacklisted)).order_by().values_list('id', flat=True)
+                BlacklistedToken.objects.bulk_create(
+                    [BlacklistedToken(token_id=token_id) for token_id in token_ids], ignore_conflicts=True
+                )
+
+    def flush(self):
+        """
+        Write the buffered rows. If the write fails they are buffered again, for the next flush.
+
+        Returns:
+            int: The number of tokens written.
+        """
+        with self._lock:
+            outstanding, self.outstanding, self.oldest = self.outstanding, {}, None
+        if not outstanding:
+            return 0
+        try:
+            self.write(outstanding)
+        except Exception:
+            with self._lock:
+                self.outstanding = {**outstanding, **self.outstanding}
+                if self.oldest is None:
+                    self.oldest = time.monotonic()
+            raise
+        return len(outstanding)
+
+    def flush_if_due(self):
+        """
+        Write the buffered rows if the oldest one has waited FLUSH_INTERVAL seconds,
+        and prune the expired tokens if PRUNE_INTERVAL seconds have passed.
+        """
+        config = settings.TOKEN_REVOCATION
+        now = time.monotonic()
+        if self.oldest is not None and now - self.oldest >= config['FLUSH_INTERVAL']:
+            self.flush()
+        if now - self.last_prune >= config['PRUNE_INTERVAL']:
+            self.last_prune = now
+            # One worker prunes each interval
+            if caches[config['CACHE']].add('tokens:prune', True, config['PRUNE_INTERVAL']):
+                prune_expired_tokens()
+
+    def clear(self):
+        """
+        Drop the buffered rows without writing them.
+        """
+        with self._lock:
+            self.outstanding, self.oldest = {}, None
+
+
+def prune_expired_tokens(batch_size=10000):
+    """
+    Delete the outstanding and blacklisted rows of expired tokens, in batches.
+
+    Args:
+        batch_size (int): Tokens deleted by each pair of DELETEs.
+
+    Returns:
+        int: The number of outstanding tokens deleted.
+    """
+    now = aware_utcnow()
+    deleted = 0
+    while True:
+        token_ids = list(OutstandingToken.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not token_ids:
+            return deleted
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=token_ids).delete()
+            deleted += OutstandingToken.objects.filter(id__in=token_ids).delete()[1].get(OutstandingToken._meta.label, 0)
+
+
+revocations = RevocationSet(settings.TOKEN_REVOCATION['CACHE'])
+token_writes = TokenWriteBuffer()
+
+
+def flush_token_writes():
+    try:
+        token_writes.flush()
+    except Exception:
+        logger.exception('Could not write the buffered token rows')
+
+
+atexit.register(flush_token_writes)
+
+
+class BufferedRefreshToken(RefreshToken):
+    """
+    Refresh token checking revocation with RevocationSet and writing its rows with TokenWriteBuffer.
+
+    Used by login, refresh and logout instead of RefreshToken, whose rotation runs about
+    ten queries: the blacklist lookup, three reads of the user and two get_or_create. The
+    outstanding row of a new token is buffered, the revocation of the old one is written at once.
+    """
+    def check_blacklist(self):
+        if self in revocations:
+            raise TokenError('Token is blacklisted')
+
+    def blacklist(self):
+        token_writes.write_blacklisted(self)
+        revocations.add(self[api_settings.JTI_CLAIM], self['exp'])
+
+    def outstand(self):
+        token_writes.add_outstanding(self)
+
+    @classmethod
+    def for_user(cls, user):
+        # BlacklistMixin.for_user would create the outstanding row right away
+        token = super(BlacklistMixin, cls).for_user(user)
+        token_writes.add_outstanding(token)
+        return token
@@ -8,9 +8,11 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     path('login', MyTokenObtainPairView.as_view(), name='login'),
+    path('login/async', login_async, name='login_async'),
     path('token/refresh', TokenRefreshView.as_view(), name='token_refresh'),
     path('logout', TokenBlacklistView.as_view(), name='logout'),
     path('create', Create.as_view(), name='create'),
+    path('provision', ProvisionUsersView.as_view(), name='provision'),
     path('update/<int:pk>', Update.as_view(), name='update'),
     path('update-password/<int:pk>', UpdatePassword.as_view(), name='update_password'),
     path('retrieve/<int:pk>', RetrieveUserInfo.as_view(), name='retrieve_user_info'),
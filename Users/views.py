@@ -1,10 +1,21 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
 from django.shortcuts import render
-from rest_framework import generics, permissions, status
+from rest_framework import generics, permissions, serializers, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+from lab1_pi2.cache import tiered_cache
+from .hashers import ahash_password
 from .models import User
 from .permissions import IsOwnerPermission
+from .provisioning import UserProvisioner, count_rows, is_utf8, read_roster
 from .serializers import (
     CreateUserSerializer,
     MyTokenObtainPairSerializer,
@@ -20,6 +31,50 @@ class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
 
+async def login_async(request):
+    """
+    Log in like MyTokenObtainPairView, waiting for the password hash without holding a worker thread.
+
+    Served natively when the project runs under lab1_pi2/asgi.py, where the sync views share
+    one thread and a login storm would make them wait on the hashing. Same contract as
+    MyTokenObtainPairView.
+
+    Args:
+        request: The HTTP request object.
+
+    Returns:
+        JsonResponse: The refresh and access tokens.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+    serializer = MyTokenObtainPairSerializer()
+    try:
+        attrs = serializer.to_internal_value(data)
+    except serializers.ValidationError as e:
+        return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+    user = await User.objects.filter(email=attrs['email']).afirst()
+    if user is None:
+        # Hash anyway, like ModelBackend, so unknown emails take as long as wrong passwords
+        await ahash_password(attrs['password'])
+    elif await user.acheck_password(attrs['password']) and api_settings.USER_AUTHENTICATION_RULE(user):
+        return JsonResponse(await sync_to_async(MyTokenObtainPairSerializer.login)(user))
+    return JsonResponse(
+        {'detail': str(serializer.error_messages['no_active_account'])}, status=status.HTTP_401_UNAUTHORIZED
+    )
+
+
+# Authentication is done with the credentials, not with the session cookie
+login_async.csrf_exempt = True
+
+
 class Create(generics.CreateAPIView):
     """
     View for creating a new user.
@@ -45,6 +100,8 @@ class UpdatePassword(generics.UpdateAPIView):
     queryset = User.objects.all()
     lookup_field = 'pk'
     serializer_class = PasswordUpdateSerializer
+    # The current password is checked against request.user, it needs the full model
+    authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsOwnerPermission]
     http_method_names = ['put']
 
@@ -73,3 +130,48 @@ class RetrieveUserInfo(generics.RetrieveAPIView):
     lookup_field = 'pk'
     serializer_class = CreateUserSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerPermission]
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve the user through the two-tier cache, invalidated when the user is saved.
+
+        Only the own user can be retrieved, other IDs get the usual 403/404 without the cache.
+        """
+        pk = self.kwargs['pk']
+        if pk != request.user.id:
+            return super().retrieve(request, *args, **kwargs)
+        data = tiered_cache.get_or_set(
+            f'user:{pk}', [f'user:{pk}'], lambda: dict(self.get_serializer(self.get_object()).data)
+        )
+        return Response(data)
+
+
+class ProvisionUsersView(generics.GenericAPIView):
+    """
+    Create the accounts of a roster CSV. (for admins)
+
+    The file is sent as 'file' in a multipart form, with columns first_name, last_name,
+    email, rol and optionally password. Emails already taken are reported as duplicates.
+    The passwords are hashed in the hashing pool threads, processes are only started by
+    the provision_users command. Rosters of more than PROVISIONING['MAX_WEB_ROWS'] rows
+    are rejected, hashing them would outlast the request, they must be created with the command.
+    """
+    # is_staff is read from the database, never trusted from the token
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        if not is_utf8(upload):
+            return Response({'file': ['The file must be UTF-8 encoded.']}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = settings.PROVISIONING['MAX_WEB_ROWS']
+        if count_rows(upload) > max_rows:
+            return Response(
+                {'file': [f'The roster has more than {max_rows} rows, create its accounts with the provision_users command.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        report = UserProvisioner(processes=False).run(read_roster(upload))
+        return Response(report, status=status.HTTP_200_OK)
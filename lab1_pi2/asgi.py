@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lab1_pi2.settings')
 
 application = get_asgi_application()
+
+from Course.utils import require_llm_provider  # noqa: E402
+from lab1_pi2.cache import require_shared_cache  # noqa: E402
+
+require_shared_cache()
+require_llm_provider()
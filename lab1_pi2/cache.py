@@ -0,0 +1,330 @@
+import functools
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.connection import ConnectionProxy
+
+
+# Cache backends holding a separate copy in each process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache(alias='default'):
+    """
+    Check if every worker process reads and writes the same cache, e.g. Redis.
+
+    Args:
+        alias (str): The alias of the cache in settings.CACHES.
+
+    Returns:
+        bool: False for the in-process backends.
+    """
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Check that the L2 cache of TIERED_CACHE is shared by the worker processes.
+
+    With a cache local to each process, a scope bumped in one worker is never seen by the
+    others, which keep serving their stale payloads and answering 304 to stale ETags.
+    """
+    config = getattr(settings, 'TIERED_CACHE', {})
+    alias = config.get('CACHE', 'default')
+    if is_shared_cache(alias):
+        return []
+    message = f"The cache '{alias}' of TIERED_CACHE is local to each process, its invalidations are not seen by the other workers."
+    hint = 'Set REDIS_URL, or SINGLE_WORKER=True if only one process serves the requests.'
+    if config.get('REQUIRE_SHARED'):
+        return [checks.Error(message, hint=hint, id='lab1_pi2.E001')]
+    return [checks.Warning(message, hint=hint, id='lab1_pi2.W001')]
+
+
+def require_shared_cache():
+    """
+    Stop a server starting with a cache local to each process, see check_shared_cache.
+
+    Called by wsgi.py and asgi.py, as gunicorn and uvicorn do not run the system checks.
+
+    Raises:
+        ImproperlyConfigured: If check_shared_cache finds an error.
+    """
+    errors = [error for error in check_shared_cache(None) if error.is_serious()]
+    if errors:
+        raise ImproperlyConfigured('\n'.join(str(error) for error in errors))
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache with LRU eviction, TTL expiration and hit/miss counters.
+
+    With max_weight, entries are also evicted while the total weight of the values,
+    given by weigh (e.g. their length), is above it, so a few large values can not
+    take the memory that max_size allows for small ones.
+    """
+    def __init__(self, max_size=1024, ttl=None, max_weight=None, weigh=None):
+        """
+        Args:
+            max_size (int): Maximum number of entries kept in the cache.
+            ttl (int, optional): Seconds an entry stays valid. None means no expiration.
+            max_weight (int, optional): Maximum total weight of the values. None means no limit.
+            weigh (callable, optional): Weight of a value, needed with max_weight.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache, marking it as recently used.
+
+        Args:
+            key (str): The key of the entry.
+            default: Value returned when the key is missing or expired.
+
+        Returns:
+            The cached value, or default if not found.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._pop(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Store a value in the cache, evicting the least recently used entries if full.
+
+        A value heavier than max_weight on its own is not stored.
+
+        Args:
+            key (str): The key of the entry.
+            value: The value to store.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        weight = self.weigh(value) if self.max_weight is not None else 0
+        with self._lock:
+            self._pop(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+            self._data[key] = (value, expires, weight)
+            self.weight += weight
+            while len(self._data) > self.max_size or (self.max_weight is not None and self.weight > self.max_weight):
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def delete(self, key):
+        """
+        Remove an entry from the cache if present.
+
+        Args:
+            key (str): The key of the entry.
+        """
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """
+        Remove every entry and reset the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Get the usage counters of the cache.
+
+        Returns:
+            dict: Hits, misses and current size of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+class TwoTierCache:
+    """
+    In-process LRU (L1) in front of a shared Django cache (L2), invalidated by scopes.
+
+    Every entry depends on some scopes, e.g. 'courses' or 'user:3', whose versions are
+    random tokens kept in L2. Entries are stored under their key and the versions of their
+    scopes, so bumping a scope in any worker makes every worker miss its old entries: L1
+    hits only save the transfer of the value, the versions are always read from L2.
+    """
+    def __init__(self, l2, max_size=1024, ttl=60, timeout=300):
+        """
+        Args:
+            l2: Django cache shared by every worker.
+            max_size (int): Maximum number of entries kept in L1.
+            ttl (int): Seconds an entry stays in L1.
+            timeout (int): Seconds an entry stays in L2.
+        """
+        self.l1 = LRUCache(max_size=max_size, ttl=ttl)
+        self.l2 = l2
+        self.timeout = timeout
+
+    def get_versions(self, scopes):
+        """
+        Get the current version of some scopes, creating the missing ones.
+
+        A scope evicted from L2 gets a new version, so it never matches an old entry or ETag.
+
+        Args:
+            scopes (list): The scopes.
+
+        Returns:
+            list: The versions, in the order of scopes.
+        """
+        keys = [f'version:{scope}' for scope in scopes]
+        versions = self.l2.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                self.l2.add(key, uuid.uuid4().hex, None)
+                versions[key] = self.l2.get(key)
+        return [versions[key] for key in keys]
+
+    def bump(self, *scopes):
+        """
+        Invalidate the entries depending on some scopes, in every worker.
+
+        Args:
+            *scopes (str): The scopes.
+        """
+        self.l2.set_many({f'version:{scope}': uuid.uuid4().hex for scope in scopes}, None)
+
+    def get_or_set(self, key, scopes, func, versions=None):
+        """
+        Get a value from L1, then L2, computing and storing it if missing.
+
+        Args:
+            key (str): The key of the value.
+            scopes (list): The scopes the value depends on.
+            func (callable): Computes the value, which must not be None.
+            versions (list, optional): The versions of scopes, if already read.
+
+        Returns:
+            The value.
+        """
+        if versions is None:
+            versions = self.get_versions(scopes)
+        stamp = hashlib.sha1('\n'.join(versions).encode()).hexdigest()[:16]
+        full_key = f'tiered:{key}:{stamp}'
+        value = self.l1.get(full_key)
+        if value is not None:
+            return value
+        value = self.l2.get(full_key)
+        if value is None:
+            value = func()
+            self.l2.set(full_key, value, self.timeout)
+        self.l1.set(full_key, value)
+        return value
+
+    def cached(self, key, scopes):
+        """
+        Decorator caching the result of a function.
+
+        Args:
+            key (callable): Gets the key from the arguments of the function.
+            scopes (callable): Gets the scopes from the arguments of the function.
+
+        Returns:
+            callable: The decorator.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.get_or_set(key(*args, **kwargs), scopes(*args, **kwargs), lambda: func(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def get_queryset(self, key, scopes, queryset):
+        """
+        Get the rows of a queryset through the cache.
+
+        Returns:
+            list: The rows.
+        """
+        return self.get_or_set(key, scopes, lambda: list(queryset))
+
+    def clear(self):
+        """
+        Clear L1. L2 entries expire by themselves or once their scopes are bumped.
+        """
+        self.l1.clear()
+
+
+def get_tiered_cache():
+    """
+    Build the two-tier cache configured in settings.TIERED_CACHE.
+
+    Returns:
+        TwoTierCache: The configured cache.
+    """
+    config = getattr(settings, 'TIERED_CACHE', {})
+    return TwoTierCache(
+        ConnectionProxy(caches, config.get('CACHE', 'default')),
+        max_size=config.get('L1_MAX_SIZE', 1024),
+        ttl=config.get('L1_TTL', 60),
+        timeout=config.get('TIMEOUT', 300),
+    )
+
+
+tiered_cache = get_tiered_cache()
+
+
+def bump_versions(*scopes):
+    """
+    Invalidate the cached values and ETags depending on some scopes.
+
+    Args:
+        *scopes (str): The scopes.
+    """
+    tiered_cache.bump(*scopes)
+
+
+def bump_versions_on_commit(*scopes):
+    """
+    Invalidate the scopes once the current transaction commits, right away outside of one.
+
+    Bumping before the commit lets a concurrent request read the old rows and cache
+    them under the new version, until the timeout of the tiered cache.
+
+    Args:
+        *scopes (str): The scopes.
+    """
+    transaction.on_commit(lambda: bump_versions(*scopes))
+
+
+def get_versions(scopes):
+    """
+    Get the current versions of some scopes, see TwoTierCache.get_versions.
+    """
+    return tiered_cache.get_versions(scopes)
@@ -0,0 +1,228 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.renderers import JSONRenderer
+
+
+class RequestProfile:
+    """
+    Queries and timings of one request.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.start
+
+    def server_timing(self):
+        """
+        Format the profile as the value of a Server-Timing header, in milliseconds.
+        """
+        return (
+            f'db;desc="{self.queries} queries";dur={self.db_time * 1000:.2f}, '
+            f'render;dur={self.render_time * 1000:.2f}, '
+            f'total;dur={self.total_time * 1000:.2f}'
+        )
+
+
+_current_profile = ContextVar('request_profile', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding each query to the profile of the current request.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(connection):
+    """
+    Add record_query to the execute wrappers of a database connection, once.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def install_on_new_connection(sender, connection, **kwargs):
+    install_query_recorder(connection)
+
+
+class EndpointStats:
+    """
+    In-process registry of the queries and timings of each endpoint, by URL name.
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, profile):
+        """
+        Add a finished request to the stats of its endpoint.
+
+        Args:
+            name (str): The URL name of the endpoint.
+            profile (RequestProfile): The profile of the request.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'db_time': 0.0,
+                'render_time': 0.0,
+                'total_time': 0.0,
+                'max_total_time': 0.0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += profile.queries
+            stats['max_queries'] = max(stats['max_queries'], profile.queries)
+            stats['db_time'] += profile.db_time
+            stats['render_time'] += profile.render_time
+            stats['total_time'] += profile.total_time
+            stats['max_total_time'] = max(stats['max_total_time'], profile.total_time)
+
+    def get(self, name):
+        """
+        Get a copy of the stats of an endpoint, or None if it was not requested.
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            return dict(stats) if stats is not None else None
+
+    def snapshot(self):
+        """
+        Get the stats of every endpoint, with averages per request in milliseconds.
+
+        Returns:
+            dict: The stats by URL name.
+        """
+        with self._lock:
+            items = [(name, dict(stats)) for name, stats in self._stats.items()]
+        snapshot = {}
+        for name, stats in items:
+            requests = stats['requests']
+            snapshot[name] = {
+                'requests': requests,
+                'avg_queries': stats['queries'] / requests,
+                'max_queries': stats['max_queries'],
+                'avg_db_ms': stats['db_time'] * 1000 / requests,
+                'avg_render_ms': stats['render_time'] * 1000 / requests,
+                'avg_total_ms': stats['total_time'] * 1000 / requests,
+                'max_total_ms': stats['max_total_time'] * 1000,
+            }
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+class EndpointProfilingMiddleware:
+    """
+    Measure the SQL queries, DB time, render time and total time of every request.
+
+    The measures are added to endpoint_stats under the URL name of the request and,
+    if settings.ENDPOINT_PROFILING['SERVER_TIMING'] is set, sent in a Server-Timing header.
+    Works for sync and async views; queries of the async ORM are counted too since the
+    profile travels with the request context. Streaming responses are measured until
+    their headers are ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'ENDPOINT_PROFILING', {}).get('SERVER_TIMING', False)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        profile.finish()
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            endpoint_stats.record(match.url_name, profile)
+        if self.server_timing:
+            response['Server-Timing'] = profile.server_timing()
+        return response
+
+
+class ProfiledJSONRenderer(JSONRenderer):
+    """
+    JSON renderer adding its time to the render time of the current request.
+
+    Only the encoding of response.data is measured: the views build it with their
+    serializers, so that time is part of the total time and not of this one.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        profile = _current_profile.get()
+        start = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            if profile is not None:
+                profile.render_time += time.perf_counter() - start
+
+
+class QueryBudgetMixin:
+    """
+    Test case mixin failing the test if a request exceeds the query budget of its endpoint.
+
+    Declare the budgets as query_budgets = {'url_name': max_queries}; they are checked
+    on every request made by the test, endpoints without a budget are not checked.
+    """
+    query_budgets = {}
+
+    def setUp(self):
+        super().setUp()
+        endpoint_stats.reset()
+        self.addCleanup(self.assertQueryBudgets)
+
+    def assertQueryBudgets(self):
+        for name, budget in self.query_budgets.items():
+            stats = endpoint_stats.get(name)
+            if stats is not None and stats['max_queries'] > budget:
+                self.fail(f'{name} made {stats["max_queries"]} queries in a request, the budget is {budget}.')
@@ -16,6 +16,7 @@ from pathlib import Path
 
 from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -55,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lab1_pi2.profiling.EndpointProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -112,6 +114,28 @@ DATABASES = {
     'default': dj_database_url.parse(os.environ.get("DATABASE_URL"))
 }
 
+# Shared cache of the workers: Redis if REDIS_URL is set, otherwise a per-process cache
+# (fine for a single worker and for tests)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# In-process LRU (L1) in front of CACHE (L2), see lab1_pi2/cache.py. The versions of
+# the cached lists and ETags live in L2, so with several worker processes it must be
+# shared (REDIS_URL): the system checks fail otherwise, unless SINGLE_WORKER=True
+TIERED_CACHE = {
+    'CACHE': 'default',
+    'L1_MAX_SIZE': 1024,
+    'L1_TTL': 60,
+    'TIMEOUT': 300,
+    'REQUIRE_SHARED': not DEBUG and os.getenv('SINGLE_WORKER') != 'True',
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -130,13 +154,68 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Hasher of new passwords and of the passwords rehashed on login: pbkdf2, argon2
+# (needs argon2-cffi) or scrypt, see Users/hashers.py. Changing the hasher or its
+# parameters rehashes each password on the next login
+PASSWORD_HASHING = {
+    "HASHER": os.getenv('PASSWORD_HASHER', 'pbkdf2'),
+    "PBKDF2_ITERATIONS": int(os.getenv('PBKDF2_ITERATIONS', 390000)),
+    "ARGON2_TIME_COST": int(os.getenv('ARGON2_TIME_COST', 2)),
+    "ARGON2_MEMORY_COST": int(os.getenv('ARGON2_MEMORY_COST', 102400)),  # KiB
+    "ARGON2_PARALLELISM": int(os.getenv('ARGON2_PARALLELISM', 8)),
+    "SCRYPT_WORK_FACTOR": int(os.getenv('SCRYPT_WORK_FACTOR', 2 ** 14)),
+    # Passwords hashed at once by each process, 0 to hash in the request thread
+    "WORKERS": int(os.getenv('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1)),
+}
+
+hashers = {
+    'pbkdf2': 'Users.hashers.PBKDF2PasswordHasher',
+    'argon2': 'Users.hashers.Argon2PasswordHasher',
+    'scrypt': 'Users.hashers.ScryptPasswordHasher',
+}
+if PASSWORD_HASHING['HASHER'] not in hashers:
+    raise ImproperlyConfigured(
+        f"Unknown PASSWORD_HASHER {PASSWORD_HASHING['HASHER']!r}, it must be one of: {', '.join(hashers)}."
+    )
+# The first one hashes, every one verifies
+PASSWORD_HASHERS = [hashers.pop(PASSWORD_HASHING['HASHER']), *hashers.values()]
+
+# Rosters sent to users/provision are hashed inside the request, larger ones must be
+# created with the provision_users command, see Users/provisioning.py
+PROVISIONING = {
+    "MAX_WEB_ROWS": int(os.getenv('PROVISIONING_MAX_WEB_ROWS', 200)),
+}
+
+# Build request.user from the id, email and rol claims of the access token instead of
+# reading the user on every request, see Users/authentication.py
+STATELESS_JWT_AUTH = os.getenv('STATELESS_JWT_AUTH') == 'True'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication'
+        if STATELESS_JWT_AUTH else 'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'lab1_pi2.profiling.ProfiledJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Queries and timings of every endpoint, see lab1_pi2/profiling.py
+ENDPOINT_PROFILING = {
+    'SERVER_TIMING': os.environ.get('SERVER_TIMING', 'True') == 'True',
+}
+
+# Logins write last_login in batches instead of one UPDATE each, see Users/logins.py.
+# Reports may see it FLUSH_INTERVAL seconds late
+LAST_LOGIN = {
+    "BUFFERED": os.getenv('BUFFERED_LAST_LOGIN') == 'True',
+    "BATCH_SIZE": int(os.getenv('LAST_LOGIN_BATCH_SIZE', 500)),
+    "FLUSH_INTERVAL": 30,  # Seconds a login time waits to be written
+    "FLUSH_TIMER": True,  # Also written by a thread, not only at the end of the next request
 }
 
 SIMPLE_JWT = {
@@ -144,7 +223,7 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
-    "UPDATE_LAST_LOGIN": True,
+    "UPDATE_LAST_LOGIN": not LAST_LOGIN["BUFFERED"],
 
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY if DEBUG else os.getenv('SIMPLE_JWT_SINGNING_KEY'),
@@ -163,7 +242,7 @@ SIMPLE_JWT = {
 
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
-    "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_USER_CLASS": "Users.authentication.TokenClaimsUser",
 
     "JTI_CLAIM": "jti",
 
@@ -172,13 +251,130 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
     "TOKEN_OBTAIN_SERIALIZER": "Users.serializers.MyTokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "Users.serializers.MyTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
-    "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
+    "TOKEN_BLACKLIST_SERIALIZER": "Users.serializers.MyTokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
 }
 
+# Every refresh revokes the previous refresh token, so the tokens expiring in the same hour
+# are the ones refreshed in an hour, one REFRESH_TOKEN_LIFETIME earlier: about one per
+# ACCESS_TOKEN_LIFETIME and active session. Each process keeps a Bloom filter per hour of
+# REFRESH_TOKEN_LIFETIME (25 with 1 day) of 1.2 bytes per token at 1% false positives
+token_sessions = int(os.getenv('TOKEN_ACTIVE_SESSIONS', 20000))
+token_refreshes = 3600 / SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+
+# Revocation checks and batched writes of the refresh tokens, see Users/tokens.py
+TOKEN_REVOCATION = {
+    "CACHE": "default",
+    "BATCH_SIZE": int(os.getenv('TOKEN_BATCH_SIZE', 200)),
+    "FLUSH_INTERVAL": 5,  # Seconds a token row waits to be written
+    "SYNC_INTERVAL": 1,  # Seconds between reads of the new blacklist rows
+    "PRUNE_INTERVAL": 3600,  # Seconds between deletions of the expired tokens
+    # Revoked tokens expiring in the same hour
+    "BLOOM_CAPACITY": int(os.getenv('TOKEN_BLOOM_CAPACITY', 0)) or int(token_sessions * token_refreshes),
+    "BLOOM_ERROR_RATE": 0.01,
+}
+
+# Language model used by the chat. Set LLM_BACKEND=stub to answer offline with a
+# deterministic local stub (tests, benchmarks). Without DEBUG_MODE the system checks,
+# and the server, fail if the backend cannot be built, e.g. without GOOGLE_AI_API_KEY
+if os.getenv('LLM_BACKEND') == 'stub':
+    LLM_PROVIDER = {
+        "BACKEND": "Course.utils.StubProvider",
+        "OPTIONS": {
+            "latency": float(os.getenv('LLM_STUB_LATENCY', 0)),
+        },
+    }
+else:
+    LLM_PROVIDER = {
+        "BACKEND": "Course.utils.GoogleAIProvider",
+        "OPTIONS": {
+            "api_key": os.getenv('GOOGLE_AI_API_KEY'),
+            "model": os.getenv('GOOGLE_AI_MODEL', 'gemini-pro'),
+        },
+        "REQUIRED": not DEBUG,
+    }
+
+# Course contexts are split in chunks and only the TOP_K most relevant to a
+# question are sent to the model
+COURSE_CONTEXT_MAX_WORDS = 200000
+COURSE_RETRIEVAL = {
+    "CHUNK_WORDS": 120,
+    "OVERLAP_WORDS": 20,
+    "TOP_K": 4,
+}
+
+# Full-text search of courses: tsvector and GIN indexes on Postgres, FTS5 on SQLite
+COURSE_SEARCH = {
+    "CONFIG": os.getenv('COURSE_SEARCH_CONFIG', 'simple'),  # Postgres text search configuration
+    "MAX_TERMS": 8,
+    "MAX_CANDIDATES": 5000,  # Newest matches ranked, see Course/search.py
+    "TYPEAHEAD_LIMIT": 10,
+    "TYPEAHEAD_MIN_LENGTH": 2,
+    "TYPEAHEAD_MAX_CANDIDATES": 1000,
+}
+
+# Cache of chat answers, keyed on the course context and the normalized question
+ANSWER_CACHE = {
+    "BACKEND": "Course.cache.LRUCache",
+    "OPTIONS": {
+        "max_size": int(os.getenv('ANSWER_CACHE_SIZE', 2048)),
+        "ttl": int(os.getenv('ANSWER_CACHE_TTL', 3600)),
+    },
+}
+
+# Prompt prefixes ("name: context") of the courses kept in each worker, at most MAX_SIZE
+# courses and MAX_CHARS characters of prefixes, as a context can be very long
+PROMPT_CACHE = {
+    "MAX_SIZE": int(os.getenv('PROMPT_CACHE_SIZE', 256)),
+    "MAX_CHARS": int(os.getenv('PROMPT_CACHE_MAX_CHARS', 64 * 1024 * 1024)),
+}
+
+# Reuse the answer of an already answered question when a new one is similar enough
+SEMANTIC_CACHE = {
+    "ENABLED": os.getenv('SEMANTIC_CACHE_ENABLED') == 'True',
+    "THRESHOLD": float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85)),
+    "MAX_SIZE": 1000,
+    "MAX_COURSES": 100,
+    "DIMENSIONS": 1024,
+    # Seconds an answer is reused, "python manage.py prune_question_answers" deletes the older ones
+    "MAX_AGE": int(os.getenv('SEMANTIC_CACHE_MAX_AGE', 30 * 24 * 3600)),
+}
+
+# Limits of the questions asked to the chat. USER and COURSE are token buckets
+# (RATE tokens per second, up to BURST), CONCURRENCY bounds the calls to the model
+# running at once in every worker and the calls waiting for one to finish
+CHAT_LIMITS = {
+    "USER": {"RATE": 0.2, "BURST": 10},
+    "COURSE": {"RATE": 5, "BURST": 60},
+    "CONCURRENCY": {"LIMIT": 16, "QUEUE_SIZE": 64, "QUEUE_TIMEOUT": 15},
+}
+
+# Questions sent with ?mode=job are queued and answered by a pool of worker threads, run
+# apart with "python manage.py run_chat_workers". With RUN_IN_PROCESS every web worker
+# starts its own pool polling the database instead (only for a single process). Job
+# requests wait at most MAX_WAIT seconds for the answer, then clients poll again.
+# COURSE_PRIORITY maps course ids to priorities
+CHAT_JOBS = {
+    "RUN_IN_PROCESS": os.getenv('CHAT_JOBS_IN_PROCESS') == 'True',
+    "WORKERS": int(os.getenv('CHAT_JOBS_WORKERS', 4)),
+    "POLL_INTERVAL": 0.5,
+    "MAX_WAIT": 5,
+    "JOB_TIMEOUT": 300,
+    "COURSE_PRIORITY": {},
+}
+
+# Identical questions asked at the same time share a single call to the model.
+# Locks and results are kept in this cache, shared by every worker
+SINGLE_FLIGHT = {
+    "CACHE": "default",
+    "LOCK_TIMEOUT": 60,
+    "RESULT_TIMEOUT": 10,
+    "POLL_INTERVAL": 0.05,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
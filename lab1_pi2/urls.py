@@ -21,6 +21,8 @@ from django.urls import re_path
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from .views import EndpointStatsView
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Snippets API",
@@ -37,6 +39,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('course/', include('Course.urls')),
     path('users/', include('Users.urls')),
+    path('stats/endpoints', EndpointStatsView.as_view(), name='endpoint_stats'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
@@ -0,0 +1,17 @@
+from rest_framework import generics, permissions
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .profiling import endpoint_stats
+
+
+class EndpointStatsView(generics.GenericAPIView):
+    """
+    Queries and timings of every endpoint served by this process. (for admins)
+    """
+    # is_staff is read from the database, never trusted from the token
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(endpoint_stats.snapshot())